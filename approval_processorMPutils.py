@@ -26,7 +26,8 @@ import re
 VIRTUALENV_ACTIVATOR = "/home/alexander.pace/emfollow_gracedb/cometenv/bin/activate_this.py" ### FIXME: this shouldn't be hard coded like this. 
                                                                                              ### If we need a virtual environment, it should be distributed along with the package.
                                                                                              ### That way, it is straightforward to install and run the code from *any* computer withour modifying the source code
-execfile(VIRTUALENV_ACTIVATOR, dict(__file__=VIRTUALENV_ACTIVATOR))
+if os.path.exists(VIRTUALENV_ACTIVATOR): ### only present on the production machine; offline replays (test/replay) run without it
+    execfile(VIRTUALENV_ACTIVATOR, dict(__file__=VIRTUALENV_ACTIVATOR))
 
 #--------------------
 # Definitions of which checks must be satisfied in each state before moving on
@@ -40,7 +41,7 @@ new_to_preliminary = [
     ]
 
 # main checks when currentstate of event is preliminary_to_initial
-# will add human signoff and advocate checks later in parseAlert after reading config file
+# human signoff and advocate checks are added by compileChecks depending on the config file
 preliminary_to_initial = [
     'farCheck',
     'labelCheck',
@@ -55,9 +56,272 @@ initial_to_update = [
     'have_lvem_skymapCheck'
     ]
 
+# the label we apply once an event passes every check in these states
+readyLabels = {
+    'preliminary_to_initial' : 'EM_READY',
+    'initial_to_update'      : 'PE_READY',
+    }
+
+#--------------------
+# Compiled checks
+#--------------------
+
+def compileCheck(Check):
+    '''
+    returns a function that runs the EventDict method named Check on an event_dict and returns its recorded result (event_dict.data[Check+'result'])
+    the method is only run if one of the fields it reads (see checkInputs) changed since it last ran. Otherwise we return the result it recorded then
+    '''
+    method = getattr(EventDict, Check)
+    resultkey = Check + 'result'
+    def check(event_dict):
+        data = event_dict.data
+        if data.isStale(Check):
+            method(event_dict)
+            data.markFresh(Check) ### anything the check itself wrote does not make it stale
+        return data[resultkey]
+    check.__name__ = Check
+    return check
+
+global checkRegistries # (humanscimons, advocates) -> {currentstate: [(Check, check), ...]}
+checkRegistries = {}
+
+global checkSettings # the Settings the results recorded in event_dicts were computed under
+checkSettings = None
+
+def compileChecks(settings):
+    '''
+    returns the checks to run in each state as {currentstate: [(Check, check), ...]}, where check(event_dict) returns the result of Check.
+    these only depend on whether we wait for human signoffs, so they are built once for each such configuration rather than for each alert.
+    whenever the childConfig is re-read (we get a different Settings) every check becomes stale, since the thresholds they compare against may have changed
+    '''
+    global checkSettings
+    if settings is not checkSettings:
+        if checkSettings is not None:
+            for data in eventDictionaries.values():
+                data.markStale()
+        checkSettings = settings
+    key = (settings.humanscimons, settings.advocates)
+    if not checkRegistries.has_key(key):
+        checks = {
+            'new_to_preliminary'     : list(new_to_preliminary),
+            'preliminary_to_initial' : list(preliminary_to_initial),
+            'initial_to_update'      : list(initial_to_update),
+        }
+        if settings.humanscimons=='yes':
+            checks['preliminary_to_initial'].append('operator_signoffCheck')
+        if settings.advocates=='yes':
+            checks['preliminary_to_initial'].append('advocate_signoffCheck')
+        checkRegistries[key] = dict((currentstate, [(Check, compileCheck(Check)) for Check in Checks]) for currentstate, Checks in checks.items())
+    return checkRegistries[key]
+
+def runChecks(event_dict, checks, g, config, logger):
+    '''
+    runs checks (see compileChecks) on event_dict in order, for whichever state it is currently in.
+    stops at the first check that fails, moves the event to rejected and (outside of new_to_preliminary) labels it DQV, then returns False
+    returns True if every check passed and None if some are still undecided
+    '''
+    graceid = event_dict.graceid
+    currentstate = event_dict.data['currentstate']
+    passedcheckcount = 0
+    for Check, check in checks:
+        checkresult = check(event_dict)
+        if checkresult==None:
+            pass
+        elif checkresult==False:
+            message = '{0} -- {1} -- Failed {2} in currentstate: {3}.'.format(convertTime(), graceid, Check, currentstate)
+            if loggerCheck(event_dict.data, message)==False:
+                logger.info(message)
+                g.writeLog(graceid, 'AP: Failed {0} in currentstate: {1}.'.format(Check, currentstate), tagname='em_follow')
+            else:
+                pass
+            message = '{0} -- {1} -- State: {2} --> rejected.'.format(convertTime(), graceid, currentstate)
+            if loggerCheck(event_dict.data, message)==False:
+                logger.info(message)
+                g.writeLog(graceid, 'AP: State: {0} --> rejected.'.format(currentstate), tagname='em_follow')
+                event_dict.data['currentstate'] = 'rejected'
+            else:
+                pass
+            if currentstate=='new_to_preliminary': # because in 'new_to_preliminary' state, no need to apply DQV label
+                pass
+            # need to set DQV label so long as it isn't the operator_signoffCheck or advocate_signoffCheck
+            elif 'signoffCheck' in Check:
+                message = '{0} -- {1} -- Not labeling DQV because signoffCheck is separate from explicit data quality checks.'.format(convertTime(), graceid)
+                if loggerCheck(event_dict.data, message)==False:
+                    logger.info(message)
+                    g.writeLog(graceid, 'AP: Not labeling DQV because signoffCheck is separate from explicit data quality checks.', tagname='em_follow')
+                else:
+                    pass
+            else:
+                message = '{0} -- {1} -- Labeling DQV.'.format(convertTime(), graceid)
+                if loggerCheck(event_dict.data, message)==False:
+                    logger.info(message)
+                    g.writeLog(graceid, 'AP: Labeling DQV.', tagname='em_follow')
+                    g.writeLabel(graceid, 'DQV')
+                else:
+                    pass
+            return False
+        elif checkresult==True:
+            passedcheckcount += 1
+            if (Check=='have_lvem_skymapCheck') and (currentstate=='preliminary_to_initial'): # we want to send skymaps out as quickly as possible, even if humans have not vetted the event
+                process_alert(event_dict.data, 'preliminary', g, config, logger) # if it turns out we've sent this alert with this skymap before, the process_alert function will just not send this repeat
+    if passedcheckcount==len(checks):
+        message = '{0} -- {1} -- Passed all {2} checks.'.format(convertTime(), graceid, currentstate)
+        if loggerCheck(event_dict.data, message)==False:
+            logger.info(message)
+            g.writeLog(graceid, 'AP: Passed all {0} checks.'.format(currentstate), tagname='em_follow')
+        else:
+            pass
+        return True
+    return None
+
+#-----------------------------------------------------------------------
+# PipelineThrottles and warm restarts
+#-----------------------------------------------------------------------
+def makePipelineThrottle(t0, group, pipeline, search, settings):
+    '''
+    builds the PipelineThrottle for this node with the parameters from the childConfig (falls back to default_PipelineThrottle)
+    every change to its events is recorded in the ThrottleJournal so that warmStart can restore it
+    '''
+    key = generate_ThrottleKey(group, pipeline, search=search)
+    throttleWin, targetRate, requireManualReset, conf = settings.throttleSettings(key)
+    return PipelineThrottle(t0, eventDictionaries, settings.grouperWin, throttleWin, targetRate, group, pipeline, search=search, requireManualReset=requireManualReset, conf=conf, graceDB_url=settings.client, journal=getThrottleJournal(settings.approval_processorMPfiles))
+
+#-----------------------------------------------------------------------
+# Groupers
+#-----------------------------------------------------------------------
+global grouperIndex # the Groupers that have not decided yet, found through gpsTimeIndex
+grouperIndex = GrouperIndex(gpsTimeIndex)
+
+def addToGrouper(queue, queueByGraceID, graceid, t0, settings):
+    '''
+    adds graceid to the open Grouper whose gpstime is within grouperWin of the event's, creating a Grouper if there is none
+    '''
+    gpstime = gpsTimeIndex.gpstime(graceid)
+    item = grouperIndex.find(gpstime, settings.grouperWin)
+    if item is None:
+        item = Grouper(t0, settings.grouperWin, 'Grouper_{0}'.format(graceid), eventDictionaries, gpstime, maxWait=settings.grouperMaxWait, index=grouperIndex, tables=settings.ranks, graceDB_url=settings.client)
+
+        queue.insert( item ) ### insert it in the overall queue
+
+        newSortedQueue = utils.SortedQueue() ### set up the SortedQueue for queueByGraceID
+        newSortedQueue.insert(item)
+        queueByGraceID[item.graceid] = newSortedQueue
+
+    item.addEvent( graceid ) ### add this graceid to the item
+    return item
+
+__groupedLabels__ = ['EM_Selected', 'EM_Superseded', 'EM_Throttled'] ### labels meaning an event no longer waits on a Grouper
+
+def groupIfUngrouped(queue, queueByGraceID, graceid, t0, event_dict, settings, logger):
+    '''
+    when grouping, a new_to_preliminary event only moves on once a Grouper labels it EM_Selected, but only new alerts add events to Groupers.
+    events rebuilt by trackFromGraceDb (we missed their new alert) and events restored by warmStart (Groupers are not persisted) would wait forever,
+    so we add any such event that is not in a Grouper, was never decided on by one and carries none of __groupedLabels__ to a Grouper now.
+    returns whether we did
+    '''
+    if not settings.grouping or (event_dict.get('currentstate')!='new_to_preliminary'):
+        return False
+    if grouperIndex.members.has_key(graceid) or event_dict.get('groupergroup'):
+        return False
+    labels = event_dict.get('labels') or []
+    for label in __groupedLabels__:
+        if label in labels:
+            return False
+    item = addToGrouper(queue, queueByGraceID, graceid, t0, settings)
+    logger.info('{0} -- {1} -- Added to {2}; this event had not been grouped.'.format(convertTime(), graceid, item.graceid))
+    return True
+
+global warmStarted # whether this instance has already picked up what the previous one persisted
+warmStarted = False
+
+def warmStart(queue, queueByGraceID, t0, settings, client, config, logger):
+    '''
+    rebuilds the state of a previous instance from approval_processorMPfiles instead of re-querying GraceDb for every event
+
+    every event_dict that was heard from within warmstart_horizon seconds of t0 gets its EventDict and ForgetMeNow back,
+    expiring when it would have without the restart. older (or already forgotten) event_dicts are loaded into eventDictionaries
+    but not tracked, so the next alert for them rebuilds them from GraceDb as before.
+    PipelineThrottles are rebuilt from the ThrottleJournal, without labeling anything in GraceDb a second time.
+
+    warmstart_horizon = 0 (the default) turns this off; we then start from scratch and the old ThrottleJournal is discarded.
+    '''
+    approval_processorMPfiles = settings.approval_processorMPfiles
+    horizon = settings.warmstart_horizon
+
+    throttleJournal = getThrottleJournal(approval_processorMPfiles)
+    throttles = throttleJournal.state
+    throttleJournal.clear() ### the throttles we restore re-record their events, so we start the journal over
+    if horizon <= 0:
+        return
+
+    ### event_dicts
+    loadEventDicts(approval_processorMPfiles)
+    restored = 0
+    for graceid, data in eventDictionaries.items():
+        if not data.get('expirationtime'):
+            continue
+        expiration = float(data['expirationtime'].split(' -- ')[0])
+        lastalert = expiration - settings.forgetmenow_timeout ### ForgetMeNow expires forgetmenow_timeout after the last alert
+        if (expiration <= t0) or (t0 - lastalert > horizon):
+            continue
+
+        event_dict = EventDict()
+        event_dict.restore(data, graceid, client, config, logger)
+        trackEventDict(event_dict)
+
+        item = ForgetMeNow(lastalert, settings.forgetmenow_timeout, graceid, eventDicts, queue, queueByGraceID, logger)
+        queue.insert(item)
+
+        newSortedQueue = utils.SortedQueue()
+        newSortedQueue.insert(item)
+        queueByGraceID[item.graceid] = newSortedQueue
+        restored += 1
+
+        groupIfUngrouped(queue, queueByGraceID, graceid, t0, event_dict.data, settings, logger) ### any Grouper it was waiting on died with the previous instance
+
+    ### PipelineThrottles
+    restoredThrottles = 0
+    for key, ((group, pipeline, search), events) in throttles.items():
+        item = makePipelineThrottle(min(event[1] for event in events), group, pipeline, search, settings)
+        item.restoreEvents(events, t0)
+        if item.complete: ### every event is too old by now
+            continue
+
+        queue.insert(item)
+
+        newSortedQueue = utils.SortedQueue()
+        newSortedQueue.insert(item)
+        queueByGraceID[item.graceid] = newSortedQueue
+        restoredThrottles += 1
+
+    logger.info('{0} -- warm start -- Restored {1} event dictionaries and {2} PipelineThrottles from {3}.'.format(convertTime(), restored, restoredThrottles, approval_processorMPfiles))
+
 #-----------------------------------------------------------------------
 # parseAlert
 #-----------------------------------------------------------------------
+def trackFromGraceDb(queue, queueByGraceID, graceid, t0, external, configdict, settings, g, config, logger):
+    '''
+    creates the event_dict for a graceid we are not tracking from what GraceDb currently knows about it, along with its ForgetMeNow
+    external says whether graceid is an external trigger rather than a GW candidate
+    '''
+    event_dict = EventDict() # create a new instance of the EventDict class which is a blank event_dict
+    if external:
+        event_dict.grb_trigger_setup(g.events(graceid).next(), graceid, g, config, logger)
+    else:
+        event_dict.setup(g.events(graceid).next(), graceid, configdict, g, config, logger) # fill in event_dict using queried event candidate dictionary
+        event_dict.update() # update the event_dict with signoffs and iDQ info
+    trackEventDict(event_dict) # add this instance to the global eventDicts, eventDictionaries and gpsTimeIndex
+
+    # create ForgetMeNow queue item and add to overall queue and queueByGraceID
+    item = ForgetMeNow(t0, settings.forgetmenow_timeout, graceid, eventDicts, queue, queueByGraceID, logger)
+    queue.insert(item) # add queue item to the overall queue
+
+    ### set up queueByGraceID
+    newSortedQueue = utils.SortedQueue() # create sorted queue for new event candidate
+    newSortedQueue.insert(item) # put ForgetMeNow queue item into the sorted queue
+    queueByGraceID[item.graceid] = newSortedQueue # add queue item to the queueByGraceID
+    return event_dict
+
 def parseAlert(queue, queueByGraceID, alert, t0, config):
     '''
     the way approval_processorMP digests lvalerts
@@ -83,44 +347,35 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
     # extract relevant config parameters and set up necessary data structures
     #-------------------------------------------------------------------
 
-    # instantiate GraceDB client from the childConfig
-    client = config.get('general', 'client')
-    g = GraceDb(client)
-
-    # get other childConfig settings; save in configdict
-    voeventerror_email        = config.get('general', 'voeventerror_email')
-    force_all_internal        = config.get('general', 'force_all_internal')
-    preliminary_internal      = config.get('general', 'preliminary_internal')
-    forgetmenow_timeout       = config.getfloat('general', 'forgetmenow_timeout')
-    approval_processorMPfiles = config.get('general', 'approval_processorMPfiles')
-    hardware_inj              = config.get('labelCheck', 'hardware_inj')
-    wait_for_hardware_inj     = config.getfloat('labelCheck', 'wait_for_hardware_inj')
-    default_farthresh         = config.getfloat('farCheck', 'default_farthresh')
-    time_duration             = config.getfloat('injectionCheck', 'time_duration')
-    humanscimons              = config.get('operator_signoffCheck', 'humanscimons')
+    # the childConfig is only parsed the first time we see it (or when the file changes on disk)
+    settings = loadSettings(config)
+    precomputeNthr(settings) ### PipelineThrottle thresholds for every section, so creating a throttle only looks its Nthr up in NthrCache
 
-    ### extract options about advocates
-    advocates      = config.get('advocate_signoffCheck', 'advocates')
-    advocate_text  = config.get('advocate_signoffCheck', 'advocate_text')
-    advocate_email = config.get('advocate_signoffCheck', 'advocate_email')
+    # the GraceDB client is shared by every alert (and by PipelineThrottles) instead of being rebuilt each time
+    # log messages and labels are written to GraceDb in the background if [general] gracedb_writers > 0
+    client = settings.client
+    g = getWriteBehindGraceDb(config)
 
-    ### extract options for GRB alerts
-    em_coinc_text     = config.get('GRB_alerts', 'em_coinc_text')
-    coinc_text        = config.get('GRB_alerts', 'coinc_text')
-    grb_email         = config.get('GRB_alerts', 'grb_email')
-    notification_text = config.get('GRB_alerts', 'notification_text')
+    # record the outcome of any VOEvents that finished sending in the background since the last alert
+    getVOEventDispatcher(config).deliver()
 
-    ### extract options about idq
-    ignore_idq        = config.get('idq_joint_fapCheck', 'ignore_idq')
-    default_idqthresh = config.getfloat('idq_joint_fapCheck', 'default_idqthresh')
-    idq_pipelines     = config.get('idq_joint_fapCheck', 'idq_pipelines')
-    idq_pipelines     = idq_pipelines.replace(' ','')
-    idq_pipelines     = idq_pipelines.split(',')
+    # get other childConfig settings
+    forgetmenow_timeout       = settings.forgetmenow_timeout
+    approval_processorMPfiles = settings.approval_processorMPfiles
 
-    skymap_ignore_list = config.get('have_lvem_skymapCheck', 'skymap_ignore_list')
+    ### extract options about advocates
+    advocate_text  = settings.advocate_text
+    advocate_email = settings.advocate_email
+
+    ### extract options for GRB alerts
+    em_coinc_text     = settings.em_coinc_text
+    coinc_text        = settings.coinc_text
+    grb_email         = settings.grb_email
+    notification_text = settings.notification_text
 
     ### set up configdict (passed to local data structure: eventDicts)
-    configdict = makeConfigDict(config)
+    ### event_dicts share configdicts (see internConfiguration), so EventDict.update() replaces rather than modifies it
+    configdict = settings.makeConfigDict()
 
     # set up logging
     ### FIXME: why not open the logger each time parseAlert is called?
@@ -135,6 +390,12 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
         logger = loadLogger(config)
         logger.info('\n{0} ************ approval_processorMP.log RESTARTED ************\n'.format(convertTime()))
 
+    # pick up what the previous instance was tracking before handling the first alert
+    global warmStarted
+    if not warmStarted:
+        warmStart(queue, queueByGraceID, t0, settings, g, config, logger)
+        warmStarted = True
+
     #-------------------------------------------------------------------
     # extract relevant info about this alert
     #-------------------------------------------------------------------
@@ -157,8 +418,7 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
             event_dict.grb_trigger_setup(alert['object'], graceid, g, config, logger) # populate this event_dict with grb trigger info from lvalert
         else:
             event_dict.setup(alert['object'], graceid, configdict, g, config, logger) # populate this event_dict with information from lvalert
-        eventDicts[graceid] = event_dict # add the instance to the global eventDicts
-        eventDictionaries[graceid] = event_dict.data # add the dictionary to the global eventDictionaries
+        trackEventDict(event_dict) # add the instance to the global eventDicts, eventDictionaries and gpsTimeIndex
 
         ### ForgetMeNow queue item
         item = ForgetMeNow( t0, forgetmenow_timeout, graceid, eventDicts, queue, queueByGraceID, logger)
@@ -168,7 +428,7 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
         newSortedQueue = utils.SortedQueue() # create sorted queue for event candidate
         newSortedQueue.insert(item) # put ForgetMeNow queue item into the sorted queue
         queueByGraceID[item.graceid] = newSortedQueue # add queue item to the queueByGraceID
-        saveEventDicts(approval_processorMPfiles) # trying to see if expirationtime is updated from None
+        saveEventDicts(approval_processorMPfiles, graceid=graceid) # trying to see if expirationtime is updated from None
 
         message = '{0} -- {1} -- Created event dictionary for {1}.'.format(convertTime(), graceid)
         if loggerCheck(event_dict.data, message)==False:
@@ -186,34 +446,20 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
 
             # find ForgetMeNow corresponding to this graceid and update expiration time
             for item in queueByGraceID[graceid]:
-                if item.name==ForgetMeNow.name: # selects the queue item that is a ForgetMeNow instance
-                    item.setExpiration(t0) # updates the expirationtime key
-                    queue.resort() ### may be expensive, but is needed to guarantee that queue remains sorted
-                    queueByGraceID[graceid].resort()
+                if item.name==ForgetMeNow.name and not item.complete: # selects the queue item that is a ForgetMeNow instance
+                    item.renew(t0) # replaces it with one expiring relative to t0 (updates the expirationtime key) without re-sorting queue
                     break
             else: ### we couldn't find a ForgetMeNow for this event! Something is wrong!
-                os.system('echo \'ForgetMeNow KeyError\' | mail -s \'ForgetMeNow KeyError {0}\' {1}'.format(graceid, advocate_email))       
+                notifier = getNotifier(config)
+                notifier.notify(graceid, 'ForgetMeNow', advocate_email, 'ForgetMeNow KeyError {0}'.format(graceid), 'ForgetMeNow KeyError')
+                notifier.flush() ### we are about to raise, so make sure this goes out first
+                if isinstance(g, WriteBehindGraceDb): ### along with everything still being written to GraceDb
+                    g.flush()
                 raise KeyError('could not find ForgetMeNow for %s'%graceid) ### Reed thinks this is necessary as a safety net. 
                                                                             ### we want the process to terminate if things are not set up correctly to force us to fix it
 
         else: # event_dict for event candidate does not exist. we need to create it with up-to-date information
-            event_dict = EventDict() # create a new instance of the EventDict class which is a blank event_dict
-            if is_external_trigger(alert)==True:
-                event_dict.grb_trigger_setup(g.events(graceid).next(), graceid, g, config, logger)
-            else:
-                event_dict.setup(g.events(graceid).next(), graceid, configdict, g, config, logger) # fill in event_dict using queried event candidate dictionary
-                event_dict.update() # update the event_dict with signoffs and iDQ info
-            eventDicts[graceid] = event_dict # add this instance to the global eventDicts
-            eventDictionaries[graceid] = event_dict.data # add the dictionary to the global eventDictionaries
-
-            # create ForgetMeNow queue item and add to overall queue and queueByGraceID
-            item = ForgetMeNow(t0, forgetmenow_timeout, graceid, eventDicts, queue, queueByGraceID, logger)
-            queue.insert(item) # add queue item to the overall queue
-
-            ### set up queueByGraceID
-            newSortedQueue = utils.SortedQueue() # create sorted queue for new event candidate
-            newSortedQueue.insert(item) # put ForgetMeNow queue item into the sorted queue
-            queueByGraceID[item.graceid] = newSortedQueue # add queue item to the queueByGraceID
+            event_dict = trackFromGraceDb(queue, queueByGraceID, graceid, t0, is_external_trigger(alert), configdict, settings, g, config, logger)
 
             message = '{0} -- {1} -- Created event dictionary for {1}.'.format(convertTime(), graceid)
             if loggerCheck(event_dict.data, message)==False:
@@ -234,7 +480,7 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
             g.writeLog(graceid, 'AP: Mock data challenge or simulation. Ignoring.', tagname='em_follow')
         else:
             pass
-        saveEventDicts(approval_processorMPfiles)
+        saveEventDicts(approval_processorMPfiles, graceid=graceid)
         return 0
 
     #--------------------
@@ -247,8 +493,9 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
         if alert_type=='update':
             # is this a comment containing coinc info that needs to be parsed?
             if 'comment' in alert['object'].keys():
-                comment = alert['object']['comment']
-                if 'Significant event in on-source' in comment: # got comment structure from Dipongkar
+                comment = classifyComment(alert['object']['comment'])
+                kind = comment.kind if comment else None
+                if kind=='grb_coinc': # got comment structure from Dipongkar
                     coinc_pipeline, coinc_fap = record_coinc_info(event_dict.data, comment, alert, logger)
                     # begin creating the dictionary that will turn into json file
                     message_dict = {}
@@ -270,28 +517,25 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
                         g.writeLog(graceid, 'GRB-GW Coincidence JSON file: grb_offline_json', '/tmp/coinc_{0}.json'.format(graceid), tagname = 'em_follow')
                     os.remove('/tmp/coinc_{0}.json'.format(graceid))
                     ### alert via email
-                    os.system('echo \{0}\' | mail -s \'Coincidence JSON created for {1}\' {2}'.format(notification_text, graceid, grb_email))
+                    getNotifier(config).notify(graceid, 'grb_coinc-{0}'.format(coinc_pipeline), grb_email, 'Coincidence JSON created for {0}'.format(graceid), notification_text)
                 # is this the json file loaded into GraceDb?
-                if 'GRB-GW Coincidence JSON file' in comment:
+                elif kind=='coinc_json':
                     # if it is, find out which type of json it was and then message_dict['loaded_to_gracedb'] = 1
-                    json_type = re.findall('file: (.*)', comment)[0]
+                    json_type = comment.fields['type']
                     message_dict = event_dict.data[json_type]
                     message_dict = json.loads(message_dict) # converts string to dictionary
                     message_dict['loaded_to_gracedb'] = 1
                     # when we send to observers, message_dict['sent_to_observers'] = 1
             else:
                 pass
-        saveEventDicts(approval_processorMPfiles)
+        saveEventDicts(approval_processorMPfiles, graceid=graceid)
         return 0
 
     #--------------------
-    # Appending which checks must be satisfied in preliminary_to_initial state before moving on
+    # which checks must be satisfied in each state before moving on
     #--------------------
 
-    if humanscimons=='yes':
-        preliminary_to_initial.append('operator_signoffCheck')
-    if advocates=='yes':
-        preliminary_to_initial.append('advocate_signoffCheck')
+    checks = compileChecks(settings)
 
     #--------------------
     # update information based on the alert_type
@@ -320,20 +564,7 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
             item = queueByGraceID[key][0] ### we expect there to be only one item in this SortedQueue
 
         else: ### we need to make a throttle!
-            # pull PipelineThrottle parameters from the config
-            if config.has_section(key):
-                throttleWin          = config.getfloat(key, 'throttleWin')
-                targetRate           = config.getfloat(key, 'targetRate')
-                requireManualReset   = config.get(key, 'requireManualReset')
-                conf                 = config.getfloat(key, 'conf')
-
-            else:
-                throttleWin          = config.getfloat('default_PipelineThrottle', 'throttleWin')
-                targetRate           = config.getfloat('default_PipelineThrottle', 'targetRate')
-                requireManualReset   = config.get('default_PipelineThrottle', 'requireManualReset')
-                conf                 = config.getfloat('default_PipelineThrottle', 'conf')
-            grouperWin = config.getfloat('grouper', 'grouperWin')
-            item = PipelineThrottle(t0, eventDictionaries, grouperWin, throttleWin, targetRate, group, pipeline, search=search, requireManualReset=requireManualReset, conf=conf, graceDB_url=client)
+            item = makePipelineThrottle(t0, group, pipeline, search, settings)
 
             queue.insert( item ) ### add to overall queue
 
@@ -348,45 +579,11 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
             ### send some warning message?
             return 0 ### we're done here because we're ignoring this event -> exit from parseAlert
 
-#        #----------------
-#        ### pass data to Grouper
-#        #----------------
-#        raise Warning("Grouper is not implemented yet! we're currently using a temporate groupTag and prototype code")
-
-#        '''
-#        need to extract groupTag from group_pipeline[_search] mapping. 
-#            These associations should be specified in the config file, so we'll have to specify this somehow.
-#            probably just a "Grouper" section, with (option = value) pairs that look like (groupTag = nodeA nodeB nodeC ...)
-#        '''
-#        groupTag = 'TEMPORARY'
-
-#        ### check to see if Grouper exists for this groupTag
-#        if queueByGraceID.has_key(groupTag): ### at least one Grouper already exists
-
-#            ### determine if any of the existing Groupers are still accepting new triggers
-#            for item in queueByGraceID[groupTag]:
-#                if item.isOpen():
-#                    break ### this Grouper is still open, so we'll just use it
-#            else: ### no Groupers are open, so we need to create one
-#                item = Grouper(t0, grouperWin, groupTag, eventDicts, graceDB_url=client) ### create the actual QueueItem
-
-#                queue.insert( item ) ### insert it in the overall queue
-
-#                newSortedQueue = utils.SortedQueue() ### set up the SortedQueue for queueByGraceID
-#                newSortedQueue.insert(item)
-#                queueByGraceID[groupTag] = newSortedQueue  
-
-#        else: ### we need to make a Grouper
-#            grouperWin = config.getfloat('grouper', 'grouperWin')
-#            item = Grouper(t0, grouperWin, groupTag, eventDicts, graceDB_url=client) ### create the actual QueueItem
-
-#            queue.insert( item ) ### insert it in the overall queue
-
-#            newSortedQueue = utils.SortedQueue() ### set up the SortedQueue for queueByGraceID
-#            newSortedQueue.insert(item)
-#            queueByGraceID[groupTag] = newSortedQueue
-
-#        item.addEvent( graceid ) ### add this graceid to the item
+        #----------------
+        ### pass data to Grouper
+        #----------------
+        if settings.grouping:
+            addToGrouper(queue, queueByGraceID, graceid, t0, settings)
 
         return 0 ### we're done here. When Grouper makes a decision, we'll tick through the rest of the processes with a "selected" label
 
@@ -436,12 +633,9 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
 
             event_dict.data['currentstate'] = 'throttled' ### update current state
             
-            ### check if we need to send retractions
-            voevents = event_dict.data['voevents']
-            if len(voevents) > 0:
-                if 'retraction' not in sorted(voevents)[-1]:
-                    # there are existing VOEvents we've sent, but no retraction alert
-                    process_alert(event_dict.data, 'retraction', g, config, logger)
+            ### send a retraction if we sent (or are still sending) any VOEvents for this event
+            ### process_alert counts VOEvents still in the dispatcher as sent and does nothing if there are none or a retraction is already out
+            process_alert(event_dict.data, 'retraction', g, config, logger)
 
             ### update ForgetMeNow expiration to handle all the clean-up?
             ### we probably do NOT want to change the clean-up schedule because we'll still likely receive a lot of alerts about this guy
@@ -456,23 +650,24 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
 #            else:
 #                raise ValueError('could not find ForgetMeNow QueueItem for graceid=%s'%graceid)
 
-        elif description=="EM_Selected": ### this event was selected by a Grouper 
-            raise NotImplementedError('write logic to handle \"Selected\" labels')
+        elif description=="EM_Selected": ### this event was selected by a Grouper, so it goes on to the new_to_preliminary checks it was held back from
+            if currentstate=='new_to_preliminary':
+                scheduleNewToPreliminaryChecks(queue, queueByGraceID, graceid, t0, settings, config)
+
+        elif description=="EM_Superseded": ### this event was superceded by another event within Grouper and we turn off all processing for it
 
-        elif description=="EM_Superseded": ### this event was superceded by another event within Grouper
-            raise NotImplementedError('write logic to handle \"Superseded" labels')
+            event_dict.data['currentstate'] = 'superseded' ### update current state
+
+            ### send a retraction if we sent (or are still sending) any VOEvents for this event
+            process_alert(event_dict.data, 'retraction', g, config, logger)
 
         elif (checkLabels(description.split(), config) > 0): ### some other label was applied. We may need to issue a retraction notice.
             event_dict.data['currentstate'] = 'rejected'
 
-            ### check to see if we need to send a retraction
-            voevents = event_dict.data['voevents']
-            if len(voevents) > 0:
-                if 'retraction' not in sorted(voevents[-1]):
-                    # there are existing VOEvents we've sent, but no retraction alert
-                    process_alert(event_dict.data, 'retraction', g, config, logger)
+            ### send a retraction if we sent (or are still sending) any VOEvents for this event
+            process_alert(event_dict.data, 'retraction', g, config, logger)
 
-        saveEventDicts(approval_processorMPfiles) ### save the updated eventDict to disk
+        saveEventDicts(approval_processorMPfiles, graceid=graceid) ### save the updated eventDict to disk
         return 0
 
     ### FIXME: Reed left off commenting here...
@@ -496,17 +691,19 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
         # interested in iDQ information or other updates
         else:
             if 'comment' in alert['object'].keys():
-                comment = alert['object']['comment']
-                if re.match('minimum glitch-FAP', comment): # looking to see if it's iDQ glitch-FAP information
+                comment = classifyComment(alert['object']['comment']) # one pass over the comment tells us what it is and extracts what we need
+                kind = comment.kind if comment else None
+                if kind=='idq': # looking to see if it's iDQ glitch-FAP information
                     record_idqvalues(event_dict.data, comment, logger)
-                elif re.match('resent VOEvent', comment): # looking to see if another running instance of approval_processorMP sent a VOEvent
-                    response = re.findall(r'resent VOEvent (.*) in (.*)', comment) # extracting which VOEvent was re-sent
-                    event_dict.data[response[0][1]].append(response[0][0])
-                    saveEventDicts(approval_processorMPfiles)
-                elif 'EM-Bright probabilities computed from detection pipeline' in comment: # got comment structure from Shaon G.
+                elif kind=='resent': # looking to see if another running instance of approval_processorMP sent a VOEvent
+                    event_dict.data[comment.fields['key']].append(comment.fields['voevent']) # recording which VOEvent was re-sent
+                    saveEventDicts(approval_processorMPfiles, graceid=graceid)
+                elif kind=='em_bright': # got comment structure from Shaon G.
                     record_em_bright(event_dict.data, comment, logger)
-                elif 'Temporal coincidence with external trigger' in comment: # got comment structure from Alex U.
+                elif kind=='raven': # got comment structure from Alex U.
                     exttrig, coinc_far = record_coinc_info(event_dict.data, comment, alert, logger)
+                    if not eventDicts.has_key(exttrig): # we are not tracking the external trigger (eg: we were restarted since it arrived), so we pick it up from GraceDb
+                        trackFromGraceDb(queue, queueByGraceID, exttrig, t0, True, configdict, settings, g, config, logger)
                     # create dictionary that will become json file
                     message_dict = {}
                     grb_instrument = eventDictionaries[exttrig]['pipeline']
@@ -529,13 +726,14 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
                     g.writeLog(exttrig, 'GRB-GW Coincidence JSON file: em_coinc_json', '/tmp/coinc_{0}.json'.format(exttrig), tagname = 'em_follow')
                     os.remove('/tmp/coinc_{0}.json'.format(exttrig))
                     ### alert via email
-                    os.system('echo \{0}\' | mail -s \'Coincidence JSON created for {1}\' {2}'.format(notification_text, exttrig, grb_email))
-                    saveEventDicts(approval_processorMPfiles)
-                elif 'GRB-GW Coincidence JSON file' in comment: # this is the comment that accompanies a loaded coinc json file
+                    getNotifier(config).notify(exttrig, 'em_coinc', grb_email, 'Coincidence JSON created for {0}'.format(exttrig), notification_text)
+                    saveEventDicts(approval_processorMPfiles, graceid=graceid)
+                    saveEventDicts(approval_processorMPfiles, graceid=exttrig) ### the external trigger's event_dict changed too
+                elif kind=='coinc_json': # this is the comment that accompanies a loaded coinc json file
                     message_dict = event_dict.data['em_coinc_json']
                     message_dict = json.loads(message_dict) # converts string to dictionary
                     message_dict['loaded_to_gracedb'] = 1
-                    saveEventDicts(approval_processorMPfiles)
+                    saveEventDicts(approval_processorMPfiles, graceid=graceid)
                 else:
                     pass
 
@@ -543,203 +741,123 @@ def parseAlert(queue, queueByGraceID, alert, t0, config):
         signoff_object = alert['object']
         record_signoff(event_dict.data, signoff_object)
 
+    ### a Grouper waiting on more information about this event may be able to decide now
+    grouperIndex.touch(graceid, queue, queueByGraceID)
+
     #---------------------------------------------
     # run checks specific to currentstate of the event candidate
     #---------------------------------------------
 
-    passedcheckcount = 0
-
     if currentstate=='new_to_preliminary':
-        time.sleep(wait_for_hardware_inj) #this is for those cases where we dont have the INJ label right away
-        queried_dict = g.events(graceid).next() #query gracedb for the graceid
-        event_dict.data['labels'] = queried_dict['labels'].keys() #get the latest labels before running checks
-        for Check in new_to_preliminary:
-            eval('event_dict.{0}()'.format(Check))
-            checkresult = event_dict.data[Check + 'result']
-            if checkresult==None:
-                pass
-            elif checkresult==False:
-                # because in 'new_to_preliminary' state, no need to apply DQV label
-                message = '{0} -- {1} -- Failed {2} in currentstate: {3}.'.format(convertTime(), graceid, Check, currentstate)
-                if loggerCheck(event_dict.data, message)==False:
-                    logger.info(message)
-                    g.writeLog(graceid, 'AP: Failed {0} in currentstate: {1}.'.format(Check, currentstate), tagname='em_follow')
-                else:
-                    pass
-                message = '{0} -- {1} -- State: {2} --> rejected.'.format(convertTime(), graceid, currentstate)
-                if loggerCheck(event_dict.data, message)==False:
-                    logger.info(message)
-                    g.writeLog(graceid, 'AP: State: {0} --> rejected.'.format(currentstate), tagname='em_follow')
-                    event_dict.data['currentstate'] = 'rejected'
-                else:
-                    pass
-                saveEventDicts(approval_processorMPfiles)
-                return 0
-            elif checkresult==True:
-                passedcheckcount += 1
-        if passedcheckcount==len(new_to_preliminary):
-            message = '{0} -- {1} -- Passed all {2} checks.'.format(convertTime(), graceid, currentstate)
-            if loggerCheck(event_dict.data, message)==False:
-                logger.info(message)
-                g.writeLog(graceid, 'AP: Passed all {0} checks.'.format(currentstate), tagname='em_follow')
-            else:
-                pass
-            message = '{0} -- {1} -- Sending preliminary VOEvent.'.format(convertTime(), graceid)
-            if loggerCheck(event_dict.data, message)==False:
-                logger.info(message)
-                g.writeLog(graceid, 'AP: Sending preliminary VOEvent.', tagname='em_follow')
-                process_alert(event_dict.data, 'preliminary', g, config, logger)
-            else:
-                pass
-            message = '{0} -- {1} -- State: {2} --> preliminary_to_initial.'.format(convertTime(), graceid, currentstate)
-            if loggerCheck(event_dict.data, message)==False:
-                logger.info(message)
-                g.writeLog(graceid, 'AP: State: {0} --> preliminary_to_initial.'.format(currentstate), tagname='em_follow')
-                event_dict.data['currentstate'] = 'preliminary_to_initial'
-            else:
-                pass
-            labels = event_dict.data['labels']
-            # notify the operators if we haven't previously processed this event
-            instruments = event_dict.data['instruments']
-            for instrument in instruments:
-                if instrument in str(labels):
-                    pass
-                else:
-                    message = '{0} -- {1} -- Labeling {2}OPS.'.format(convertTime(), graceid, instrument)
-                    if loggerCheck(event_dict.data, message)==False:
-                        logger.info(message)
-                        g.writeLog(graceid, 'AP: Labeling {0}OPS.'.format(instrument), tagname='em_follow')
-                        g.writeLabel(graceid, '{0}OPS'.format(instrument))
-                    else:
-                        pass
-            # notify the advocates if we haven't previously processed this event
-            if 'ADV' in str(labels):
-                pass
-            else:
-                message = '{0} -- {1} -- Labeling ADVREQ.'.format(convertTime(), graceid)
-                if loggerCheck(event_dict.data, message)==False:
-                    logger.info(message)
-                    g.writeLog(graceid, 'AP: Labeling ADVREQ.', tagname='em_follow')
-                    g.writeLabel(graceid, 'ADVREQ')
-                    os.system('echo \'{0}\' | mail -s \'{1} passed criteria for follow-up\' {2}'.format(advocate_text, graceid, advocate_email))
-                    # expose event to LV-EM
-                    url_perm_base = g.service_url + urllib.quote('events/{0}/perms/gw-astronomy:LV-EM:Observers/'.format(graceid))
-                    for perm in ['view', 'change']:
-                        url = url_perm_base + perm
-                        #g.put(url)
-                else:
-                    pass
-        saveEventDicts(approval_processorMPfiles)
+        ### when grouping, only the event a Grouper selects goes on (see the EM_Selected label above)
+        groupIfUngrouped(queue, queueByGraceID, graceid, t0, event_dict.data, settings, logger)
+        if not (settings.grouping and ('EM_Selected' not in event_dict.data['labels'])):
+            scheduleNewToPreliminaryChecks(queue, queueByGraceID, graceid, t0, settings, config)
+        saveEventDicts(approval_processorMPfiles, graceid=graceid)
         return 0
 
-    elif currentstate=='preliminary_to_initial':
-        for Check in preliminary_to_initial:
-            eval('event_dict.{0}()'.format(Check))
-            checkresult = event_dict.data[Check + 'result']
-            if checkresult==None:
-                pass
-            elif checkresult==False:
-                message = '{0} -- {1} -- Failed {2} in currentstate: {3}.'.format(convertTime(), graceid, Check, currentstate)
-                if loggerCheck(event_dict.data, message)==False:
-                    logger.info(message)
-                    g.writeLog(graceid, 'AP: Failed {0} in currentstate: {1}.'.format(Check, currentstate), tagname='em_follow')
-                else:
-                    pass
-                message = '{0} -- {1} -- State: {2} --> rejected.'.format(convertTime(), graceid, currentstate)
-                if loggerCheck(event_dict.data, message)==False:
-                    logger.info(message)
-                    g.writeLog(graceid, 'AP: State: {0} --> rejected.'.format(currentstate), tagname='em_follow')
-                    event_dict.data['currentstate'] = 'rejected'
-                else:
-                    pass
-                # need to set DQV label so long as it isn't the operator_signoffCheck or advocate_signoffCheck
-                if 'signoffCheck' in Check:
-                    message = '{0} -- {1} -- Not labeling DQV because signoffCheck is separate from explicit data quality checks.'.format(convertTime(), graceid)
-                    if loggerCheck(event_dict.data, message)==False:
-                        logger.info(message)
-                        g.writeLog(graceid, 'AP: Not labeling DQV because signoffCheck is separate from explicit data quality checks.', tagname='em_follow')
-                    else:
-                        pass
-                else:
-                    message = '{0} -- {1} -- Labeling DQV.'.format(convertTime(), graceid)
-                    if loggerCheck(event_dict.data, message)==False:
-                        logger.info(message)
-                        g.writeLog(graceid, 'AP: Labeling DQV.', tagname='em_follow')
-                        g.writeLabel(graceid, 'DQV')
-                    else:
-                        pass
-                saveEventDicts(approval_processorMPfiles)
-                return 0
-            elif checkresult==True:
-                passedcheckcount += 1
-                if Check=='have_lvem_skymapCheck': # we want to send skymaps out as quickly as possible, even if humans have not vetted the event
-                    process_alert(event_dict.data, 'preliminary', g, config, logger) # if it turns out we've sent this alert with this skymap before, the process_alert function will just not send this repeat
-        if passedcheckcount==len(preliminary_to_initial):
-            message = '{0} -- {1} -- Passed all {2} checks.'.format(convertTime(), graceid, currentstate)
+    elif readyLabels.has_key(currentstate): ### preliminary_to_initial or initial_to_update
+        if runChecks(event_dict, checks[currentstate], g, config, logger)==True:
+            label = readyLabels[currentstate]
+            message = '{0} -- {1} -- Labeling {2}.'.format(convertTime(), graceid, label)
             if loggerCheck(event_dict.data, message)==False:
                 logger.info(message)
-                g.writeLog(graceid, 'AP: Passed all {0} checks.'.format(currentstate), tagname='em_follow')
+                g.writeLog(graceid, 'AP: Labeling {0}.'.format(label), tagname='em_follow')
+                g.writeLabel(graceid, label)
             else:
                 pass
-            message = '{0} -- {1} -- Labeling EM_READY.'.format(convertTime(), graceid)
-            if loggerCheck(event_dict.data, message)==False:
-                logger.info(message)
-                g.writeLog(graceid, 'AP: Labeling EM_READY.', tagname='em_follow')
-                g.writeLabel(graceid, 'EM_READY')
-            else:
-                pass
-        saveEventDicts(approval_processorMPfiles)
+        saveEventDicts(approval_processorMPfiles, graceid=graceid)
+        return 0
+
+    else:
+        saveEventDicts(approval_processorMPfiles, graceid=graceid)
         return 0
 
-    elif currentstate=='initial_to_update':
-        for Check in initial_to_update:
-            eval('event_dict.{0}()'.format(Check))
-            checkresult = event_dict.data[Check + 'result']
-            if checkresult==None:
+#-----------------------------------------------------------------------
+# new_to_preliminary checks
+#-----------------------------------------------------------------------
+def scheduleNewToPreliminaryChecks(queue, queueByGraceID, graceid, t0, settings, config):
+    '''
+    the INJ label is not always applied right away, so we give it wait_for_hardware_inj seconds to show up before running checks.
+    rather than sleeping, which would hold up every other alert, we schedule a HardwareInjectionWait to run them later.
+    '''
+    for item in queueByGraceID[graceid]:
+        if item.name==HardwareInjectionWait.name and not item.complete:
+            return ### checks are already scheduled for this graceid and will pick up whatever this alert changed
+    item = HardwareInjectionWait(t0, settings.wait_for_hardware_inj, graceid, new_to_preliminaryChecks, config)
+    queue.insert(item) # add queue item to the overall queue
+    queueByGraceID[graceid].insert(item) # and to the sorted queue for this graceid
+
+def new_to_preliminaryChecks(graceid, config):
+    '''
+    runs the new_to_preliminary checks for graceid and, if they all pass, sends the preliminary VOEvent and notifies operators and advocates
+    called by HardwareInjectionWait once wait_for_hardware_inj has passed since the alert that scheduled it
+    '''
+    if not eventDicts.has_key(graceid): ### we stopped tracking this event while waiting
+        return 0
+    event_dict = eventDicts[graceid]
+    currentstate = event_dict.data['currentstate']
+    if currentstate!='new_to_preliminary': ### something else moved this event along while we were waiting
+        return 0
+
+    settings = loadSettings(config)
+    approval_processorMPfiles = settings.approval_processorMPfiles
+    advocate_text  = settings.advocate_text
+    advocate_email = settings.advocate_email
+
+    g = getWriteBehindGraceDb(config)
+
+    queried_dict = g.events(graceid).next() #query gracedb for the graceid
+    event_dict.data['labels'] = queried_dict['labels'].keys() #get the latest labels before running checks
+    checkresult = runChecks(event_dict, compileChecks(settings)['new_to_preliminary'], g, config, logger)
+    if checkresult==False:
+        saveEventDicts(approval_processorMPfiles, graceid=graceid)
+        return 0
+    elif checkresult==True:
+        message = '{0} -- {1} -- Sending preliminary VOEvent.'.format(convertTime(), graceid)
+        if loggerCheck(event_dict.data, message)==False:
+            logger.info(message)
+            g.writeLog(graceid, 'AP: Sending preliminary VOEvent.', tagname='em_follow')
+            process_alert(event_dict.data, 'preliminary', g, config, logger)
+        else:
+            pass
+        message = '{0} -- {1} -- State: {2} --> preliminary_to_initial.'.format(convertTime(), graceid, currentstate)
+        if loggerCheck(event_dict.data, message)==False:
+            logger.info(message)
+            g.writeLog(graceid, 'AP: State: {0} --> preliminary_to_initial.'.format(currentstate), tagname='em_follow')
+            event_dict.data['currentstate'] = 'preliminary_to_initial'
+        else:
+            pass
+        labels = event_dict.data['labels']
+        # notify the operators if we haven't previously processed this event
+        instruments = event_dict.data['instruments']
+        for instrument in instruments:
+            if instrument in str(labels):
                 pass
-            elif checkresult==False:
-               # need to set DQV label
-                message = '{0} -- {1} -- Failed {2} in currentstate: {3}.'.format(convertTime(), graceid, Check, currentstate)
-                if loggerCheck(event_dict.data, message)==False:
-                    logger.info(message)
-                    g.writeLog(graceid, 'AP: Failed {0} in currentstate: {1}.'.format(Check, currentstate), tagname='em_follow')
-                else:
-                    pass
-                message = '{0} -- {1} -- State: {2} --> rejected.'.format(convertTime(), graceid, currentstate)
-                if loggerCheck(event_dict.data, message)==False:
-                    logger.info(message)
-                    g.writeLog(graceid, 'AP: State: {0} --> rejected.'.format(currentstate), tagname='em_follow')
-                    event_dict.data['currentstate'] = 'rejected'
-                else:
-                    pass
-                message = '{0} -- {1} -- Labeling DQV.'.format(convertTime(), graceid)
+            else:
+                message = '{0} -- {1} -- Labeling {2}OPS.'.format(convertTime(), graceid, instrument)
                 if loggerCheck(event_dict.data, message)==False:
                     logger.info(message)
-                    g.writeLog(graceid, 'AP: Labeling DQV.', tagname='em_follow')
-                    g.writeLabel(graceid, 'DQV')
+                    g.writeLog(graceid, 'AP: Labeling {0}OPS.'.format(instrument), tagname='em_follow')
+                    g.writeLabel(graceid, '{0}OPS'.format(instrument))
                 else:
                     pass
-                saveEventDicts(approval_processorMPfiles)
-                return 0
-            elif checkresult==True:
-                passedcheckcount += 1
-        if passedcheckcount==len(initial_to_update):
-            message = '{0} -- {1} -- Passed all {2} checks.'.format(convertTime(), graceid, currentstate)
-            if loggerCheck(event_dict.data, message)==False:
-                logger.info(message)
-                g.writeLog(graceid, 'AP: Passed all {0} checks.'.format(currentstate), tagname='em_follow')
-            else:
-                pass
-            message = '{0} -- {1} -- Labeling PE_READY.'.format(convertTime(), graceid)
+        # notify the advocates if we haven't previously processed this event
+        if 'ADV' in str(labels):
+            pass
+        else:
+            message = '{0} -- {1} -- Labeling ADVREQ.'.format(convertTime(), graceid)
             if loggerCheck(event_dict.data, message)==False:
                 logger.info(message)
-                g.writeLog(graceid, 'AP: Labeling PE_READY.', tagname='em_follow')
-                g.writeLabel(graceid, 'PE_READY')
+                g.writeLog(graceid, 'AP: Labeling ADVREQ.', tagname='em_follow')
+                g.writeLabel(graceid, 'ADVREQ')
+                getNotifier(config).notify(graceid, 'ADVREQ', advocate_email, '{0} passed criteria for follow-up'.format(graceid), advocate_text)
+                # expose event to LV-EM
+                url_perm_base = g.service_url + urllib.quote('events/{0}/perms/gw-astronomy:LV-EM:Observers/'.format(graceid))
+                for perm in ['view', 'change']:
+                    url = url_perm_base + perm
+                    #g.put(url)
             else:
                 pass
-        saveEventDicts(approval_processorMPfiles)
-        return 0
-    
-    else:
-        saveEventDicts(approval_processorMPfiles)
-        return 0
+    saveEventDicts(approval_processorMPfiles, graceid=graceid)
+    return 0
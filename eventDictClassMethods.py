@@ -5,8 +5,12 @@ author = "Min-A Cho (mina19@umd.edu)"
 # Import packages
 #-----------------------------------------------------------------------
 from ligo.gracedb.rest import GraceDb, HTTPError
+from voeventDispatcher import VOEventDispatcher, transports
+from gracedbWriter import WriteBehindGraceDb
+from notifier import Notifier, transports as notifierTransports
 
 import os
+import sys
 import json
 import pickle
 import urllib
@@ -25,7 +29,20 @@ import operator
 
 import functools
 
-import random
+import threading
+import Queue
+
+import struct
+
+import hashlib
+
+import bisect
+
+from collections import namedtuple, OrderedDict
+
+from cStringIO import StringIO
+
+from xml.etree import cElementTree as ElementTree
 
 #-----------------------------------------------------------------------
 # Creating the global event dictionaries variable for local bookkeeping
@@ -38,6 +55,577 @@ global eventDictionaries # global variable for local bookkeeping
 ### important thing is it saves the event_dict as a DICTIONARY
 eventDictionaries = {}
 
+#-----------------------------------------------------------------------
+# GPSTimeIndex: the tracked events sorted by gpstime
+#-----------------------------------------------------------------------
+class GPSTimeIndex(object):
+    '''
+    the gpstimes of every tracked event (G events and external triggers alike), kept sorted in parallel lists
+    so that "which events lie within +/-delta of t" is two bisections plus the matches, rather than a walk through eventDictionaries.
+    events without a gpstime are not indexed
+    '''
+    def __init__(self):
+        self.gpstimes = [] ### sorted
+        self.graceids = [] ### graceids[i] has gpstimes[i]
+        self.byGraceID = {} ### graceid -> gpstime
+
+    def __len__(self):
+        return len(self.graceids)
+
+    def __contains__(self, graceid):
+        return self.byGraceID.has_key(graceid)
+
+    def __position__(self, graceid):
+        gpstime = self.byGraceID[graceid]
+        ind = bisect.bisect_left(self.gpstimes, gpstime)
+        while self.graceids[ind]!=graceid: ### only events with exactly the same gpstime are skipped
+            ind += 1
+        return ind
+
+    def add(self, graceid, gpstime):
+        '''
+        indexes graceid at gpstime, replacing wherever it was indexed before
+        '''
+        if gpstime is None:
+            return
+        gpstime = float(gpstime)
+        if self.byGraceID.has_key(graceid):
+            if self.byGraceID[graceid]==gpstime:
+                return
+            self.discard(graceid)
+        ind = bisect.bisect_right(self.gpstimes, gpstime)
+        self.gpstimes.insert(ind, gpstime)
+        self.graceids.insert(ind, graceid)
+        self.byGraceID[graceid] = gpstime
+
+    def discard(self, graceid):
+        if self.byGraceID.has_key(graceid):
+            ind = self.__position__(graceid)
+            self.gpstimes.pop(ind)
+            self.graceids.pop(ind)
+            self.byGraceID.pop(graceid)
+
+    def gpstime(self, graceid):
+        return self.byGraceID.get(graceid)
+
+    def within(self, gpstime, tl, th=None):
+        '''
+        returns the graceids with gpstime+tl <= their gpstime <= gpstime+th, in gpstime order
+        with only tl, this is the symmetric window +/-tl
+        '''
+        if th is None:
+            tl, th = -abs(tl), abs(tl)
+        left = bisect.bisect_left(self.gpstimes, gpstime+tl)
+        right = bisect.bisect_right(self.gpstimes, gpstime+th)
+        return self.graceids[left:right]
+
+global gpsTimeIndex # the gpstimes of everything in eventDicts
+gpsTimeIndex = GPSTimeIndex()
+
+def trackEventDict(event_dict):
+    '''
+    starts tracking an EventDict: adds it to eventDicts, its data to eventDictionaries and its gpstime to gpsTimeIndex
+    '''
+    graceid = event_dict.graceid
+    eventDicts[graceid] = event_dict
+    eventDictionaries[graceid] = event_dict.data
+    gpsTimeIndex.add(graceid, event_dict.data.get('gpstime'))
+
+#-----------------------------------------------------------------------
+# EventRecord: the storage behind each event_dict
+#-----------------------------------------------------------------------
+global configurations # the distinct configdicts in use, so event_dicts set up with the same settings share one
+configurations = {}
+
+def internConfiguration(configdict):
+    '''
+    returns the shared copy of configdict. The result is shared between event_dicts and must be treated as read-only:
+    to change a setting for one event, intern a modified copy instead (see EventDict.update)
+    '''
+    key = tuple(sorted(configdict.items()))
+    if not configurations.has_key(key):
+        configurations[key] = configdict
+    return configurations[key]
+
+global strings # the distinct values of the string fields repeated across event_dicts (group, pipeline, labels, ...)
+strings = {}
+
+def internString(s):
+    '''
+    like intern() but also works for the unicode strings that come out of json
+    '''
+    return strings.setdefault(s, s)
+
+#-----------------------------------------------------------------------
+# VOEventHistory: the VOEvents sent for each event_dict
+#-----------------------------------------------------------------------
+class VOEvent(namedtuple('VOEvent', ['sequence', 'voevent_type', 'internal', 'vetted', 'open_alert', 'hardware_inj', 'skymap'])):
+    '''
+    a single VOEvent we sent (or failed to send). sequence counts from 1 within its VOEventHistory
+    the parameters are kept as the strings they were always formatted into, so a VOEvent built by process_alert compares equal
+    to the same VOEvent read back from GraceDb (see voeventKey). str() gives the form written to logs and older event_dicts:
+        <sequence>-(internal,vetted,open_alert,hardware_inj,skymap):(<internal>,<vetted>,<open_alert>,<hardware_inj>,<skymap>)-<voevent_type>
+    '''
+    __slots__ = ()
+    __pattern__ = re.compile(r'\A(\d+)-\(internal,vetted,open_alert,hardware_inj,skymap\):\((.*?),(.*?),(.*?),(.*?),(.*)\)-(\w+)\Z')
+
+    @classmethod
+    def fromString(cls, text):
+        match = cls.__pattern__.match(text)
+        if not match:
+            raise ValueError('could not parse VOEvent from %s'%text)
+        sequence, internal, vetted, open_alert, hardware_inj, skymap, voevent_type = match.groups()
+        return cls(int(sequence), *voeventKey(voevent_type, internal, vetted, open_alert, hardware_inj, skymap))
+
+    def key(self):
+        '''
+        everything but the sequence number: two VOEvents with the same key are repeats of each other
+        '''
+        return self[1:]
+
+    def __str__(self):
+        return '{0}-(internal,vetted,open_alert,hardware_inj,skymap):({2},{3},{4},{5},{6})-{1}'.format(*self)
+
+def voeventKey(voevent_type, internal, vetted, open_alert, hardware_inj, skymap):
+    '''
+    returns the key (see VOEvent.key) of a VOEvent with these parameters
+    '''
+    return (internString(str(voevent_type)), internString(str(internal)), internString(str(vetted)), internString(str(open_alert)), internString(str(hardware_inj)), str(skymap))
+
+class VOEventHistory(object):
+    '''
+    the VOEvents sent for one event (voevents) or that failed to send (voeventerrors), in order
+
+    alongside the list we count the VOEvents with each key and each voevent_type, so "did we send this before" and
+    "did we send a retraction" are dictionary lookups rather than a search through the list, and last points straight at the newest VOEvent.
+    supports len(), iteration and indexing like the list of strings it replaces, and str() shows those strings
+    '''
+    def __init__(self, voevents=()):
+        self.records = []
+        self.keys    = {} ### VOEvent.key() -> number of records with it
+        self.types   = {} ### voevent_type -> number of records with it
+        for voevent in voevents:
+            self.append(voevent)
+
+    def append(self, voevent):
+        '''
+        records a VOEvent, a key (numbered as the next VOEvent) or one of the strings older versions stored. Returns the VOEvent
+        '''
+        if isinstance(voevent, basestring):
+            voevent = VOEvent.fromString(voevent)
+        elif not isinstance(voevent, VOEvent):
+            voevent = VOEvent(len(self.records)+1, *voevent)
+        self.records.append(voevent)
+        key = voevent.key()
+        self.keys[key] = self.keys.get(key, 0) + 1
+        self.types[voevent.voevent_type] = self.types.get(voevent.voevent_type, 0) + 1
+        return voevent
+
+    @property
+    def last(self):
+        '''
+        the most recent VOEvent, or None
+        '''
+        return self.records[-1] if self.records else None
+
+    def hasKey(self, key):
+        return self.keys.has_key(key)
+
+    def hasType(self, voevent_type):
+        return self.types.has_key(voevent_type)
+
+    def discardType(self, voevent_type):
+        '''
+        forgets every VOEvent of this type
+        '''
+        if self.hasType(voevent_type):
+            records = [voevent for voevent in self.records if voevent.voevent_type!=voevent_type]
+            self.__init__(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, ind):
+        return self.records[ind]
+
+    def __eq__(self, other):
+        if isinstance(other, VOEventHistory):
+            return self.records==other.records
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __str__(self):
+        return str([str(voevent) for voevent in self.records])
+
+    __repr__ = __str__
+
+    def __getstate__(self):
+        return [tuple(voevent) for voevent in self.records]
+
+    def __setstate__(self, state):
+        self.__init__([VOEvent(*voevent) for voevent in state])
+
+#-----------------------------------------------------------------------
+# SkymapRegistry: the lvem tagged skymaps for each event_dict
+#-----------------------------------------------------------------------
+class SkymapRegistry(object):
+    '''
+    the lvem tagged skymaps for one event in the order they arrived, with who submitted each of them
+
+    filenames are kept in a list (for the order) and a dictionary (filename -> submitter) so checking for a repeat is a lookup
+    and latest is the last one in the list. Nothing is ever removed.
+    older versions stored {'<N>-<filename>' : submitter}, which is still accepted by the constructor and shown by str()
+    '''
+    __pattern__ = re.compile(r'\A(\d+)-(.*)\Z')
+
+    def __init__(self, skymaps=()):
+        self.filenames  = []
+        self.submitters = {} ### filename -> submitter
+        if isinstance(skymaps, dict):
+            numbered = []
+            for key, submitter in skymaps.items():
+                number, filename = self.__pattern__.match(key).groups()
+                numbered.append( (int(number), filename, submitter) )
+            skymaps = [(filename, submitter) for number, filename, submitter in sorted(numbered)]
+        for filename, submitter in skymaps:
+            self.add(filename, submitter)
+
+    def add(self, filename, submitter):
+        '''
+        records a skymap. Returns False if we already had it
+        '''
+        if self.submitters.has_key(filename):
+            return False
+        self.filenames.append(filename)
+        self.submitters[filename] = submitter
+        return True
+
+    @property
+    def latest(self):
+        '''
+        the filename of the most recent skymap, or None
+        '''
+        return self.filenames[-1] if self.filenames else None
+
+    def submitter(self, filename):
+        return self.submitters[filename]
+
+    def __contains__(self, filename):
+        return self.submitters.has_key(filename)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __iter__(self):
+        return iter(self.filenames)
+
+    def __eq__(self, other):
+        if isinstance(other, SkymapRegistry):
+            return self.filenames==other.filenames and self.submitters==other.submitters
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __str__(self):
+        return '{%s}'%', '.join('%r: %r'%('%d-%s'%(ind+1, filename), self.submitters[filename]) for ind, filename in enumerate(self.filenames))
+
+    __repr__ = __str__
+
+    def __getstate__(self):
+        return [(filename, self.submitters[filename]) for filename in self.filenames]
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+### the event_dict fields each EventDict check reads (besides the config). A check is only re-run once one of them has changed
+checkInputs = OrderedDict([
+    ('farCheck'              , ('farCheckresult', 'far', 'pipeline', 'search')),
+    ('labelCheck'            , ('labels',)),
+    ('injectionCheck'        , ('injectionCheckresult', 'gpstime')),
+    ('have_lvem_skymapCheck' , ('currentstate', 'lvemskymaps', 'lastsentskymap')),
+    ('idq_joint_fapCheck'    , ('idq_joint_fapCheckresult', 'group', 'pipeline', 'search', 'idqvalues', 'instruments', 'idqlogkey')),
+    ('operator_signoffCheck' , ('operator_signoffCheckresult', 'operatorsignoffs', 'instruments', 'operatorlogkey')),
+    ('advocate_signoffCheck' , ('advocate_signoffCheckresult', 'advocatesignoffs', 'advocatelogkey')),
+])
+
+class EventRecord(object):
+    '''
+    the event_dict for a single graceid (what eventDictionaries holds and EventDict.data points to)
+
+    it behaves like the dictionary it replaces (event_dict[key], has_key, keys, items, update, get, ...), but
+    every key set by EventDict.setup or EventDict.grb_trigger_setup is stored in a slot rather than in a per-event hash table.
+      the *logkey flags are booleans (the old 'yes'/'no' strings are converted when they are set)
+      configuration is interned with internConfiguration and the repeated string fields with internString
+      empty containers (voevents, idqvalues, ...) are only allocated the first time they are looked up
+      voevents and voeventerrors are VOEventHistory objects and lvemskymaps is a SkymapRegistry (the dicts and lists older versions stored are converted when they are set)
+    keys we do not know about end up in a small dictionary of extras, which is only allocated if needed.
+    a key whose slot was never set is missing, just as it would be from a dictionary.
+
+    it also remembers which checks are stale, ie: which of the fields they read (checkInputs) were set since they last ran.
+    this is a single bitmask, one bit per check. Code that modifies a field in place (eg: appends to labels) must call touch()
+    '''
+    __fields__ = (
+        'advocate_signoffCheckresult',
+        'advocatelogkey',
+        'advocatesignoffs',
+        'configuration',
+        'currentstate',
+        'em_coinc_json',
+        'expirationtime',
+        'external_trigger',
+        'far',
+        'farCheckresult',
+        'farlogkey',
+        'gpstime',
+        'graceid',
+        'grb_offline_json',
+        'grb_online_json',
+        'group',
+        'groupergroup',
+        'have_lvem_skymapCheckresult',
+        'idq_joint_fapCheckresult',
+        'idqlogkey',
+        'idqvalues',
+        'injectionCheckresult',
+        'injectionlogkey',
+        'injectionsfound',
+        'instruments',
+        'jointfapvalues',
+        'labelCheckresult',
+        'labels',
+        'lastsentpreliminaryskymap',
+        'lastsentskymap',
+        'loggerfingerprints',
+        'loggermessages',
+        'lvemskymaps',
+        'operator_signoffCheckresult',
+        'operatorlogkey',
+        'operatorsignoffs',
+        'pipeline',
+        'search',
+        'voeventerrors',
+        'voevents',
+    )
+    __slots__ = __fields__ + ('__extras__', '__stale__')
+
+    __fieldset__   = frozenset(__fields__)
+    __flags__      = frozenset(['advocatelogkey', 'farlogkey', 'idqlogkey', 'injectionlogkey', 'operatorlogkey'])
+    __interned__   = frozenset(['currentstate', 'group', 'pipeline', 'search'])
+    __upgrades__   = {'lvemskymaps':SkymapRegistry, 'voeventerrors':VOEventHistory, 'voevents':VOEventHistory} ### fields older versions stored as plain dicts and lists
+    __containers__ = {
+        'advocatesignoffs'   : list,
+        'groupergroup'       : dict,
+        'idqvalues'          : dict,
+        'jointfapvalues'     : dict,
+        'loggerfingerprints' : set,
+        'loggermessages'     : list,
+        'lvemskymaps'        : SkymapRegistry,
+        'operatorsignoffs'   : dict,
+        'voeventerrors'      : VOEventHistory,
+        'voevents'           : VOEventHistory,
+    }
+    __empty__ = object() ### stands in for an empty container that has not been allocated yet
+
+    __checkbits__  = dict((Check, 1<<ind) for ind, Check in enumerate(checkInputs.keys()))
+    __dependents__ = {} ### field -> bitmask of the checks that read it
+    for Check, fields in checkInputs.items():
+        for field in fields:
+            __dependents__[field] = __dependents__.get(field, 0) | __checkbits__[Check]
+    del Check, fields, field
+
+    def __init__(self, data=None):
+        self.__extras__ = None
+        self.__stale__  = -1 ### every check
+        if data:
+            self.update(data)
+
+    #--- storage
+
+    def __setitem__(self, key, value):
+        if key in self.__fieldset__:
+            if (key in self.__upgrades__) and not isinstance(value, self.__upgrades__[key]):
+                value = self.__upgrades__[key](value)
+            if key in self.__flags__:
+                value = (value=='yes') if isinstance(value, basestring) else bool(value)
+            elif (key in self.__containers__) and (type(value) is self.__containers__[key]) and (not value):
+                value = self.__empty__
+            elif (key in self.__interned__) and isinstance(value, basestring):
+                value = internString(value)
+            elif (key=='configuration') and isinstance(value, dict):
+                value = internConfiguration(value)
+            setattr(self, key, value)
+            self.touch(key)
+        else:
+            if self.__extras__ is None:
+                self.__extras__ = {}
+            self.__extras__[key] = value
+
+    def __getitem__(self, key):
+        if key in self.__fieldset__:
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+            if value is self.__empty__: ### allocate it now that someone may modify it
+                value = self.__containers__[key]()
+                setattr(self, key, value)
+            return value
+        if self.__extras__ and self.__extras__.has_key(key):
+            return self.__extras__[key]
+        raise KeyError(key)
+
+    def __delitem__(self, key):
+        if key in self.__fieldset__:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+            self.touch(key)
+        elif self.__extras__ and self.__extras__.has_key(key):
+            del self.__extras__[key]
+        else:
+            raise KeyError(key)
+
+    def __peek__(self, key):
+        '''
+        like __getitem__, but does not allocate empty containers (the result must not be modified)
+        '''
+        if key in self.__fieldset__:
+            value = getattr(self, key)
+            if value is self.__empty__:
+                return self.__containers__[key]()
+            return value
+        return self.__extras__[key]
+
+    #--- stale checks
+
+    def touch(self, *keys):
+        '''
+        marks the checks that read any of keys as stale. Called automatically whenever a field is set
+        '''
+        for key in keys:
+            self.__stale__ |= self.__dependents__.get(key, 0)
+
+    def isStale(self, Check):
+        '''
+        whether Check has to be re-run. Checks that do not declare their inputs in checkInputs always are
+        '''
+        bit = self.__checkbits__.get(Check)
+        return (bit is None) or bool(self.__stale__ & bit)
+
+    def markFresh(self, Check):
+        if self.__checkbits__.has_key(Check):
+            self.__stale__ &= ~self.__checkbits__[Check]
+
+    def markStale(self):
+        '''
+        marks every check as stale (eg: because the config changed)
+        '''
+        self.__stale__ = -1
+
+    #--- the dictionary interface
+
+    def has_key(self, key):
+        if key in self.__fieldset__:
+            return hasattr(self, key)
+        return bool(self.__extras__) and self.__extras__.has_key(key)
+
+    __contains__ = has_key
+
+    def keys(self):
+        keys = [key for key in self.__fields__ if hasattr(self, key)]
+        if self.__extras__:
+            keys += self.__extras__.keys()
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self.__peek__(key) for key in self.keys()]
+
+    def items(self):
+        return [(key, self.__peek__(key)) for key in self.keys()]
+
+    def get(self, key, default=None):
+        if self.has_key(key):
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if not self.has_key(key):
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if self.has_key(key):
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def update(self, other=None, **kwargs):
+        if other is not None:
+            for key in other.keys():
+                self[key] = other[key]
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, EventRecord)):
+            return dict(self.items())==dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    #--- pickling
+
+    def __getstate__(self):
+        '''
+        a plain dictionary of everything that is set. Empty containers that were never allocated are only listed by name
+        '''
+        state = {}
+        empty = []
+        for key in self.__fields__:
+            if hasattr(self, key):
+                value = getattr(self, key)
+                if value is self.__empty__:
+                    empty.append(key)
+                else:
+                    state[key] = value
+        if self.__extras__:
+            state.update(self.__extras__)
+        return (state, tuple(empty))
+
+    def __setstate__(self, state):
+        state, empty = state
+        self.__extras__ = None
+        self.__stale__  = -1 ### nothing has been checked in this process yet
+        self.update(state) ### re-interns configuration and the string fields
+        for key in empty:
+            setattr(self, key, self.__empty__)
+
 #-----------------------------------------------------------------------
 # EventDict class
 #-----------------------------------------------------------------------
@@ -46,55 +634,56 @@ class EventDict():
     creates an event_dict for each event candidate to keep track of checks, files, comments, labels coming in
     '''
     def __init__(self):
-        self.data = {} # create a blank dictionary that gets populated later
+        self.data = EventRecord() # create a blank event_dict that gets populated later
 
     def __getitem__(self, key):
         self.key = key
         return self.data[self.key]
 
     def setup(self, dictionary, graceid, configdict, client, config, logger):
-        self.dictionary = dictionary # a dictionary either extracted from an lvalert or from a call to graceDb
+        ### dictionary is either extracted from an lvalert or from a call to graceDb. We copy what we need rather than holding onto it
         self.graceid = graceid
-        self.configdict = configdict # stores settings used
+        self.configdict = internConfiguration(configdict) # stores settings used, shared with every other event set up with the same settings
         self.client = client
         self.config = config
         self.logger = logger
         self.data.update({
             'advocate_signoffCheckresult': None,
-            'advocatelogkey'             : 'no',
+            'advocatelogkey'             : False,
             'advocatesignoffs'           : [],
             'configuration'              : self.configdict,
             'currentstate'               : 'new_to_preliminary',
-            'far'                        : self.dictionary['far'],
+            'far'                        : dictionary['far'],
             'farCheckresult'             : None,
-            'farlogkey'                  : 'no',
+            'farlogkey'                  : False,
             'em_coinc_json'              : None,
             'expirationtime'             : None,
             'external_trigger'           : None,
-            'gpstime'                    : float(self.dictionary['gpstime']),
+            'gpstime'                    : float(dictionary['gpstime']),
             'graceid'                    : self.graceid,
-            'group'                      : self.dictionary['group'],
+            'group'                      : dictionary['group'],
             'groupergroup'               : {},
             'have_lvem_skymapCheckresult': None,
             'idq_joint_fapCheckresult'   : None,
-            'idqlogkey'                  : 'no',
+            'idqlogkey'                  : False,
             'idqvalues'                  : {},
             'injectionCheckresult'       : None,
             'injectionsfound'            : None,
-            'injectionlogkey'            : 'no',
-            'instruments'                : str(self.dictionary['instruments']).split(','),
+            'injectionlogkey'            : False,
+            'instruments'                : [internString(ifo) for ifo in str(dictionary['instruments']).split(',')],
             'jointfapvalues'             : {},
             'labelCheckresult'           : None,
-            'labels'                     : self.dictionary['labels'].keys(),
+            'labels'                     : [internString(label) for label in dictionary['labels'].keys()],
             'lastsentskymap'             : None,
             'lastsentpreliminaryskymap'  : None,
+            'loggerfingerprints'         : set(),
             'loggermessages'             : [],
             'lvemskymaps'                : {},
             'operator_signoffCheckresult': None,
-            'operatorlogkey'             : 'no',
+            'operatorlogkey'             : False,
             'operatorsignoffs'           : {},
-            'pipeline'                   : self.dictionary['pipeline'],
-            'search'                     : self.dictionary['search'] if self.dictionary.has_key('search') else '',
+            'pipeline'                   : dictionary['pipeline'],
+            'search'                     : dictionary['search'] if dictionary.has_key('search') else '',
             'voeventerrors'              : [],
             'voevents'                   : []
         })
@@ -103,79 +692,62 @@ class EventDict():
         '''
         creates an event_dict with signoff and iDQ information for self.graceid
         this event_dict starts off with currentstate new_to_preliminary
+
+        the voevents, signoff list and logs are fetched concurrently (see fetchConcurrently) and the logs are parsed in a single pass.
+        log entries we parsed on an earlier rebuild of this graceid are taken from logCache rather than parsed again, and VOEvents from voeventCache.
         '''
+        url = self.client.templates['signoff-list-template'].format(graceid=self.graceid) # construct url for the operator/advocate signoff list
+        voevent_dicts, signoff_list, log_dicts = fetchConcurrently(
+            lambda: self.client.voevents(self.graceid).json()['voevents'],
+            lambda: self.client.get(url).json()['signoff'],
+            lambda: self.client.logs(self.graceid).json()['log'],
+        )
+
         # get the most recent voevent information
-        voevent_dicts = self.client.voevents(self.graceid).json()['voevents']
         for voevent in voevent_dicts: # this traverses voevents in the order they were sent
-            voevent_text = voevent['text'] # this is the actual xml text
-            internal     = re.findall(r'internal\" dataType=\"int\" value=\"(\S+)\"', voevent_text)[0]
-            vetted       = re.findall(r'Vetted\" dataType=\"int\" value=\"(\S+)\"', voevent_text)[0] 
-            open_alert   = re.findall(r'OpenAlert\" dataType=\"int\" value=\"(\S+)\"', voevent_text)[0] 
-            hardware_inj = re.findall(r'HardwareInj\" dataType=\"int\" value=\"(\S+)\"', voevent_text)[0]
-            voevent_type = voevent['voevent_type']
-            if voevent_type=='PR':
-                voevent_type = 'preliminary'
-            elif voevent_type=='IN':
-                voevent_type = 'initial'
-            elif voevent_type=='UP':
-                voevent_type = 'update'
-            elif voevent_type=='RE':
-                voevent_type = 'retraction'
-            # update sent skymaps if any from the voevent
-            skymap = re.findall(r'skymap_fits_basic\" dataType=\"string\" value=\"(\S+)\"', voevent_text)
+            internal, vetted, open_alert, hardware_inj, skymap = getVOEventParams(self.graceid, voevent)
+            voevent_type = __voeventTypes__.get(voevent['voevent_type'], voevent['voevent_type'])
             # update event_dict in the case there were any skymaps
-            if len(skymap)==1:
-                skymap = re.findall(r'files/(\S+)', skymap[0])[0]
+            if skymap:
                 if voevent_type=='preliminary':
                     self.data['lastsentpreliminaryskymap'] = skymap
                 elif voevent_type=='initial' or voevent_type=='update':
                     self.data['lastsentskymap'] = skymap
-            elif len(skymap)==0:
-                skymap = None
-            thisvoevent = '(internal,vetted,open_alert,hardware_inj,skymap):({0},{1},{2},{3},{4})-'.format(internal, vetted, open_alert, hardware_inj, skymap) + voevent_type
-            thisvoevent = '{0}-'.format(len(self.data['voevents']) + 1) + thisvoevent
-            self.data['voevents'].append(thisvoevent)
-
+            self.data['voevents'].append(voeventKey(voevent_type, internal, vetted, open_alert, hardware_inj, skymap)) # numbered in the order they were sent
 
         # update signoff information if available
-        url = self.client.templates['signoff-list-template'].format(graceid=self.graceid) # construct url for the operator/advocate signoff list
-        signoff_list = self.client.get(url).json()['signoff'] # pull down signoff list
         for signoff_object in signoff_list:
             record_signoff(self.data, signoff_object)
 
         # update iDQ information, skymaps, EM-Bright information, and past farCheck results if available
-        log_dicts = self.client.logs(self.graceid).json()['log']
-        for message in log_dicts: # going through the log from oldest to most recent for recording skymaps
-            if 'lvem' in message['tag_names'] and '.fits' in message['filename']:
-                record_skymap(self.data, message['filename'], message['issuer']['display_name'], logger) # this way, the ordering in which the skymaps came in is properly noted
-            else:
-                pass
-
-        for message in reversed(log_dicts): # going through the log from most recent to oldest message
-            if re.match('minimum glitch-FAP', message['comment']):
-                record_idqvalues(self.data, message['comment'], logger)
-            elif re.match('EM-Bright probabilities computed from detection pipeline', message['comment']):
-                record_em_bright(self.data, message['comment'], logger)
-            elif re.match('AP: Candidate event rejected due to large FAR', message['comment']):
-                default_farthresh = float(re.findall(r'>= (.*)', message['comment'])[0])
-                self.configdict['default_farthresh'] = default_farthresh
+        skymaps, records = parseLogs(self.graceid, log_dicts)
+        for filename, submitter in skymaps: # from oldest to most recent so the ordering in which the skymaps came in is properly noted
+            record_skymap(self.data, filename, submitter, self.logger)
+
+        for record in reversed(records): # from most recent to oldest, so the oldest of each kind of message has the final say
+            kind = record.kind
+            if kind=='idq':
+                record_idqvalues(self.data, record, self.logger)
+            elif kind=='em_bright':
+                record_em_bright(self.data, record, self.logger)
+            elif kind=='far_rejected':
+                default_farthresh = float(record.fields['farthresh'])
+                self.configdict = internConfiguration(dict(self.configdict, default_farthresh=default_farthresh)) # configdicts are shared, so we never modify one in place
                 self.data['configuration'] = self.configdict
-                self.data['farlogkey'] = 'yes'
+                self.data['farlogkey'] = True
                 self.data['farCheckresult'] = False
-            elif re.match('AP: Candidate event has low enough FAR', message['comment']):
-                default_farthresh = float(re.findall(r'< (.*)', message['comment'])[0])
-                self.configdict['default_farthresh'] = default_farthresh
+            elif kind=='far_passed':
+                default_farthresh = float(record.fields['farthresh'])
+                self.configdict = internConfiguration(dict(self.configdict, default_farthresh=default_farthresh)) # configdicts are shared, so we never modify one in place
                 self.data['configuration'] = self.configdict
-                self.data['farlogkey'] = 'yes'
+                self.data['farlogkey'] = True
                 self.data['farCheckresult'] = True
-            else:
-                pass               
 
     #-----------------------------------------------------------------------
     # external GRB trigger local data bookkeeping
     #-----------------------------------------------------------------------
     def grb_trigger_setup(self, dictionary, graceid, client, config, logger):
-        self.dictionary = dictionary # a dictionary either extracted from an lvalert or from a call to gracedb
+        ### dictionary is either extracted from an lvalert or from a call to gracedb. We copy what we need rather than holding onto it
         self.graceid = graceid
         self.client = client
         self.config = config
@@ -183,13 +755,30 @@ class EventDict():
         self.data.update({
             'em_coinc_json'    : None,
             'expirationtime'   : None,
+            'gpstime'          : float(dictionary['gpstime']) if dictionary.get('gpstime') is not None else None,
             'graceid'          : self.graceid,
             'grb_offline_json' : None,
             'grb_online_json'  : None,
-            'labels'           : self.dictionary['labels'].keys(),
+            'labels'           : [internString(label) for label in dictionary['labels'].keys()],
+            'loggerfingerprints' : set(),
             'loggermessages'   : [],
-            'pipeline'         : self.dictionary['pipeline']
-        })  
+            'pipeline'         : dictionary['pipeline']
+        })
+
+    #-----------------------------------------------------------------------
+    # rebuilding an event_dict persisted by a previous instance
+    #-----------------------------------------------------------------------
+    def restore(self, data, graceid, client, config, logger):
+        '''
+        wraps an event_dict loaded from disk (see loadEventDicts) instead of rebuilding it from GraceDb
+        works for both GW candidates and external triggers, which do not carry a configuration
+        '''
+        self.data = data if isinstance(data, EventRecord) else EventRecord(data) ### event_dicts pickled before EventRecord existed are plain dictionaries
+        self.graceid = graceid
+        self.configdict = self.data.get('configuration') # the settings this event_dict was set up with
+        self.client = client
+        self.config = config
+        self.logger = logger
 
     #-----------------------------------------------------------------------
     # farCheck
@@ -214,7 +803,7 @@ class EventDict():
             farthresh = self.__get_farthresh__(pipeline, search, self.config)
             if far >= farthresh:
                 self.client.writeLog(self.graceid, 'AP: Candidate event rejected due to large FAR. {0} >= {1}'.format(far, farthresh), tagname='em_follow')
-                self.data['farlogkey'] = 'yes'
+                self.data['farlogkey'] = True
                 message = '{0} -- {1} -- Rejected due to large FAR. {2} >= {3}'.format(convertTime(), self.graceid, far, farthresh)
                 if loggerCheck(self.data, message)==False:
                     self.logger.info(message)
@@ -224,7 +813,7 @@ class EventDict():
                 return False
             elif far==None:
                 self.client.writeLog(self.graceid, 'AP: Candidate event is missing FAR.', tagname='em_follow')
-                self.data['farlogkey'] = 'yes'
+                self.data['farlogkey'] = True
                 message = '{0} -- {1} -- Candidate event is missing FAR.'.format(convertTime(), self.graceid)
                 if loggerCheck(self.data, message)==False:
                     self.logger.info(message)
@@ -234,7 +823,7 @@ class EventDict():
                 return False
             elif far < farthresh:
                 self.client.writeLog(self.graceid, 'AP: Candidate event has low enough FAR. {0} < {1}'.format(far, farthresh), tagname='em_follow')
-                self.data['farlogkey'] = 'yes'
+                self.data['farlogkey'] = True
                 message = '{0} -- {1} -- Low enough FAR. {2} < {3}'.format(convertTime(), self.graceid, far, farthresh)
                 if loggerCheck(self.data, message)==False:
                     self.logger.info(message)
@@ -273,16 +862,15 @@ class EventDict():
         else:
             eventtime = float(self.data['gpstime'])
             time_duration = self.config.getfloat('injectionCheck', 'time_duration')
-            from raven.search import query
             th = time_duration
             tl = -th
-            Injections = query('HardwareInjection', eventtime, tl, th)
+            Injections = getInjectionCache(self.config).query(eventtime, tl, th) ### answered from cached GPS buckets where possible
             self.data['injectionsfound'] = len(Injections)
             hardware_inj = self.config.get('labelCheck', 'hardware_inj')
             if len(Injections) > 0:
                 if hardware_inj=='no':
                     self.client.writeLog(self.graceid, 'AP: Ignoring new event because we found a hardware injection +/- {0} seconds of event gpstime.'.format(th), tagname = "em_follow")
-                    self.data['injectionlogkey'] = 'yes'
+                    self.data['injectionlogkey'] = True
                     message = '{0} -- {1} -- Ignoring new event because we found a hardware injection +/- {2} seconds of event gpstime.'.format(convertTime(), self.graceid, th)
                     if loggerCheck(self.data, message)==False:
                         self.logger.info(message)
@@ -292,7 +880,7 @@ class EventDict():
                     return False
                 else:
                     self.client.writeLog(self.graceid, 'AP: Found hardware injection +/- {0} seconds of event gpstime but treating as real event in config.'.format(th), tagname = "em_follow")
-                    self.data['injectionlogkey'] = 'yes'
+                    self.data['injectionlogkey'] = True
                     message = '{0} -- {1} -- Found hardware injection +/- {2} seconds of event gpstime but treating as real event in config.'.format(convertTime(), self.graceid, th)
                     if loggerCheck(self.data, message)==False:
                         self.logger.info(message)
@@ -302,7 +890,7 @@ class EventDict():
                     return True
             elif len(Injections)==0:
                 self.client.writeLog(self.graceid, 'AP: No hardware injection found near event gpstime +/- {0} seconds.'.format(th), tagname="em_follow")
-                self.data['injectionlogkey'] = 'yes'
+                self.data['injectionlogkey'] = True
                 message = '{0} -- {1} -- No hardware injection found near event gpstime +/- {2} seconds.'.format(convertTime(), self.graceid, th)
                 if loggerCheck(self.data, message)==False:
                     self.logger.info(message)
@@ -322,12 +910,11 @@ class EventDict():
         # if return True, we have a new lvem skymap
         # otherwise, add this Check to queueByGraceID
         currentstate = self.data['currentstate']
-        lvemskymaps  = self.data['lvemskymaps'].keys()
+        lvemskymaps  = self.data['lvemskymaps']
         if currentstate=='preliminary_to_initial':
             if len(lvemskymaps)>=1:
                 self.data['have_lvem_skymapCheckresult'] = True
-                skymap = sorted(lvemskymaps)[-1]
-                skymap = re.findall(r'-(\S+)', skymap)[0]
+                skymap = lvemskymaps.latest
                 message = '{0} -- {1} -- Initial skymap tagged lvem {2} available.'.format(convertTime(), self.graceid, skymap)
                 if loggerCheck(self.data, message)==False:
                     self.logger.info(message)
@@ -339,10 +926,9 @@ class EventDict():
                 return None
         elif (currentstate=='initial_to_update' or currentstate=='complete'):
             if len(lvemskymaps)>=2:
-                if lvemskymaps[-1]!=self.data['lastsentskymap']:
+                if lvemskymaps.latest!=self.data['lastsentskymap']:
                     self.data['have_lvem_skymapCheckresult'] = True
-                    skymap = sorted(lvemskymaps)[-1]
-                    skymap = re.findall(r'-(\S+)', skymap)[0]
+                    skymap = lvemskymaps.latest
                     message = '{0} -- {1} -- Update skymap tagged lvem {2} available.'.format(convertTime(), self.graceid, skymap)
                     if loggerCheck(self.data, message)==False:
                         self.logger.info(message)
@@ -414,9 +1000,9 @@ class EventDict():
                 else:
                     pass
                 if (min(idqvalues.values() and jointfapvalues.values()) < idqthresh):
-                    if idqlogkey=='no':
+                    if not idqlogkey:
                         self.client.writeLog(self.graceid, 'AP: Finished running iDQ checks. Candidate event rejected because incomplete joint min-FAP value already less than iDQ threshold. {0} < {1}'.format(min(idqvalues.values() and jointfapvalues.values()), idqthresh), tagname='em_follow')
-                        self.data['idqlogkey']='yes'
+                        self.data['idqlogkey'] = True
                     message = '{0} -- {1} -- iDQ check result: {2} < {3}'.format(convertTime(), self.graceid, min(idqvalues.values() and jointfapvalues.values()), idqthresh)
                     if loggerCheck(self.data, message)==False:
                         self.logger.info(message)
@@ -453,9 +1039,9 @@ class EventDict():
                     else:
                         pass
                 if min(jointfapvalues.values()) > idqthresh:
-                    if idqlogkey=='no':
+                    if not idqlogkey:
                         self.client.writeLog(self.graceid, 'AP: Finished running iDQ checks. Candidate event passed iDQ checks. {0} > {1}'.format(min(jointfapvalues.values()), idqthresh), tagname = 'em_follow')
-                        self.data['idqlogkey']='yes'
+                        self.data['idqlogkey'] = True
                     message = '{0} -- {1} -- Passed iDQ check: {2} > {3}.'.format(convertTime(), self.graceid, min(jointfapvalues.values()), idqthresh)
                     if loggerCheck(self.data, message)==False:
                         self.logger.info(message)
@@ -464,9 +1050,9 @@ class EventDict():
                         pass
                     return True
                 else:
-                    if idqlogkey=='no':
+                    if not idqlogkey:
                         self.client.writeLog(self.graceid, 'AP: Finished running iDQ checks. Candidate event rejected due to low iDQ FAP value. {0} < {1}'.format(min(jointfapvalues.values()), idqthresh), tagname = 'em_follow')
-                        self.data['idqlogkey'] = 'yes'
+                        self.data['idqlogkey'] = True
                     message = '{0} -- {1} -- iDQ check result: {2} < {3}'.format(convertTime(), self.graceid, min(jointfapvalues.values()), idqthresh)
                     if loggerCheck(self.data, message)==False:
                         self.logger.info(message)
@@ -489,9 +1075,9 @@ class EventDict():
             operatorsignoffs = self.data['operatorsignoffs']
             if len(operatorsignoffs) < len(instruments):
                 if 'NO' in operatorsignoffs.values():
-                    if operatorlogkey=='no':
+                    if not operatorlogkey:
                         self.client.writeLog(self.graceid, 'AP: Candidate event failed operator signoff check.', tagname = 'em_follow')
-                        self.data['operatorlogkey'] = 'yes'
+                        self.data['operatorlogkey'] = True
                         # self.client.writeLabel(self.graceid, 'DQV') [apply DQV in parseAlert when return False]
                     self.data['operator_signoffCheckresult'] = False
                     return False
@@ -503,21 +1089,21 @@ class EventDict():
                         pass
             else:
                 if 'NO' in operatorsignoffs.values():
-                    if operatorlogkey=='no':
+                    if not operatorlogkey:
                         self.client.writeLog(self.graceid, 'AP: Candidate event failed operator signoff check.', tagname = 'em_follow')
-                        self.data['operatorlogkey'] = 'yes'
+                        self.data['operatorlogkey'] = True
                         #self.client.writeLabel(self.graceid, 'DQV') [apply DQV in parseAlert when return False]
                     self.data['operator_signoffCheckresult'] = False
                     return False
                 else:
-                    if operatorlogkey=='no':
+                    if not operatorlogkey:
                         message = '{0} -- {1} -- Candidate event passed operator signoff check.'.format(convertTime(), self.graceid)
                         if loggerCheck(self.data, message)==False:
                             self.logger.info(message)
                         else:
                             pass
                         self.client.writeLog(self.graceid, 'AP: Candidate event passed operator signoff check.', tagname = 'em_follow')
-                        self.data['operatorlogkey'] = 'yes'
+                        self.data['operatorlogkey'] = True
                     self.data['operator_signoffCheckresult'] = True
                     return True
 
@@ -539,53 +1125,224 @@ class EventDict():
                     pass
             elif len(advocatesignoffs) > 0:
                 if 'NO' in advocatesignoffs:
-                    if advocatelogkey=='no':
+                    if not advocatelogkey:
                         self.client.writeLog(self.graceid, 'AP: Candidate event failed advocate signoff check.', tagname = 'em_follow')
-                        self.data['advocatelogkey'] = 'yes'
+                        self.data['advocatelogkey'] = True
                         #self.client.writeLabel(self.graceid, 'DQV') [apply DQV in parseAlert when return False]
                     self.data['advocate_signoffCheckresult'] = False
                     return False
                 else:
-                    if advocatelogkey=='no':
+                    if not advocatelogkey:
                         message = '{0} -- {1} -- Candidate event passed advocate signoff check.'.format(convertTime(), self.graceid)
                         if loggerCheck(self.data, message)==False:
                             logger.info(message)
                         else:
                             pass
                         self.client.writeLog(self.graceid, 'AP: Candidate event passed advocate signoff check.', tagname = 'em_follow')
-                        self.data['advocatelogkey'] = 'yes'
+                        self.data['advocatelogkey'] = True
                     self.data['advocate_signoffCheckresult'] = True
                     return True
 
 #-----------------------------------------------------------------------
-# Saving event dictionaries
+# Journaled persistence of event dictionaries
 #-----------------------------------------------------------------------
-def saveEventDicts(approval_processorMPfiles):
+class EventDictJournal():
+    '''
+    persists eventDictionaries as a snapshot (EventDicts.p) plus an append-only journal (EventDicts.journal)
+
+    each call to append() pickles only the event_dict that changed onto the end of the journal, so the cost of saving
+    after an alert does not grow with the number of events we are tracking.
+    once the journal holds compactEvery records it is rotated out (EventDicts.journal.N) and a background thread folds
+    the rotated journals into a new snapshot and rewrites the human readable EventDicts.txt.
+    the compaction only reads files on disk, never the live eventDictionaries, so it does not race with parseAlert.
+
+    load() rebuilds the state from the snapshot followed by any rotated journals and finally the live journal.
+    a record of (graceid, None) is a tombstone and removes graceid from the state.
+    '''
+    __header__ = struct.Struct('>Q') ### the length of each pickled record in the journal
+
+    def __init__(self, directory, compactEvery=1000):
+        self.directory    = directory
+        self.snapshot     = os.path.join(directory, 'EventDicts.p')
+        self.txt          = os.path.join(directory, 'EventDicts.txt')
+        self.journal      = os.path.join(directory, 'EventDicts.journal')
+        self.compactEvery = compactEvery
+
+        self.records   = self.__countRecords__(self.journal) ### number of records in the live journal
+        self.rotations = max([0]+[n for n, _ in self.__rotatedJournals__()]) ### index of the most recently rotated journal
+        self.compactor = None ### the background thread doing the compaction, if any
+
+    def __rotatedJournals__(self):
+        '''
+        returns [(N, path), ...] for the rotated journals still on disk, oldest first
+        '''
+        prefix = os.path.basename(self.journal)+'.'
+        rotated = []
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.startswith(prefix) and filename[len(prefix):].isdigit():
+                    rotated.append( (int(filename[len(prefix):]), os.path.join(self.directory, filename)) )
+        return sorted(rotated)
+
+    def __readRecords__(self, path):
+        '''
+        yields (graceid, event_dict) records from a journal
+        each record is a pickle preceded by its length, so a truncated record at the end (eg: we died mid-write) is recognized and ignored
+        '''
+        if not os.path.exists(path):
+            return
+        file_obj = open(path, 'rb')
+        try:
+            while True:
+                header = file_obj.read(self.__header__.size)
+                if len(header) < self.__header__.size:
+                    break
+                size, = self.__header__.unpack(header)
+                record = file_obj.read(size)
+                if len(record) < size:
+                    break
+                yield pickle.loads(record)
+        finally:
+            file_obj.close()
+
+    def __countRecords__(self, path):
+        return sum(1 for _ in self.__readRecords__(path))
+
+    def __replay__(self, state, path):
+        for graceid, event_dict in self.__readRecords__(path):
+            if event_dict is None: ### tombstone
+                state.pop(graceid, None)
+            else:
+                state[graceid] = event_dict
+
+    def append(self, graceid, event_dict):
+        '''
+        appends the current state of one event_dict (or a tombstone if event_dict is None) to the journal
+        '''
+        record = pickle.dumps((graceid, event_dict), pickle.HIGHEST_PROTOCOL)
+        file_obj = open(self.journal, 'ab')
+        file_obj.write(self.__header__.pack(len(record)) + record)
+        file_obj.close()
+        self.records += 1
+
+        if self.records >= self.compactEvery:
+            self.compact()
+
+    def compact(self, block=False):
+        '''
+        rotates the live journal out of the way and folds everything into a new snapshot in a background thread
+        if a compaction is already running, we leave the live journal alone and try again on a later append
+        '''
+        if self.compactor and self.compactor.isAlive():
+            if not block:
+                return
+            self.compactor.join()
+
+        if os.path.exists(self.journal):
+            self.rotations += 1
+            os.rename(self.journal, '{0}.{1}'.format(self.journal, self.rotations))
+        self.records = 0
+
+        self.compactor = threading.Thread(target=self.__compact__, name='EventDictJournal compaction')
+        self.compactor.daemon = True
+        self.compactor.start()
+        if block:
+            self.compactor.join()
+
+    def __compact__(self):
+        rotated = self.__rotatedJournals__()
+        state = {}
+        if os.path.exists(self.snapshot):
+            file_obj = open(self.snapshot, 'rb')
+            state = pickle.load(file_obj)
+            file_obj.close()
+        for _, path in rotated:
+            self.__replay__(state, path)
+
+        self.__writeSnapshot__(state)
+
+        for _, path in rotated: ### only forget the journals once their contents are safely in the snapshot
+            os.remove(path)
+
+    def __writeSnapshot__(self, state):
+        '''
+        writes the pickle and txt files via temporary files so a reader never sees a partial snapshot
+        '''
+        tmpname = self.snapshot+'.tmp'
+        file_obj = open(tmpname, 'wb')
+        pickle.dump(state, file_obj, pickle.HIGHEST_PROTOCOL)
+        file_obj.close()
+        os.rename(tmpname, self.snapshot)
+
+        tmpname = self.txt+'.tmp'
+        file_obj = open(tmpname, 'w')
+        for graceid in sorted(state.keys()): ### iterate through graceids
+            file_obj.write('{0}\n'.format(graceid))
+            event_dict = state[graceid]
+
+            for key in sorted(event_dict.keys()): ### iterate through keys for this graceid
+                if key not in ('loggermessages', 'loggerfingerprints'):
+                    file_obj.write('    {0}: {1}\n'.format(key, event_dict[key]))
+            file_obj.write('\n')
+        file_obj.close()
+        os.rename(tmpname, self.txt)
+
+    def checkpoint(self, state):
+        '''
+        synchronously replaces the snapshot with state and discards all journals
+        '''
+        if self.compactor and self.compactor.isAlive():
+            self.compactor.join()
+        self.__writeSnapshot__(state)
+        for _, path in self.__rotatedJournals__():
+            os.remove(path)
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        self.records = 0
+
+    def load(self):
+        '''
+        rebuilds the dictionary of event dictionaries from the snapshot and journals
+        '''
+        state = {}
+        if os.path.exists(self.snapshot): ### check to see if the file actually exists
+            file_obj = open(self.snapshot, 'rb')
+            state = pickle.load(file_obj) ### if something fails here, we want to know about it!
+            file_obj.close()
+        for _, path in self.__rotatedJournals__():
+            self.__replay__(state, path)
+        self.__replay__(state, self.journal)
+        return state
+
+global eventDictJournals # one EventDictJournal per directory, so the record counts and compaction threads persist between alerts
+eventDictJournals = {}
+
+def getEventDictJournal(approval_processorMPfiles):
     '''
-    saves eventDicts (the dictonary of event dictionaries) to a pickle file and txt file
+    returns the EventDictJournal writing into approval_processorMPfiles, creating it if needed
     '''
-    ### figure out filenames, etc.
     ### FIXME: THIS SHOULD NOT BE HARD CODED! Instead, use input arguments
     homedir = os.path.expanduser('~')
-    pklfilename = '{0}{1}/EventDicts.p'.format(homedir, approval_processorMPfiles)
-    txtfilename = '{0}{1}/EventDicts.txt'.format(homedir, approval_processorMPfiles)
-
-    ### write pickle file
-    file_obj = open(pklfilename, 'wb')
-    pickle.dump(eventDictionaries, file_obj) # note: we save eventDictionaries rather than eventDicts because we run into pickling errors with the instances saved in eventDicts
-    file_obj
-
-    ### write txt file
-    file_obj = open(txtfilename, 'w')
-    for graceid in sorted(eventDictionaries.keys()): ### iterate through graceids
-        file_obj.write('{0}\n'.format(graceid))
-        event_dict = eventDictionaries[graceid]
-
-        for key in sorted(event_dict.keys()): ### iterate through keys for this graceid
-            if key!='loggermessages':
-                file_obj.write('    {0}: {1}\n'.format(key, event_dict[key]))
-        file_obj.write('\n')
-    file_obj.close()
+    directory = '{0}{1}'.format(homedir, approval_processorMPfiles)
+    if not eventDictJournals.has_key(directory):
+        eventDictJournals[directory] = EventDictJournal(directory)
+    return eventDictJournals[directory]
+
+#-----------------------------------------------------------------------
+# Saving event dictionaries
+#-----------------------------------------------------------------------
+def saveEventDicts(approval_processorMPfiles, graceid=None):
+    '''
+    saves eventDictionaries (the dictonary of event dictionaries)
+
+    if graceid is supplied, only that event_dict is appended to the journal (a tombstone if we no longer track graceid).
+    otherwise, the full pickle and txt files are rewritten and the journal is cleared.
+    '''
+    journal = getEventDictJournal(approval_processorMPfiles)
+    if graceid is None:
+        journal.checkpoint(eventDictionaries) # note: we save eventDictionaries rather than eventDicts because we run into pickling errors with the instances saved in eventDicts
+    else:
+        journal.append(graceid, eventDictionaries.get(graceid, None))
 
 #-----------------------------------------------------------------------
 # Loading event dictionaries
@@ -593,16 +1350,127 @@ def saveEventDicts(approval_processorMPfiles):
 def loadEventDicts(approval_processorMPfiles):
     '''
     loads eventDictionaries (the dictionary of event dictionaries) to do things like resend VOEvents for an event candidate
+    the state is rebuilt from the snapshot plus the journal and replaces the contents of eventDictionaries in place,
+    so modules that imported eventDictionaries see the loaded data too.
+    event_dicts pickled as plain dictionaries (before EventRecord existed) are converted as they are loaded
     '''
-    homedir = os.path.expanduser('~')
-    pklname = '{0}{1}/EventDicts.p'.format(homedir, approval_processorMPfiles)
+    state = getEventDictJournal(approval_processorMPfiles).load()
+    eventDictionaries.clear()
+    for graceid, event_dict in state.items():
+        eventDictionaries[graceid] = event_dict if isinstance(event_dict, EventRecord) else EventRecord(event_dict)
+
+#-----------------------------------------------------------------------
+# Persisting PipelineThrottle windows
+#-----------------------------------------------------------------------
+class ThrottleJournal():
+    '''
+    persists the events tracked by each PipelineThrottle as an append-only journal (Throttles.journal) so a restart does not lose throttle history
+
+    records are (throttleKey, op, args) with
+        op='add'    : args = (group, pipeline, search, graceid, t0, gpstime)
+        op='forget' : args = t, every event received at or before t was dropped
+        op='clear'  : args = None, the throttle was reset
+    the journal also keeps the resulting state in memory; once it holds compactEvery records it is rewritten from that state.
+    unlike EventDicts.journal, the state is only ever as large as the throttle windows, so this is done synchronously.
+    '''
+    __header__ = struct.Struct('>Q') ### the length of each pickled record
+
+    def __init__(self, directory, compactEvery=1000):
+        self.journal      = os.path.join(directory, 'Throttles.journal')
+        self.compactEvery = compactEvery
 
-    if os.path.exists(pklname): ### check to see if the file actually exists
-        file_obj = open(pklname, 'rb')
-        global eventDictionaries
-        eventDictionaries = pickle.load(file_obj) ### if something fails here, we want to know about it!
+        self.state   = {}
+        self.records = 0
+        for record in self.__readRecords__():
+            self.__apply__(*record)
+            self.records += 1
+
+    def __readRecords__(self):
+        '''
+        yields records from the journal, ignoring a truncated record at the end (eg: we died mid-write)
+        '''
+        if not os.path.exists(self.journal):
+            return
+        file_obj = open(self.journal, 'rb')
+        try:
+            while True:
+                header = file_obj.read(self.__header__.size)
+                if len(header) < self.__header__.size:
+                    break
+                size, = self.__header__.unpack(header)
+                record = file_obj.read(size)
+                if len(record) < size:
+                    break
+                yield pickle.loads(record)
+        finally:
+            file_obj.close()
+
+    def __apply__(self, key, op, args):
+        if op=='add':
+            group, pipeline, search, graceid, t0, gpstime = args
+            self.state.setdefault(key, ((group, pipeline, search), []))[1].append( (graceid, t0, gpstime) )
+        elif op=='forget':
+            if self.state.has_key(key):
+                node, events = self.state[key]
+                events[:] = [event for event in events if event[1] > args]
+                if not events:
+                    self.state.pop(key)
+        elif op=='clear':
+            self.state.pop(key, None)
+
+    def __write__(self, path, records, mode):
+        file_obj = open(path, mode)
+        for record in records:
+            record = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            file_obj.write(self.__header__.pack(len(record)) + record)
         file_obj.close()
 
+    def append(self, key, op, args=None):
+        '''
+        records one change to the throttle keyed by key
+        '''
+        self.__apply__(key, op, args)
+        self.__write__(self.journal, [(key, op, args)], 'ab')
+        self.records += 1
+
+        if self.records >= self.compactEvery:
+            self.compact()
+
+    def compact(self):
+        '''
+        rewrites the journal with one 'add' record per event we still track
+        '''
+        records = []
+        for key, ((group, pipeline, search), events) in self.state.items():
+            for graceid, t0, gpstime in events:
+                records.append( (key, 'add', (group, pipeline, search, graceid, t0, gpstime)) )
+        tmpname = self.journal+'.tmp'
+        self.__write__(tmpname, records, 'wb')
+        os.rename(tmpname, self.journal)
+        self.records = len(records)
+
+    def clear(self):
+        '''
+        forgets every throttle, both in memory and on disk
+        '''
+        self.state = {}
+        if os.path.exists(self.journal):
+            os.remove(self.journal)
+        self.records = 0
+
+global throttleJournals # one ThrottleJournal per directory
+throttleJournals = {}
+
+def getThrottleJournal(approval_processorMPfiles):
+    '''
+    returns the ThrottleJournal writing into approval_processorMPfiles, creating it if needed
+    '''
+    homedir = os.path.expanduser('~')
+    directory = '{0}{1}'.format(homedir, approval_processorMPfiles)
+    if not throttleJournals.has_key(directory):
+        throttleJournals[directory] = ThrottleJournal(directory)
+    return throttleJournals[directory]
+
 #-----------------------------------------------------------------------
 # Load logger
 #-----------------------------------------------------------------------
@@ -673,23 +1541,663 @@ def makeConfigDict(config):
     }
     return configdict
 
+#-----------------------------------------------------------------------
+# Settings parsed once from the childConfig
+#-----------------------------------------------------------------------
+ThrottleSettings = namedtuple('ThrottleSettings', ['throttleWin', 'targetRate', 'requireManualReset', 'conf'])
+
+### how the Grouper ranks groups, pipelines and searches against each other (bigger is preferred, anything not listed ranks -1)
+### names are lower case because ConfigParser lower cases option names. [grouper] groupRank[...], pipelineRank[...] and searchRank[...] override these
+RankTables = namedtuple('RankTables', ['group', 'pipeline', 'search'])
+
+defaultRankTables = RankTables(
+    group    = {'cbc'  :1, ### cbc events are preferred over burst
+                'burst':0,
+               },
+    pipeline = {'gstlal'      :0, ### all pipelines are equal
+                'mbtaonline'  :0,
+                'pycbc'       :0,
+                'gstlal-spiir':0,
+                'cwb'         :0,
+                'lib'         :0,
+               },
+    search   = {'lowmass' :1,   ### events with "search" specified are preferred over events without "search" specified
+                'highmass':1,
+                'allsky'  :1,
+                ''        :0,
+               },
+)
+
+def parseRankTables(config):
+    '''
+    returns defaultRankTables updated with any groupRank[name], pipelineRank[name] or searchRank[name] options in [grouper]
+    '''
+    tables = RankTables(*[dict(table) for table in defaultRankTables])
+    if config.has_section('grouper'):
+        for option in config.options('grouper'):
+            match = re.match(r'(group|pipeline|search)rank\[(.*)\]\Z', option)
+            if match:
+                getattr(tables, match.group(1))[match.group(2).strip()] = config.getint('grouper', option)
+    return tables
+
+class Settings(namedtuple('Settings', [
+        'client',
+        'voeventerror_email',
+        'force_all_internal',
+        'preliminary_internal',
+        'forgetmenow_timeout',
+        'approval_processorMPfiles',
+        'hardware_inj',
+        'wait_for_hardware_inj',
+        'default_farthresh',
+        'time_duration',
+        'humanscimons',
+        'advocates',
+        'advocate_text',
+        'advocate_email',
+        'em_coinc_text',
+        'coinc_text',
+        'grb_email',
+        'notification_text',
+        'ignore_idq',
+        'default_idqthresh',
+        'idq_pipelines',
+        'skymap_ignore_list',
+        'grouperWin',
+        'grouping',
+        'grouperMaxWait',
+        'ranks',
+        'gracedb_writers',
+        'gracedb_retries',
+        'throttles',
+        'voevent_transport',
+        'comet_host',
+        'comet_port',
+        'voevent_workers',
+        'warmstart_horizon',
+        'injection_bucket',
+        'injection_ttl',
+        'notify_transport',
+        'notify_target',
+        'notify_rate',
+        'notify_burst',
+        'notify_dedup',
+        'notify_urgent',
+        ])):
+    '''
+    an immutable, typed view of the childConfig options used while processing alerts
+    built by loadSettings so that parseAlert does not re-read ~25 options from the ConfigParser for every alert
+    '''
+    __slots__ = ()
+
+    def throttleSettings(self, key):
+        '''
+        returns the PipelineThrottle parameters for a throttleKey, falling back to default_PipelineThrottle
+        '''
+        if self.throttles.has_key(key):
+            return self.throttles[key]
+        return self.throttles['default_PipelineThrottle']
+
+    def makeConfigDict(self):
+        '''
+        returns the configdict (see makeConfigDict) for an event_dict. It is interned and shared, so it must not be modified in place
+        '''
+        return internConfiguration({
+            'force_all_internal'  : self.force_all_internal,
+            'preliminary_internal': self.preliminary_internal,
+            'hardware_inj'        : self.hardware_inj,
+            'default_farthresh'   : self.default_farthresh,
+            'humanscimons'        : self.humanscimons,
+            'advocates'           : self.advocates,
+            'ignore_idq'          : self.ignore_idq,
+            'default_idqthresh'   : self.default_idqthresh,
+            'client'              : self.client
+        })
+
+def parseSettings(config):
+    '''
+    reads everything we need out of the config into a Settings object
+    '''
+    ### one entry per PipelineThrottle section (including default_PipelineThrottle)
+    throttles = {}
+    for section in config.sections():
+        if config.has_option(section, 'throttleWin'):
+            throttles[section] = ThrottleSettings(
+                throttleWin        = config.getfloat(section, 'throttleWin'),
+                targetRate         = config.getfloat(section, 'targetRate'),
+                requireManualReset = config.getboolean(section, 'requireManualReset'),
+                conf               = config.getfloat(section, 'conf'),
+            )
+
+    idq_pipelines = config.get('idq_joint_fapCheck', 'idq_pipelines')
+    idq_pipelines = tuple(idq_pipelines.replace(' ', '').split(','))
+
+    ### options for sending VOEvents, writing to GraceDb, notifications, warm restarts, the injection cache and the grouper, which older childConfigs may not have
+    def getdefault(section, option, default, get=config.get):
+        if config.has_option(section, option):
+            return get(section, option)
+        return default
+
+    return Settings(
+        client                    = config.get('general', 'client'),
+        voeventerror_email        = config.get('general', 'voeventerror_email'),
+        force_all_internal        = config.get('general', 'force_all_internal'),
+        preliminary_internal      = config.get('general', 'preliminary_internal'),
+        forgetmenow_timeout       = config.getfloat('general', 'forgetmenow_timeout'),
+        approval_processorMPfiles = config.get('general', 'approval_processorMPfiles'),
+        hardware_inj              = config.get('labelCheck', 'hardware_inj'),
+        wait_for_hardware_inj     = config.getfloat('labelCheck', 'wait_for_hardware_inj'),
+        default_farthresh         = config.getfloat('farCheck', 'default_farthresh'),
+        time_duration             = config.getfloat('injectionCheck', 'time_duration'),
+        humanscimons              = config.get('operator_signoffCheck', 'humanscimons'),
+        advocates                 = config.get('advocate_signoffCheck', 'advocates'),
+        advocate_text             = config.get('advocate_signoffCheck', 'advocate_text'),
+        advocate_email            = config.get('advocate_signoffCheck', 'advocate_email'),
+        em_coinc_text             = config.get('GRB_alerts', 'em_coinc_text'),
+        coinc_text                = config.get('GRB_alerts', 'coinc_text'),
+        grb_email                 = config.get('GRB_alerts', 'grb_email'),
+        notification_text         = config.get('GRB_alerts', 'notification_text'),
+        ignore_idq                = config.get('idq_joint_fapCheck', 'ignore_idq'),
+        default_idqthresh         = config.getfloat('idq_joint_fapCheck', 'default_idqthresh'),
+        idq_pipelines             = idq_pipelines,
+        skymap_ignore_list        = config.get('have_lvem_skymapCheck', 'skymap_ignore_list'),
+        grouperWin                = config.getfloat('grouper', 'grouperWin'),
+        grouping                  = getdefault('grouper', 'grouping', False, get=config.getboolean),
+        grouperMaxWait            = getdefault('grouper', 'grouperMaxWait', 60.0, get=config.getfloat),
+        ranks                     = parseRankTables(config),
+        gracedb_writers           = getdefault('general', 'gracedb_writers', 0, get=config.getint),
+        gracedb_retries           = getdefault('general', 'gracedb_retries', 3, get=config.getint),
+        throttles                 = throttles,
+        voevent_transport         = getdefault('general', 'voevent_transport', 'vtp'),
+        comet_host                = getdefault('general', 'comet_host', '127.0.0.1'),
+        comet_port                = getdefault('general', 'comet_port', 5340, get=config.getint),
+        voevent_workers           = getdefault('general', 'voevent_workers', 1, get=config.getint),
+        warmstart_horizon         = getdefault('general', 'warmstart_horizon', 0.0, get=config.getfloat),
+        injection_bucket          = getdefault('injectionCheck', 'cache_bucket', 60.0, get=config.getfloat),
+        injection_ttl             = getdefault('injectionCheck', 'cache_ttl', 30.0, get=config.getfloat),
+        notify_transport          = getdefault('general', 'notify_transport', 'sendmail'),
+        notify_target             = getdefault('general', 'notify_target', None),
+        notify_rate               = getdefault('general', 'notify_rate', 10.0, get=config.getfloat),
+        notify_burst              = getdefault('general', 'notify_burst', 5, get=config.getint),
+        notify_dedup              = getdefault('general', 'notify_dedup', 3600.0, get=config.getfloat),
+        notify_urgent             = tuple(reason for reason in getdefault('general', 'notify_urgent', 'ADVREQ').replace(' ', '').split(',') if reason),
+    )
+
+global settingsCache # maps id(config) -> (config, mtime of the childConfig, Settings)
+settingsCache = {}
+
+def loadSettings(config):
+    '''
+    returns the Settings for this config, parsing it only the first time we see the config.
+    if the config names its own file via [general] childConfig, we stat that file and re-read it
+    (into the same ConfigParser) whenever its mtime changes, so edits are picked up without a restart.
+    '''
+    path = config.get('general', 'childConfig') if config.has_option('general', 'childConfig') else None
+    mtime = os.path.getmtime(path) if (path and os.path.exists(path)) else None
+
+    key = id(config)
+    if settingsCache.has_key(key):
+        _, cachedmtime, settings = settingsCache[key]
+        if cachedmtime==mtime:
+            return settings
+        config.read(path) ### the file changed on disk since we last parsed it
+
+    settings = parseSettings(config)
+    settingsCache[key] = (config, mtime, settings) ### holding the config keeps id(config) from being reused
+    return settings
+
+#-----------------------------------------------------------------------
+# Shared GraceDb clients
+#-----------------------------------------------------------------------
+class BufferedResponse(object):
+    '''
+    holds the status, headers and body of an HTTPResponse that has already been read off its connection
+    this frees the connection for the next request regardless of whether the caller ever reads the response
+    '''
+    def __init__(self, response):
+        self.status  = response.status
+        self.reason  = response.reason
+        self.headers = response.getheaders()
+        self.body    = response.read()
+
+    def getheader(self, name, default=None):
+        name = name.lower()
+        for key, val in self.headers:
+            if key.lower()==name:
+                return val
+        return default
+
+    def getheaders(self):
+        return self.headers
+
+    def read(self, amt=None):
+        body = self.body
+        self.body = ''
+        return body
+
+class PooledGraceDb(GraceDb):
+    '''
+    a GraceDb client that keeps one HTTPS connection alive per thread instead of opening a new one, and paying for a new
+    TLS handshake, on every request. A connection that has gone stale (eg: the server closed it while we were idle)
+    is replaced and the request retried once, but only if nothing but idempotent requests (GET, HEAD) went out on it.
+    once a POST or PUT (writeLog, writeLabel, createVOEvent, ...) has been handed to the connection it may have reached the server,
+    so retrying could log, label or send a VOEvent twice. GraceDb primes every POST and PUT with a GET on the same connection,
+    which is where a stale connection normally shows up.
+    '''
+    __idempotent__ = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+    def __init__(self, *args, **kwargs):
+        GraceDb.__init__(self, *args, **kwargs)
+        self.__local__ = threading.local()
+
+    def getConnection(self):
+        conn = getattr(self.__local__, 'conn', None)
+        if conn is None:
+            conn = self.__local__.conn = self.connector()
+        return conn
+
+    def get_response(self, conn):
+        return BufferedResponse(GraceDb.get_response(self, conn))
+
+    def make_request(self, conn, method, *args, **kwargs):
+        if method.upper() not in self.__idempotent__:
+            self.__local__.unsafe = True ### from here on the server may have seen this request
+        return GraceDb.make_request(self, conn, method, *args, **kwargs)
+
+    def request(self, method, *args, **kwargs):
+        reused = getattr(self.__local__, 'conn', None) is not None
+        self.__local__.unsafe = False
+        try:
+            return GraceDb.request(self, method, *args, **kwargs)
+        except HTTPError:
+            raise
+        except Exception:
+            self.__local__.conn = None ### never reuse a connection that failed
+            if (not reused) or self.__local__.unsafe:
+                raise
+            return GraceDb.request(self, method, *args, **kwargs) ### the connection we reused had gone stale before anything unsafe was sent; try once on a fresh one
+
+global graceDbClients # maps service_url -> the GraceDb client shared by everything talking to that server
+graceDbClients = {}
+
+def getGraceDb(service_url):
+    '''
+    returns the shared GraceDb client for service_url, creating it the first time
+    clients that do not expose their connections (newer, requests based versions of ligo-gracedb already pool them) are used as is
+    '''
+    if not graceDbClients.has_key(service_url):
+        if hasattr(GraceDb, 'getConnection'):
+            graceDbClients[service_url] = PooledGraceDb(service_url)
+        else:
+            graceDbClients[service_url] = GraceDb(service_url)
+    return graceDbClients[service_url]
+
+### labels that set off processing elsewhere as soon as they are applied, so they are never left waiting in a WriteBehindGraceDb
+syncLabels = ('EM_READY', 'PE_READY', 'DQV')
+
+def isMergeableLog(message):
+    '''
+    log messages we parse back out of GraceDb (see classifyComment) must stay a log message of their own
+    '''
+    return classifyComment(message) is None
+
+global writeBehindClients # maps (service_url, workers, retries) -> WriteBehindGraceDb
+writeBehindClients = {}
+
+def getWriteBehindGraceDb(config):
+    '''
+    returns the GraceDb client parseAlert should use: the shared client from getGraceDb, wrapped in a WriteBehindGraceDb
+    so that writeLog and writeLabel happen in the background. [general] gracedb_writers = 0 (the default) writes synchronously as before
+    '''
+    settings = loadSettings(config)
+    if settings.gracedb_writers <= 0:
+        return getGraceDb(settings.client)
+    key = (settings.client, settings.gracedb_writers, settings.gracedb_retries)
+    if not writeBehindClients.has_key(key):
+        writeBehindClients[key] = WriteBehindGraceDb(getGraceDb(settings.client), workers=settings.gracedb_writers, retries=settings.gracedb_retries, syncLabels=syncLabels, mergeable=isMergeableLog, logger=logging.getLogger('approval_processorMP'))
+    return writeBehindClients[key]
+
+#-----------------------------------------------------------------------
+# Shared VOEvent dispatcher
+#-----------------------------------------------------------------------
+global voeventDispatchers # maps (transport, host, port, workers) -> VOEventDispatcher
+voeventDispatchers = {}
+
+def getVOEventDispatcher(config):
+    '''
+    returns the VOEventDispatcher described by the childConfig, starting its worker threads the first time
+    '''
+    settings = loadSettings(config)
+    key = (settings.voevent_transport, settings.comet_host, settings.comet_port, settings.voevent_workers)
+    if not voeventDispatchers.has_key(key):
+        if not transports.has_key(settings.voevent_transport):
+            raise ValueError('voevent_transport=%s not understood. Must be one of : %s'%(settings.voevent_transport, ', '.join(sorted(transports.keys()))))
+        transport = functools.partial(transports[settings.voevent_transport], host=settings.comet_host, port=settings.comet_port)
+        voeventDispatchers[key] = VOEventDispatcher(transport, workers=settings.voevent_workers)
+    return voeventDispatchers[key]
+
+#-----------------------------------------------------------------------
+# Shared Notifier
+#-----------------------------------------------------------------------
+global notifiers # maps (transport, target, rate, burst, dedup, urgent) -> Notifier
+notifiers = {}
+
+def getNotifier(config):
+    '''
+    returns the Notifier described by the childConfig, starting its worker thread the first time
+    '''
+    settings = loadSettings(config)
+    key = (settings.notify_transport, settings.notify_target, settings.notify_rate, settings.notify_burst, settings.notify_dedup, settings.notify_urgent)
+    if not notifiers.has_key(key):
+        if not notifierTransports.has_key(settings.notify_transport):
+            raise ValueError('notify_transport=%s not understood. Must be one of : %s'%(settings.notify_transport, ', '.join(sorted(notifierTransports.keys()))))
+        transport = notifierTransports[settings.notify_transport](target=settings.notify_target)
+        notifiers[key] = Notifier(transport, rate=settings.notify_rate, burst=settings.notify_burst, dedup=settings.notify_dedup, urgent=settings.notify_urgent, logger=logging.getLogger('approval_processorMP'))
+    return notifiers[key]
+
+#-----------------------------------------------------------------------
+# Shared HardwareInjection cache
+#-----------------------------------------------------------------------
+class InjectionCache(object):
+    '''
+    answers raven HardwareInjection queries locally from lists of injections fetched per GPS interval.
+    GPS time is cut into buckets of `bucket` seconds aligned on multiples of `bucket` (the GPS minute by default).
+    a window query fetches every bucket it overlaps that we do not have (adjacent ones together in a single raven query)
+    and then filters the cached injections down to the window, so triggers close together in time share one lookup.
+
+    buckets are refetched once they are older than `ttl` seconds, because injections may still be uploaded for recent times.
+    '''
+    def __init__(self, bucket=60.0, ttl=30.0):
+        self.bucket  = bucket
+        self.ttl     = ttl
+        self.buckets = {} ### bucket index -> (time fetched, [injection, injection, ...])
+        self.queries = 0  ### the number of raven queries made, for bookkeeping
+
+    def __bucketIndex__(self, gpstime):
+        return int(gpstime//self.bucket)
+
+    def __expire__(self, now):
+        for ind in [ind for ind, (fetched, _) in self.buckets.items() if now-fetched >= self.ttl]:
+            self.buckets.pop(ind)
+
+    def __fetch__(self, first, last, now):
+        '''
+        fetches the buckets first through last (inclusive) with a single raven query
+        injections on the boundary between two buckets are stored only in the later one
+        '''
+        from raven.search import query
+        start = first*self.bucket
+        Injections = query('HardwareInjection', start, 0, (last+1-first)*self.bucket)
+        self.queries += 1
+        for ind in xrange(first, last+1):
+            self.buckets[ind] = (now, [])
+        for injection in Injections:
+            ind = self.__bucketIndex__(float(injection['gpstime']))
+            if first <= ind <= last:
+                self.buckets[ind][1].append(injection)
+
+    def prefetch(self, start, end=None):
+        '''
+        makes sure every bucket overlapping [start, end] is cached and current. With only start, this fetches the bucket holding that GPS time
+        '''
+        if end is None:
+            end = start
+        now = time.time()
+        self.__expire__(now)
+        missing = [ind for ind in xrange(self.__bucketIndex__(start), self.__bucketIndex__(end)+1) if not self.buckets.has_key(ind)]
+        while missing: ### one query per run of adjacent missing buckets
+            first = last = missing.pop(0)
+            while missing and missing[0]==last+1:
+                last = missing.pop(0)
+            self.__fetch__(first, last, now)
+
+    def query(self, gpstime, tl, th):
+        '''
+        returns the injections with gpstime+tl <= injection gpstime <= gpstime+th, like raven.search.query('HardwareInjection', gpstime, tl, th)
+        '''
+        start = gpstime + tl
+        end = gpstime + th
+        self.prefetch(start, end)
+        Injections = []
+        for ind in xrange(self.__bucketIndex__(start), self.__bucketIndex__(end)+1):
+            Injections += [injection for injection in self.buckets[ind][1] if start <= float(injection['gpstime']) <= end]
+        return Injections
+
+global injectionCaches # maps (bucket, ttl) -> InjectionCache
+injectionCaches = {}
+
+def getInjectionCache(config):
+    '''
+    returns the InjectionCache described by the childConfig, creating it the first time
+    '''
+    settings = loadSettings(config)
+    key = (settings.injection_bucket, settings.injection_ttl)
+    if not injectionCaches.has_key(key):
+        injectionCaches[key] = InjectionCache(bucket=settings.injection_bucket, ttl=settings.injection_ttl)
+    return injectionCaches[key]
+
 #-----------------------------------------------------------------------
 # Utilities
 #-----------------------------------------------------------------------
+class FetchPool(object):
+    '''
+    long-lived threads that make fetchConcurrently's fetches. PooledGraceDb keeps one connection per thread, so running the fetches
+    on the same threads every time reuses their connections instead of opening (and handshaking) new ones for every rebuild.
+    threads are only started as more concurrent fetches are asked for, and never stop
+    '''
+    def __init__(self):
+        self.jobs = Queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = 0
+
+    def __work__(self):
+        while True:
+            fetch, ind, done = self.jobs.get()
+            try:
+                fetch(ind)
+            finally:
+                done.put(ind)
+
+    def submit(self, fetch, inds):
+        '''
+        calls fetch(ind) for each of inds on the pool's threads and returns a Queue that receives each ind once fetch(ind) has returned
+        '''
+        self.lock.acquire()
+        try:
+            while self.workers < len(inds):
+                thread = threading.Thread(target=self.__work__, name='FetchPool-%d'%self.workers)
+                thread.daemon = True
+                thread.start()
+                self.workers += 1
+        finally:
+            self.lock.release()
+        done = Queue.Queue()
+        for ind in inds:
+            self.jobs.put( (fetch, ind, done) )
+        return done
+
+global fetchPool # the threads fetchConcurrently runs fetches on
+fetchPool = FetchPool()
+
+def fetchConcurrently(*fetches):
+    '''
+    calls each of fetches (functions taking no arguments) concurrently and returns their results in order
+    the first is called on this thread and the rest on fetchPool's threads, so each keeps its connection to GraceDb between calls.
+    used to overlap the round trips to GraceDb; if any fetch raises, the first exception (in order) is re-raised once all have finished
+    '''
+    results = [None]*len(fetches)
+    errors = [None]*len(fetches)
+    def fetch(ind):
+        try:
+            results[ind] = fetches[ind]()
+        except Exception:
+            errors[ind] = sys.exc_info()
+    inds = range(1, len(fetches))
+    done = fetchPool.submit(fetch, inds)
+    if fetches:
+        fetch(0) ### no need for another thread to do the first one
+    for ind in inds:
+        done.get()
+    for error in errors:
+        if error:
+            raise error[0], error[1], error[2]
+    return results
+
+__voeventTypes__ = {'PR':'preliminary', 'IN':'initial', 'UP':'update', 'RE':'retraction'}
+
+#-----------------------------------------------------------------------
+# Reading VOEvents
+#-----------------------------------------------------------------------
+VOEventParams = namedtuple('VOEventParams', ['internal', 'vetted', 'open_alert', 'hardware_inj', 'skymap'])
+
+__voeventParams__ = {'internal':'internal', 'Vetted':'vetted', 'OpenAlert':'open_alert', 'HardwareInj':'hardware_inj', 'skymap_fits_basic':'skymap'} ### Param name -> VOEventParams field
+
+VOEVENTCACHE_SIZE = 1000 ### the number of VOEvents for which we remember the parameters
+
+global voeventCache # ivorn -> VOEventParams
+voeventCache = OrderedDict()
+
+def readVOEventParams(voevent_text):
+    '''
+    reads the Params we care about out of the xml text of a VOEvent in one incremental pass, stopping as soon as we have them all
+    returns VOEventParams. skymap is the filename of the skymap_fits_basic url (or None if there is no skymap)
+    '''
+    if isinstance(voevent_text, unicode): ### the parser wants the bytes the xml declaration describes
+        voevent_text = voevent_text.encode('utf-8')
+    values = {}
+    for event, element in ElementTree.iterparse(StringIO(voevent_text), events=('end',)):
+        if element.tag.rsplit('}', 1)[-1]=='Param': ### ignore the namespace, if any
+            name = element.get('name')
+            if __voeventParams__.has_key(name):
+                values[__voeventParams__[name]] = element.get('value')
+                if len(values)==len(__voeventParams__):
+                    break
+        element.clear() ### we never look back, so do not keep the tree around
+    skymap = values.get('skymap')
+    if skymap:
+        skymap = skymap.split('files/', 1)[-1]
+    else:
+        skymap = None
+    return VOEventParams(values['internal'], values['vetted'], values['open_alert'], values['hardware_inj'], skymap)
+
+def getVOEventParams(graceid, voevent):
+    '''
+    returns VOEventParams for a voevent dictionary from GraceDb. Each VOEvent is only parsed once; after that it is taken from voeventCache
+    VOEvents never change once sent, so they are identified by ivorn (or by graceid and number if GraceDb did not give us one)
+    '''
+    ivorn = voevent.get('ivorn') or (graceid, voevent['N'])
+    if voeventCache.has_key(ivorn):
+        params = voeventCache.pop(ivorn)
+    else:
+        params = readVOEventParams(voevent['text'])
+    voeventCache[ivorn] = params ### most recently used VOEvents live at the end
+    while len(voeventCache) > VOEVENTCACHE_SIZE:
+        voeventCache.popitem(last=False)
+    return params
+
+### the log comments EventDict.update cares about. The group that matched identifies the kind of message
+#-----------------------------------------------------------------------
+# Classifying log comments
+#-----------------------------------------------------------------------
+LogComment = namedtuple('LogComment', ['kind', 'comment', 'fields'])
+
+### (kind, pattern) for every log comment we act on. each pattern captures the fields we need as (?P<kind_field>...)
+### \A anchors to the start of the comment and ^ to the start of any line in it; the rest may appear anywhere in the comment
+__logCommentKinds__ = [
+    ('idq',          r'\Aminimum glitch-FAP for (?P<idq_pipeline>.*) at (?P<idq_detector>.*) with.*?is (?P<idq_minfap>.*)'),
+    ('resent',       r'\Aresent VOEvent (?P<resent_voevent>.*) in (?P<resent_key>.*)'),
+    ('far_rejected', r'\AAP: Candidate event rejected due to large FAR.*?>= (?P<far_rejected_farthresh>.*)'),
+    ('far_passed',   r'\AAP: Candidate event has low enough FAR.*?< (?P<far_passed_farthresh>.*)'),
+    ('em_bright',    r'EM-Bright probabilities computed from detection pipeline[\s\S]*?The probability of second object being a neutron star  = (?P<em_bright_ProbHasNS>.*)% \n  The probability of remnant mass outside the black hole in excess of (?P<em_bright_RemnantThresh>.*) M_sun = (?P<em_bright_ProbHasRemnant>.*)% \n'),
+    ('raven',        r'Temporal coincidence with external trigger (?P<raven_link>.*)>(?P<raven_exttrig>.*)<(?P<raven_rest>.*) gives a coincident FAR = (?P<raven_far>.*) Hz'),
+    ('grb_coinc',    r'^(?P<grb_coinc_pipeline>.*): Significant event in on-source \(FAP = (?P<grb_coinc_fap>.*) for the most significant event\)'),
+    ('coinc_json',   r'GRB-GW Coincidence JSON file: (?P<coinc_json_type>.*)'),
+]
+
+__logCommentPattern__ = re.compile('|'.join('(?P<%s>%s)'%(kind, pattern) for kind, pattern in __logCommentKinds__), re.MULTILINE)
+__logCommentFields__ = dict((kind, [(name[len(kind)+1:], name) for name in re.compile(pattern).groupindex.keys()]) for kind, pattern in __logCommentKinds__)
+
+def classifyComment(comment):
+    '''
+    classifies a log comment in a single pass of one compiled regex
+    returns LogComment(kind, comment, fields) with the fields the record_* helpers need, or None if we do not act on this comment
+    '''
+    match = __logCommentPattern__.search(comment)
+    if not match:
+        return None
+    kind = match.lastgroup ### the alternative that matched is the last (outermost) group to close
+    return LogComment(kind, comment, dict((field, match.group(name)) for field, name in __logCommentFields__[kind]))
+
+__updateKinds__ = dict.fromkeys(['idq', 'em_bright', 'far_rejected', 'far_passed']) ### the kinds of comments EventDict.update acts on
+
+LOGCACHE_SIZE = 1000 ### the number of graceids for which we remember parsed logs
+
+global logCache # graceid -> (number of log entries parsed, [(filename, submitter), ...], [LogComment, ...])
+logCache = OrderedDict()
+
+def parseLogs(graceid, log_dicts):
+    '''
+    makes a single pass through the log entries (oldest first) and returns
+        skymaps : [(filename, submitter), ...] for lvem tagged fits files
+        records : [LogComment, ...] for comments EventDict.update acts on (see classifyComment)
+    both are ordered oldest first. Entries already parsed for this graceid are taken from logCache; only new ones are parsed.
+    '''
+    if logCache.has_key(graceid):
+        nparsed, skymaps, records = logCache.pop(graceid)
+        if nparsed > len(log_dicts): ### the log is shorter than we remember? Start over
+            nparsed, skymaps, records = 0, [], []
+    else:
+        nparsed, skymaps, records = 0, [], []
+    skymaps = list(skymaps)
+    records = list(records)
+
+    for message in log_dicts[nparsed:]:
+        if 'lvem' in message['tag_names'] and '.fits' in message['filename']:
+            skymaps.append( (message['filename'], message['issuer']['display_name']) )
+        record = classifyComment(message['comment'])
+        if record and __updateKinds__.has_key(record.kind):
+            records.append( record )
+
+    logCache[graceid] = (len(log_dicts), skymaps, records) ### most recently used graceids live at the end
+    while len(logCache) > LOGCACHE_SIZE:
+        logCache.popitem(last=False)
+    return skymaps, records
+
 def convertTime(ts=None):
     if ts is None:
         ts = time.time()
     st = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
     return st
 
+### how many of the most recent messages loggerCheck keeps in loggermessages for people reading EventDicts.txt/.p
+### lookups only use loggerfingerprints, so this can be set to 0 to keep no history at all
+LOGGERMESSAGES_HISTORY = 50
+
+__loggerCheckPattern__ = re.compile(r'-- (\S+) -- (.*)') ### messages look like "time -- graceid -- text"
+
 def loggerCheck(event_dict, message):
-    loggermessages = event_dict['loggermessages']
-    graceid = event_dict['graceid']
-    message = re.findall(r'-- {0} -- (.*)'.format(graceid), message)[0]
-    if message in loggermessages:
+    '''
+    returns True if we have already seen this message for this event. Otherwise remembers it and returns False
+    messages are remembered as md5 digests in the set event_dict['loggerfingerprints'], so the check costs the same no matter how many messages came before.
+    event_dicts pickled before loggerfingerprints existed are migrated the first time they are checked.
+    '''
+    text = __loggerCheckPattern__.search(message).group(2)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    fingerprint = hashlib.md5(text).digest()
+
+    if not event_dict.has_key('loggerfingerprints'): ### an old event_dict that only has the (uncapped) list of messages
+        event_dict['loggerfingerprints'] = set(hashlib.md5(m.encode('utf-8') if isinstance(m, unicode) else m).digest() for m in event_dict['loggermessages'])
+
+    fingerprints = event_dict['loggerfingerprints']
+    if fingerprint in fingerprints:
         return True
     else:
-        event_dict['loggermessages'].append(message)
+        fingerprints.add(fingerprint)
+        loggermessages = event_dict['loggermessages']
+        loggermessages.append(text)
+        if len(loggermessages) > LOGGERMESSAGES_HISTORY:
+            del loggermessages[:len(loggermessages)-LOGGERMESSAGES_HISTORY]
         return False
 
 def is_external_trigger(alert):
@@ -720,13 +2228,21 @@ def checkLabels(labels, config):
     intersectionlist = list(set(badlabels).intersection(labels))
     return len(intersectionlist)
 
+def asLogComment(comment):
+    '''
+    the record_* helpers take either the raw comment or what classifyComment already made of it
+    '''
+    if isinstance(comment, LogComment):
+        return comment
+    return classifyComment(comment)
+
 def record_coinc_info(event_dict, comment, alert, logger):
     graceid = event_dict['graceid']
+    comment = asLogComment(comment)
     # is this a log comment from PyGRB or X-pipeline for an external trigger?
     if is_external_trigger(alert)==True:
-        coinc_info = re.findall('(.*): Significant event in on-source \(FAP = (.*) for the most significant event\)', comment)
-        coinc_pipeline = coinc_info[0][0]
-        coinc_fap = float(coinc_info[0][1])
+        coinc_pipeline = comment.fields['pipeline']
+        coinc_fap = float(comment.fields['fap'])
         message = '{0} -- {1} -- {2} coincidence found with FAP {3}.'.format(convertTime(), graceid, coinc_pipeline, coinc_fap)
         if loggerCheck(event_dict, message)==False:
             logger.info(message)
@@ -735,10 +2251,9 @@ def record_coinc_info(event_dict, comment, alert, logger):
         return coinc_pipeline, coinc_fap
     # if this a log comment from RAVEN
     else:
-        coinc_info = re.findall('Temporal coincidence with external trigger (.*)>(.*)<(.*) gives a coincident FAR = (.*) Hz', comment) # this parsing looks messy but only because the raw string we need to parse contains html code
-        exttrig = coinc_info[0][1]
+        exttrig = comment.fields['exttrig'] # the raw string contains html code, see __logCommentKinds__
         event_dict['external_trigger'] = exttrig
-        coinc_far = coinc_info[0][3]
+        coinc_far = comment.fields['far']
         message = '{0} -- {1} -- RAVEN coincidence found with FAR {2}. External trigger {3}.'.format(convertTime(), graceid, coinc_far, exttrig)
         if loggerCheck(event_dict, message)==False:
             logger.info(message)
@@ -748,8 +2263,9 @@ def record_coinc_info(event_dict, comment, alert, logger):
 
 def record_em_bright(event_dict, comment, logger):
     graceid = event_dict['graceid']
+    fields = asLogComment(comment).fields
     em_bright_info = {}
-    ProbHasNS, RemnantThresh, ProbHasRemnant = re.findall('The probability of second object being a neutron star  = (.*)% \n  The probability of remnant mass outside the black hole in excess of (.*) M_sun = (.*)% \n', comment)[0]
+    ProbHasNS, RemnantThresh, ProbHasRemnant = fields['ProbHasNS'], fields['RemnantThresh'], fields['ProbHasRemnant']
     em_bright_info['ProbHasNS'] = float(ProbHasNS)/100
     em_bright_info['ProbHasRemnant'] = float(ProbHasRemnant)/100
     em_bright_info['RemnantMassThreshInM_Sun'] = float(RemnantThresh)
@@ -760,10 +2276,18 @@ def record_em_bright(event_dict, comment, logger):
     else:
         pass
 
+def touch(event_dict, *keys):
+    '''
+    records that event_dict[key] was modified in place, so the checks reading it are run again (see EventRecord.touch)
+    '''
+    if isinstance(event_dict, EventRecord):
+        event_dict.touch(*keys)
+
 def record_label(event_dict, label):
     labels = event_dict['labels']
     graceid = event_dict['graceid']
     labels.append(label)
+    touch(event_dict, 'labels')
     message = '{0} -- {1} -- Got {2} label.'.format(convertTime(), graceid, label)
     if loggerCheck(event_dict, message)==False:
         logger.info(message)
@@ -771,29 +2295,14 @@ def record_label(event_dict, label):
         pass
 
 def current_lvem_skymap(event_dict):
-    lvemskymaps = sorted(event_dict['lvemskymaps'].keys())
-    if len(lvemskymaps)==0:
-        return None
-    else:
-        skymap = sorted(lvemskymaps)[-1]
-        skymap = re.findall(r'-(\S+)', skymap)[0]
-        return skymap
+    return event_dict['lvemskymaps'].latest
 
 def record_skymap(event_dict, skymap, submitter, logger):
     # this only records skymaps with the lvem tag
     graceid = event_dict['graceid']
-    lvemskymaps = sorted(event_dict['lvemskymaps'].keys())
-    currentnumber = len(lvemskymaps) + 1
-    skymapkey = '{0}'.format(currentnumber) + '-'+ skymap
     # check if we already have the skymap
-    count = 0
-    for map in lvemskymaps:
-        if skymap in map:
-            count += 1
-        else:
-            count +=0
-    if count==0:
-        event_dict['lvemskymaps'][skymapkey] = submitter
+    if event_dict['lvemskymaps'].add(skymap, submitter):
+        touch(event_dict, 'lvemskymaps')
         message = '{0} -- {1} -- Got the lvem skymap {2}.'.format(convertTime(), graceid, skymap)
         if loggerCheck(event_dict, message)==False:
             logger.info(message)
@@ -802,13 +2311,13 @@ def record_skymap(event_dict, skymap, submitter, logger):
 
 def record_idqvalues(event_dict, comment, logger):
     graceid = event_dict['graceid']
-    idqinfo = re.findall('minimum glitch-FAP for (.*) at (.*) with', comment)
-    idqpipeline = idqinfo[0][0]
-    idqdetector = idqinfo[0][1]
-    minfap = re.findall('is (.*)', comment)
-    minfap = float(minfap[0])
+    fields = asLogComment(comment).fields
+    idqpipeline = fields['pipeline']
+    idqdetector = fields['detector']
+    minfap = float(fields['minfap'])
     detectorstring = '{0}.{1}'.format(idqpipeline, idqdetector)
-    event_dict['idqvalues'][detectorstring] = minfap    
+    event_dict['idqvalues'][detectorstring] = minfap
+    touch(event_dict, 'idqvalues')
     message = '{0} -- {1} -- Got the minfap for {2} using {3} is {4}.'.format(convertTime(), graceid, idqdetector, idqpipeline, minfap)
     if loggerCheck(event_dict, message)==False:
         logger.info(message)
@@ -822,18 +2331,30 @@ def record_signoff(event_dict, signoff_object):
     if signofftype=='OP':
         operatorsignoffs = event_dict['operatorsignoffs']
         operatorsignoffs[instrument] = status
+        touch(event_dict, 'operatorsignoffs')
     if signofftype=='ADV':
         advocatesignoffs = event_dict['advocatesignoffs']
         advocatesignoffs.append(status)
+        touch(event_dict, 'advocatesignoffs')
 
 #-----------------------------------------------------------------------
 # process_alert
 #-----------------------------------------------------------------------
-def process_alert(event_dict, voevent_type, client, config, logger, set_internal='do nothing'):
+def process_alert(event_dict, voevent_type, client, config, logger, set_internal='do nothing', wait=False):
+    '''
+    creates a VOEvent in GraceDb and hands it to the VOEventDispatcher, which sends it to Comet in the background
+    the outcome is recorded in voevents or voeventerrors by record_voevent the next time the dispatcher delivers
+    (the start of every parseAlert and process_alert). If wait=True, we block until that has happened and return
+    'voevents, <voevent>' or 'voeventerrors, <voevent>'
+    '''
+    ### bring voevents and voeventerrors up to date with anything that finished sending since we last looked
+    dispatcher = getVOEventDispatcher(config)
+    dispatcher.deliver()
+
     graceid = event_dict['graceid']
     pipeline = event_dict['pipeline']
-    voeventerrors = event_dict['voeventerrors']
     voevents = event_dict['voevents']
+    pending = dispatcher.pending(graceid) ### the keys of VOEvents that are still being sent, which count as sent
 
     # setting default internal value settings for alerts
     force_all_internal = config.get('general', 'force_all_internal')
@@ -868,19 +2389,18 @@ def process_alert(event_dict, voevent_type, client, config, logger, set_internal
             search = event_dict['search']
             skymap_type = skymapname + '-' + group + search
             skymap_image_filename = skymapname + '.png'
-            #submitter = event_dict['lvemskymaps'][skymap_filename]
+            #submitter = event_dict['lvemskymaps'].submitter(skymap_filename)
 
     if voevent_type=='retraction':
         # check if we've sent alerts for this event
-        if len(voevents) > 0:
+        if len(voevents) > 0 or pending:
             # check if we sent a retraction alert before
-            for voevent in voevents:
-                if voevent_type in voevent:
-                    return
+            if voevents.hasType(voevent_type) or (voevent_type in [key[0] for key in pending]):
+                return
             # there are existing alerts but we haven't sent a retraction so let's do that
             if (force_all_internal!='yes') and (pipeline in preliminary_internal):
-                lastvoeventsent = voevents[-1]
-                if 'preliminary' in lastvoeventsent:
+                lastvoeventsent = pending[-1][0] if pending else voevents.last.voevent_type
+                if lastvoeventsent=='preliminary':
                     internal = 1
                 else:
                     internal = 0
@@ -905,7 +2425,7 @@ def process_alert(event_dict, voevent_type, client, config, logger, set_internal
             search = event_dict['search']
             skymap_type = skymapname + '-' + group + search
             skymap_image_filename = skymapname + '.png'
-            #submitter = event_dict['lvemskymaps'][skymap_filename]
+            #submitter = event_dict['lvemskymaps'].submitter(skymap_filename)
 
     injectionsfound = event_dict['injectionsfound']
     if injectionsfound==None:
@@ -936,9 +2456,9 @@ def process_alert(event_dict, voevent_type, client, config, logger, set_internal
     elif set_internal=='do nothing': # this will set 'internal' as whatever the config logic has it to be above
         internal = internal
 
-    thisvoevent = '(internal,vetted,open_alert,hardware_inj,skymap):({0},{1},{2},{3},{4})-'.format(internal, vetted, open_alert, hardware_inj, skymap_filename) + voevent_type
+    thisvoevent = voeventKey(voevent_type, internal, vetted, open_alert, hardware_inj, skymap_filename)
     # check if we sent this voevent before
-    if thisvoevent in str(voevents):
+    if voevents.hasKey(thisvoevent) or (thisvoevent in pending):
         message = '{0} -- {1} -- This {2} VOEvent has been sent previously.'.format(convertTime(), graceid, voevent_type)
         if loggerCheck(event_dict, message)==False:
             logger.info(message)
@@ -960,7 +2480,6 @@ def process_alert(event_dict, voevent_type, client, config, logger, set_internal
 
     logger.info('{0} -- {1} -- Creating {2} VOEvent file locally.'.format(convertTime(), graceid, voevent_type))
     voevent = None
-    thisvoevent = '{0}-'.format(len(voevents) + 1) + thisvoevent
 
     try:
         r = client.createVOEvent(graceid, voevent_type, skymap_filename = skymap_filename, skymap_type = skymap_type, 
@@ -970,45 +2489,58 @@ def process_alert(event_dict, voevent_type, client, config, logger, set_internal
     except Exception, e:        
         logger.info('{0} -- {1} -- Caught HTTPError: {2}'.format(convertTime(), graceid, str(e)))
 
-    number = str(random.random())
     if voevent:
-        tmpfile = open('/tmp/voevent_{0}_{1}.tmp'.format(graceid, number), 'w')
-        tmpfile.write(voevent)
-        tmpfile.close()
-        cmd = 'comet-sendvo -p 5340 -f /tmp/voevent_{0}_{1}.tmp'.format(graceid, number)
-        proc = sp.Popen(cmd, shell = True, stdout = sp.PIPE, stderr = sp.PIPE)
-        output, error = proc.communicate(voevent)
-        if proc.returncode==0:
-            message = '{0} VOEvent sent to GCN.'.format(voevent_type)
-            voevents.append(thisvoevent)
-            for key in voeventerrors:
-                if voevent_type in key:
-                    voeventerrors.remove(key)
-            if (voevent_type=='preliminary'):
-                event_dict['lastsentpreliminaryskymap'] = skymap_filename
-            if (voevent_type=='initial' or voevent_type=='update'):
-                event_dict['lastsentskymap'] = skymap_filename
-            else:
-                pass
-            logger.info('{0} -- {1} -- {2}'.format(convertTime(), graceid, message))
-            os.remove('/tmp/voevent_{0}_{1}.tmp'.format(graceid, number))
-            return 'voevents, {0}'.format(thisvoevent)
+        job = dispatcher.submit(graceid, thisvoevent, voevent,
+            report=functools.partial(report_voevent, event_dict, voevent_type, client, config, logger),
+            record=functools.partial(record_voevent, event_dict, voevent_type, skymap_filename, config),
+        )
+        if wait:
+            return dispatcher.wait(job)
+
+def report_voevent(event_dict, voevent_type, client, config, logger, job):
+    '''
+    called by the VOEventDispatcher's worker thread once job has been sent (or failed to send)
+    logs the outcome and, on failure, notifies GraceDb and voeventerror_email. Does not modify event_dict
+    '''
+    graceid = event_dict['graceid']
+    if job.success:
+        message = '{0} VOEvent sent to GCN.'.format(voevent_type)
+        logger.info('{0} -- {1} -- {2}'.format(convertTime(), graceid, message))
+    else:
+        message = 'Error sending {0} VOEvent! {1}.'.format(voevent_type, job.message)
+        client.writeLog(graceid, 'AP: Could not send VOEvent type {0}.'.format(voevent_type), tagname = 'em_follow')
+        logger.info('{0} -- {1} -- {2}'.format(convertTime(), graceid, message))
+        if event_dict['voeventerrors'].hasType(voevent_type):
+            pass
         else:
-            message = 'Error sending {0} VOEvent! {1}.'.format(voevent_type, error)
-            client.writeLog(graceid, 'AP: Could not send VOEvent type {0}.'.format(voevent_type), tagname = 'em_follow')
-            logger.info('{0} -- {1} -- {2}'.format(convertTime(), graceid, message))
-            os.remove('/tmp/voevent_{0}_{1}.tmp'.format(graceid, number))
-            listofvoeventerrors = ''
-            for i in range(0, len(voeventerrors)):
-                listofvoeventerrors += '{0} '.format(voeventerrors[i])
-            if voevent_type in listofvoeventerrors:
-                pass
-            else:
-                voeventerror_email = config.get('general', 'voeventerror_email')
-                os.system('echo \'{0}\' | mail -s \'Problem sending {1} VOEvent: {2}\' {3}'.format(message, graceid, voevent_type, voeventerror_email))
-            thisvoevent = '{0}-(internal,vetted,open_alert,hardware_inj,skymap):({1},{2},{3},{4},{5})-'.format(len(voeventerrors) + 1, internal, vetted, open_alert, hardware_inj, skymap_filename) + voevent_type
-            voeventerrors.append(thisvoevent)
-            return 'voeventerrors, {0}'.format(thisvoevent)
+            voeventerror_email = config.get('general', 'voeventerror_email')
+            getNotifier(config).notify(graceid, 'voeventerror-{0}'.format(voevent_type), voeventerror_email, 'Problem sending {0} VOEvent: {1}'.format(graceid, voevent_type), message)
+
+def record_voevent(event_dict, voevent_type, skymap_filename, config, job):
+    '''
+    called when the VOEventDispatcher delivers job; records the outcome in voevents or voeventerrors and saves event_dict
+    VOEvents are numbered here, in the order they finished sending
+    '''
+    graceid = event_dict['graceid']
+    voevents = event_dict['voevents']
+    voeventerrors = event_dict['voeventerrors']
+    if job.success:
+        thisvoevent = voevents.append(job.key)
+        voeventerrors.discardType(voevent_type) ### this type went out, so forget earlier failures
+        if (voevent_type=='preliminary'):
+            event_dict['lastsentpreliminaryskymap'] = skymap_filename
+        if (voevent_type=='initial' or voevent_type=='update'):
+            event_dict['lastsentskymap'] = skymap_filename
+        else:
+            pass
+        response = 'voevents, {0}'.format(thisvoevent)
+    else:
+        thisvoevent = voeventerrors.append(job.key)
+        response = 'voeventerrors, {0}'.format(thisvoevent)
+
+    if eventDictionaries.get(graceid) is event_dict: ### only save what we are tracking
+        saveEventDicts(config.get('general', 'approval_processorMPfiles'), graceid=graceid)
+    return response
 
 #-----------------------------------------------------------------------
 # in the case we need to re-send alerts from outside the running
@@ -1040,16 +2572,15 @@ def resend_alert():
     configdict = makeConfigDict(config) # make a configdict needed for the setup
     event_dict.setup(g.events(graceid).next(), graceid, configdict, g, config, logger) # filling in the basics about the event
     event_dict.update() # update the event_dict with signoffs and iDQ info, etc
-    eventDicts[graceid] = event_dict
-    eventDictionaries[graceid] = event_dict.data
+    trackEventDict(event_dict)
     if set_internal=='yes':
         print 'internal will be set to 1'
-        response = process_alert(event_dict.data, voevent_type, g, config, logger, set_internal='yes')
+        response = process_alert(event_dict.data, voevent_type, g, config, logger, set_internal='yes', wait=True)
     elif set_internal=='no':
         print 'internal will be set to 0'
-        response = process_alert(event_dict.data, voevent_type, g, config, logger, set_internal='no')
+        response = process_alert(event_dict.data, voevent_type, g, config, logger, set_internal='no', wait=True)
     elif set_internal=='do nothing':
-        response = process_alert(event_dict.data, voevent_type, g, config, logger)
+        response = process_alert(event_dict.data, voevent_type, g, config, logger, wait=True)
     # to edit event_dict in parseAlert later
     response = re.findall(r'(.*), (.*)', response)
 
@@ -1071,6 +2602,5 @@ def createTestEventDict(graceid):
     event_dict = EventDict()
     event_dict.setup(g.events(graceid).next(), graceid, configdict, g, config, logger)
     event_dict.update()
-    eventDicts[graceid] = event_dict
-    eventDictionaries[graceid] = event_dict.data
+    trackEventDict(event_dict)
     return event_dict.data
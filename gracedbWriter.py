@@ -0,0 +1,207 @@
+description = "a module that writes log messages and labels to GraceDb from background threads so approval_processorMP does not wait on them"
+author = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import time
+import threading
+import traceback
+import Queue
+
+from collections import deque
+
+#-------------------------------------------------
+# Annotations
+#-------------------------------------------------
+
+class Annotation(object):
+    """
+    a single writeLog or writeLabel call waiting to be made
+    """
+    def __init__(self, graceid, method, args, kwargs):
+        self.graceid = graceid
+        self.method  = method
+        self.args    = args
+        self.kwargs  = kwargs
+
+    def mergeKey(self):
+        '''
+        log messages with the same graceid and keyword arguments (tagname, ...) can be sent as a single multi-line message
+        '''
+        return (self.graceid, tuple(sorted(self.kwargs.items())))
+
+#-------------------------------------------------
+# Write-behind client
+#-------------------------------------------------
+
+class WriteBehindGraceDb(object):
+    """
+    stands in for a GraceDb client. writeLog and writeLabel are queued and made from a small pool of worker threads
+    and everything else is passed straight through to the client.
+
+    annotations are assigned to workers by graceid, so the writes for a single event are always made in the order they were requested.
+    a worker takes every annotation that is waiting for it at once, and consecutive log messages for the same graceid are joined
+    into one writeLog. Messages for which mergeable(message) is False (eg: ones we parse back out of the logs later) are always sent on their own.
+    a write that fails is retried up to `retries` times, waiting backoff, 2*backoff, ... seconds in between.
+    writes we give up on are logged through logger (if given) and the most recent maxFailed of them are kept in failed.
+
+    some writes must happen before the caller goes on, so they are made on the calling thread after everything queued for that graceid:
+      writeLabel for any label in syncLabels (labels that set off processing elsewhere)
+      writeLog with a file, since callers remove the file as soon as we return
+      every other call naming a graceid (events, logs, createVOEvent, ...), so that reads see the writes that came before them
+    """
+    def __init__(self, client, workers=1, retries=3, backoff=1.0, syncLabels=(), mergeable=None, logger=None, maxFailed=100):
+        self.client     = client
+        self.retries    = retries
+        self.backoff    = backoff
+        self.syncLabels = frozenset(syncLabels)
+        self.mergeable  = mergeable
+
+        self.logger = logger
+        self.failed = deque(maxlen=maxFailed) ### annotations we gave up on
+
+        self.condition = threading.Condition()
+        self.__pending__ = {} ### graceid -> number of annotations queued but not yet made
+
+        self.workers = []
+        for ind in xrange(max(1, workers)):
+            jobs = Queue.Queue()
+            thread = threading.Thread(target=self.__work__, args=(jobs,), name='WriteBehindGraceDb-%d'%ind)
+            thread.daemon = True
+            thread.start()
+            self.workers.append( jobs )
+
+    #---------------------------------------------
+    # worker side
+    #---------------------------------------------
+
+    def __work__(self, jobs):
+        while True:
+            batch = [jobs.get()]
+            while True: ### take everything else that is already waiting
+                try:
+                    batch.append(jobs.get_nowait())
+                except Queue.Empty:
+                    break
+
+            for annotation in self.__coalesce__(batch):
+                self.__send__(annotation)
+
+            self.condition.acquire()
+            try:
+                for annotation in batch:
+                    self.__pending__[annotation.graceid] -= 1
+                    if not self.__pending__[annotation.graceid]:
+                        self.__pending__.pop(annotation.graceid)
+                self.condition.notifyAll()
+            finally:
+                self.condition.release()
+            for annotation in batch:
+                jobs.task_done()
+
+    def __isMergeable__(self, annotation):
+        if annotation.method!='writeLog' or len(annotation.args)!=1: ### only plain messages, never files
+            return False
+        return (self.mergeable is None) or self.mergeable(annotation.args[0])
+
+    def __coalesce__(self, batch):
+        '''
+        groups the batch by graceid (keeping the order within each graceid) and joins runs of mergeable log messages
+        '''
+        byGraceID = {}
+        order = []
+        for annotation in batch:
+            if not byGraceID.has_key(annotation.graceid):
+                byGraceID[annotation.graceid] = []
+                order.append(annotation.graceid)
+            byGraceID[annotation.graceid].append(annotation)
+
+        coalesced = []
+        for graceid in order:
+            run = []
+            for annotation in byGraceID[graceid] + [None]: ### None flushes the last run
+                if run and ((annotation is None) or (not self.__isMergeable__(annotation)) or (annotation.mergeKey()!=run[0].mergeKey())):
+                    if len(run)==1:
+                        coalesced.append( run[0] )
+                    else:
+                        coalesced.append( Annotation(graceid, 'writeLog', ('\n'.join(other.args[0] for other in run),), run[0].kwargs) )
+                    run = []
+                if annotation is None:
+                    break
+                if self.__isMergeable__(annotation):
+                    run.append( annotation )
+                else:
+                    coalesced.append( annotation )
+        return coalesced
+
+    def __send__(self, annotation):
+        for attempt in xrange(self.retries+1):
+            try:
+                return getattr(self.client, annotation.method)(annotation.graceid, *annotation.args, **annotation.kwargs)
+            except Exception, e: ### a worker must never die, otherwise every later annotation assigned to it would hang
+                if attempt==self.retries:
+                    self.failed.append( annotation )
+                    if self.logger is not None:
+                        self.logger.error('{0} -- {1} -- Gave up on {2}{3} after {4} attempts: {5}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), annotation.graceid, annotation.method, annotation.args, self.retries+1, e))
+                    else:
+                        traceback.print_exc()
+                else:
+                    time.sleep(self.backoff*2**attempt)
+
+    #---------------------------------------------
+    # caller side
+    #---------------------------------------------
+
+    def __submit__(self, graceid, method, args, kwargs):
+        self.condition.acquire()
+        try:
+            self.__pending__[graceid] = self.__pending__.get(graceid, 0) + 1
+        finally:
+            self.condition.release()
+        self.workers[hash(graceid)%len(self.workers)].put( Annotation(graceid, method, args, kwargs) )
+
+    def pending(self, graceid=None):
+        '''
+        returns the number of annotations for graceid (or for every graceid) that have not been made yet
+        '''
+        self.condition.acquire()
+        try:
+            if graceid is None:
+                return sum(self.__pending__.values())
+            return self.__pending__.get(graceid, 0)
+        finally:
+            self.condition.release()
+
+    def flush(self, graceid=None):
+        '''
+        blocks until every annotation queued for graceid (or for every graceid) has been made
+        '''
+        self.condition.acquire()
+        try:
+            while self.__pending__.get(graceid, 0) if graceid is not None else self.__pending__:
+                self.condition.wait()
+        finally:
+            self.condition.release()
+
+    def writeLog(self, graceid, message, *args, **kwargs):
+        if args or kwargs.get('filename'): ### a file goes along with this message
+            self.flush(graceid)
+            return self.client.writeLog(graceid, message, *args, **kwargs)
+        self.__submit__(graceid, 'writeLog', (message,), kwargs)
+
+    def writeLabel(self, graceid, label, *args, **kwargs):
+        if label in self.syncLabels:
+            self.flush(graceid)
+            return self.client.writeLabel(graceid, label, *args, **kwargs)
+        self.__submit__(graceid, 'writeLabel', (label,)+args, kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            if args and isinstance(args[0], basestring) and self.pending(args[0]): ### a call about a graceid we are still writing to
+                self.flush(args[0])
+            return attr(*args, **kwargs)
+        call.__name__ = name
+        return call
@@ -0,0 +1,259 @@
+description = "a module that sends email notifications from a background thread so approval_processorMP does not wait on them"
+author = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import os
+import re
+import time
+import socket
+import smtplib
+import threading
+import traceback
+import Queue
+
+import subprocess as sp
+
+from collections import namedtuple, OrderedDict, deque
+
+from email.mime.text import MIMEText
+
+#-------------------------------------------------
+# Notifications
+#-------------------------------------------------
+
+Notification = namedtuple('Notification', ['graceid', 'reason', 'recipients', 'subject', 'body'])
+
+def splitRecipients(recipients):
+    '''
+    the childConfig lists several addresses separated by commas and/or spaces
+    '''
+    return [recipient for recipient in re.split(r'[,\s]+', recipients) if recipient]
+
+#-------------------------------------------------
+# Transports
+# each knows how to deliver a single Notification and returns (success, message)
+#-------------------------------------------------
+
+def makeMessage(notification, sender=None):
+    '''
+    returns the notification as an email (MIMEText)
+    '''
+    message = MIMEText(notification.body)
+    message['Subject'] = notification.subject
+    if sender:
+        message['From'] = sender
+    message['To'] = ', '.join(splitRecipients(notification.recipients))
+    return message
+
+class SendmailTransport(object):
+    """
+    pipes the message into the local sendmail binary (target, /usr/sbin/sendmail by default) on stdin. No shell is involved.
+    This is what the mail command we used to shell out to does, so it works wherever that did
+    """
+    def __init__(self, target=None, sender=None):
+        self.executable = target or '/usr/sbin/sendmail'
+        self.sender     = sender
+
+    def send(self, notification):
+        cmd = [self.executable, '-oi'] + splitRecipients(notification.recipients)
+        try:
+            proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+            output, error = proc.communicate(makeMessage(notification, self.sender).as_string())
+        except OSError, e:
+            return False, 'could not run %s: %s'%(self.executable, str(e))
+        if proc.returncode==0:
+            return True, ''
+        return False, '%s exited with %d: %s'%(self.executable, proc.returncode, error.strip())
+
+class SMTPTransport(object):
+    """
+    hands the message to the SMTP server at target (host or host:port, localhost:25 by default)
+    unlike SendmailTransport, this needs a server listening there, which hosts that only have a sendmail binary may not run
+    """
+    def __init__(self, target=None, sender=None, timeout=30):
+        target = target or 'localhost'
+        if ':' in target:
+            host, port = target.rsplit(':', 1)
+            port = int(port)
+        else:
+            host, port = target, 25
+        self.host    = host
+        self.port    = port
+        self.sender  = sender or 'approval_processorMP@%s'%socket.getfqdn()
+        self.timeout = timeout
+
+    def send(self, notification):
+        recipients = splitRecipients(notification.recipients)
+        message = makeMessage(notification, self.sender)
+        try:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                refused = server.sendmail(self.sender, recipients, message.as_string())
+            finally:
+                server.quit()
+        except (smtplib.SMTPException, socket.error), e:
+            return False, 'could not send mail through %s:%d: %s'%(self.host, self.port, str(e))
+        if refused:
+            return False, 'recipients refused: %s'%(', '.join(sorted(refused.keys())))
+        return True, ''
+
+class FileTransport(object):
+    """
+    appends every notification to the file target instead of sending it. Meant for tests and dry runs
+    """
+    def __init__(self, target, sender=None):
+        self.path = os.path.expanduser(target)
+
+    def send(self, notification):
+        try:
+            obj = open(self.path, 'a')
+            try:
+                obj.write('To: %s\nSubject: %s\nX-GraceID: %s\nX-Reason: %s\n\n%s\n\n'%(notification.recipients, notification.subject, notification.graceid, notification.reason, notification.body))
+            finally:
+                obj.close()
+        except IOError, e:
+            return False, str(e)
+        return True, ''
+
+class MemoryTransport(object):
+    """
+    keeps every notification in a list. Meant for tests and offline replays
+    """
+    def __init__(self, target=None, sender=None):
+        self.notifications = []
+
+    def send(self, notification):
+        self.notifications.append(notification) ### list.append is atomic, so this is safe from the worker thread
+        return True, ''
+
+transports = {
+    'sendmail' : SendmailTransport,
+    'smtp'     : SMTPTransport,
+    'file'     : FileTransport,
+    'memory'   : MemoryTransport,
+}
+
+#-------------------------------------------------
+# Notifier
+#-------------------------------------------------
+
+class Notifier(object):
+    """
+    sends notifications (advocate pages, GRB coincidence notices, VOEvent errors, ...) from a background worker thread
+
+    notify() only queues the notification, so the alert that triggered it is not held up by the mail server.
+    a notification with the same (graceid, reason) as one queued within the last `dedup` seconds is dropped.
+    the worker sends at most `rate` notifications per minute on average, with bursts of up to `burst`; anything beyond that waits its turn,
+    so a storm of failures turns into a slow trickle of mail rather than dozens of processes or connections at once.
+    notifications whose reason is in `urgent` (advocate pages) are time critical: they have a worker of their own and are never rate limited,
+    so they are not stuck behind that trickle.
+    notifications the transport could not deliver are logged through logger (if given) and the most recent maxFailed of them are kept in failed
+    """
+    def __init__(self, transport, rate=10, burst=5, dedup=3600, urgent=('ADVREQ',), logger=None, maxFailed=100):
+        self.transport = transport
+        self.interval  = 60.0/rate if rate > 0 else 0 ### seconds per token
+        self.burst     = max(1, burst)
+        self.dedup     = dedup
+        self.urgent    = frozenset(urgent)
+
+        self.sent       = 0
+        self.suppressed = 0
+        self.failed     = deque(maxlen=maxFailed) ### (Notification, message) we gave up on
+        self.logger     = logger
+
+        self.lock = threading.Lock()
+        self.__recent__ = OrderedDict() ### (graceid, reason) -> time queued, oldest first
+
+        self.tokens = float(self.burst)
+        self.filled = time.time()
+
+        self.jobs       = Queue.Queue()
+        self.urgentJobs = Queue.Queue()
+        for jobs, wait, name in [(self.jobs, self.__wait__, 'Notifier'), (self.urgentJobs, None, 'Notifier-urgent')]:
+            thread = threading.Thread(target=self.__work__, args=(jobs, wait), name=name)
+            thread.daemon = True
+            thread.start()
+
+    #---------------------------------------------
+    # worker side
+    #---------------------------------------------
+
+    def __wait__(self):
+        '''
+        blocks until the token bucket lets us send another notification
+        '''
+        if not self.interval:
+            return
+        while True:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now-self.filled)/self.interval)
+            self.filled = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1-self.tokens)*self.interval)
+
+    def __work__(self, jobs, wait=None):
+        while True:
+            notification = jobs.get()
+            try:
+                if wait is not None:
+                    wait()
+                success, message = self.transport.send(notification)
+            except Exception, e: ### the worker must never die, otherwise every later notification would hang
+                traceback.print_exc()
+                success, message = False, str(e)
+            if success:
+                self.lock.acquire() ### both workers count here
+                try:
+                    self.sent += 1
+                finally:
+                    self.lock.release()
+            else:
+                self.failed.append( (notification, message) )
+                if self.logger is not None:
+                    self.logger.error('{0} -- {1} -- Could not send {2} notification "{3}" to {4}: {5}'.format(time.strftime('%Y-%m-%d %H:%M:%S'), notification.graceid, notification.reason, notification.subject, notification.recipients, message))
+            jobs.task_done()
+
+    #---------------------------------------------
+    # caller side
+    #---------------------------------------------
+
+    def notify(self, graceid, reason, recipients, subject, body):
+        '''
+        queues a notification. Returns False if it was dropped as a repeat of a recent one with the same (graceid, reason)
+        '''
+        now = time.time()
+        key = (graceid, reason)
+        self.lock.acquire()
+        try:
+            while self.__recent__: ### forget everything older than the dedup window
+                oldest, queued = next(self.__recent__.iteritems())
+                if now - queued < self.dedup:
+                    break
+                self.__recent__.popitem(last=False)
+            if self.__recent__.has_key(key):
+                self.suppressed += 1
+                return False
+            self.__recent__[key] = now
+        finally:
+            self.lock.release()
+        if reason in self.urgent:
+            self.urgentJobs.put( Notification(graceid, reason, recipients, subject, body) )
+        else:
+            self.jobs.put( Notification(graceid, reason, recipients, subject, body) )
+        return True
+
+    def pending(self):
+        '''
+        returns the number of notifications queued but not sent yet
+        '''
+        return self.jobs.unfinished_tasks + self.urgentJobs.unfinished_tasks
+
+    def flush(self):
+        '''
+        blocks until every queued notification has been sent (or has failed)
+        '''
+        self.urgentJobs.join()
+        self.jobs.join()
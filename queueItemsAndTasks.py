@@ -8,6 +8,7 @@ from lvalertMP.lvalert import lvalertMPutils as utils
 from ligo.gracedb.rest import GraceDb
 
 import time
+import bisect
 
 import numpy as np
 
@@ -27,6 +28,9 @@ class ForgetMeNow(utils.QueueItem):
         self.graceid = graceid ### required to look up and modify objects refering to this graceid. Also means interactiveQueue will manage queueByGraceID for us.
         self.event_dicts = event_dicts ### pointer to the big "dictionary of dictionaries" which keeps local records of events' states
         self.logger = logger ### used to redirect print statements
+        self.timeout = timeout ### remembered so renew() can build our replacement
+        self.queue = queue
+        self.queueByGraceID = queueByGraceID
         tasks = [RemoveFromEventDicts(graceid, event_dicts, timeout, logger),  ### first task removes the event from the dict of dicts
                  CleanUpQueue(graceid, queue, queueByGraceID, timeout)                ### second task removes everything from the queues
                 ]
@@ -47,6 +51,26 @@ class ForgetMeNow(utils.QueueItem):
 
         self.event_dicts[self.graceid].data['expirationtime'] = '{0} -- {1}'.format(self.expiration, convertTime(self.expiration)) ### records the expiration in local memory
 
+    def renew(self, t0):
+        '''
+        pushes the expiration back to t0+timeout without re-sorting the whole queue.
+        we cannot move an item within lvalertMP's SortedQueue, so instead this ForgetMeNow is marked complete (a tombstone that
+        interactiveQueue skips when it reaches it) and a new ForgetMeNow is inserted in its place. Only the small
+        SortedQueue for this graceid is touched beyond that. Returns the new ForgetMeNow
+        '''
+        item = ForgetMeNow(t0, self.timeout, self.graceid, self.event_dicts, self.queue, self.queueByGraceID, self.logger) ### records the new expirationtime
+        self.complete = True ### mark as complete
+        self.queue.complete += 1 ### increment self.queue's complete attribute to reflect that we marked this item as complete
+        self.queue.insert(item)
+
+        sortedQueue = self.queueByGraceID[self.graceid]
+        for ind, other in enumerate(sortedQueue):
+            if other is self:
+                sortedQueue.pop(ind)
+                break
+        sortedQueue.insert(item)
+        return item
+
 class RemoveFromEventDicts(utils.Task):
     """
     first task that gets called by ForgetMeNow; it removes the graceID  event dictionary from eventDicts
@@ -67,6 +91,7 @@ class RemoveFromEventDicts(utils.Task):
         ### FIXME: how will this know what convertTime() is? It isn't defined and it isn't passed in
         self.logger.info('{0} -- {1} -- Removing event dictionary upon expiration time.'.format(convertTime(), self.graceid)) ### record that we're removing this
         self.event_dicts.pop(self.graceid) ### remove the graceid from the dict of dicts
+        gpsTimeIndex.discard(self.graceid) ### and stop finding it by gpstime
 
 class CleanUpQueue(utils.Task):
     """
@@ -93,6 +118,44 @@ class CleanUpQueue(utils.Task):
             self.queue.complete += 1 ### increment self.queue's complete attribute to reflect that we marked this item as complete
         sortedQueue.insert(queueItem) # putting this queue item back in so that when interactiveQueue reaches the sorted queue associated with this self.graceid, it will not break
 
+#-------------------------------------------------
+# HardwareInjectionWait
+# used to give labels (INJ) time to be applied before running the new_to_preliminary checks
+#-------------------------------------------------
+
+class HardwareInjectionWait(utils.QueueItem):
+    """
+    waits wait_for_hardware_inj seconds and then runs the new_to_preliminary checks for graceid
+    this replaces a time.sleep within parseAlert, which blocked every other alert for the duration of the wait
+    """
+    name = 'hardware injection wait'
+    description = 'upon execution delegates to RecheckLabels, which re-queries labels and runs the new_to_preliminary checks'
+
+    def __init__(self, t0, timeout, graceid, callback, *args):
+        self.graceid = graceid ### required so interactiveQueue manages queueByGraceID for us
+        tasks = [RecheckLabels(graceid, callback, timeout, *args)] ### there is only one task!
+        super(HardwareInjectionWait, self).__init__(t0, tasks) ### delegate instantiation to the parent class
+
+class RecheckLabels(utils.Task):
+    """
+    the only task in HardwareInjectionWait; calls callback(graceid, *args)
+    the callback (approval_processorMPutils.new_to_preliminaryChecks) re-queries labels itself, so it sees anything applied while we waited
+    """
+    name = 'recheckLabels'
+    description = 'runs the new_to_preliminary checks for graceid'
+
+    def __init__(self, graceid, callback, timeout, *args):
+        self.graceid = graceid
+        self.callback = callback ### defined in approval_processorMPutils, which imports this module
+        self.args = args
+        super(RecheckLabels, self).__init__(timeout)
+
+    def recheckLabels(self, verbose=False, **kwargs):
+        """
+        runs the new_to_preliminary checks
+        """
+        self.callback(self.graceid, *self.args)
+
 #-------------------------------------------------
 # A common function used by PipelineThrottle and Grouper
 #-------------------------------------------------
@@ -109,12 +172,132 @@ def withinGrouperWin(trigger1, trigger2, grouperWin, eventDictionaries):
     else:
         return True, timeDiff, trigger2
 
+class DistinctTriggers(object):
+    """
+    counts the number of distinct triggers among a changing set of gpstimes.
+    gpstimes are kept sorted and neighbours closer than grouperWin belong to the same trigger, so the count is
+    1 + the number of gaps >= grouperWin between neighbours (the same test withinGrouperWin applies).
+
+    the number of gaps is updated as gpstimes are added and removed, which only requires looking at their neighbours.
+    """
+
+    def __init__(self, grouperWin):
+        self.grouperWin = grouperWin
+        self.gpstimes = [] ### sorted
+        self.gaps = 0 ### number of neighbouring pairs separated by >= grouperWin
+
+    def __len__(self):
+        if self.gpstimes:
+            return self.gaps + 1
+        return 0
+
+    def __gap__(self, left, right):
+        '''
+        returns 1 if left and right both exist and belong to different triggers, 0 otherwise
+        '''
+        if (left is None) or (right is None):
+            return 0
+        return int(right - left >= self.grouperWin)
+
+    def __change__(self, gpstime, left, right):
+        '''
+        the number of gaps gained by putting gpstime between its neighbours left and right
+        '''
+        return self.__gap__(left, gpstime) + self.__gap__(gpstime, right) - self.__gap__(left, right)
+
+    def add(self, gpstime):
+        ind = bisect.bisect_right(self.gpstimes, gpstime)
+        left  = self.gpstimes[ind-1] if ind > 0 else None
+        right = self.gpstimes[ind] if ind < len(self.gpstimes) else None
+        self.gaps += self.__change__(gpstime, left, right)
+        self.gpstimes.insert(ind, gpstime)
+
+    def remove(self, gpstime):
+        ind = bisect.bisect_left(self.gpstimes, gpstime)
+        if (ind==len(self.gpstimes)) or (self.gpstimes[ind]!=gpstime):
+            raise ValueError('gpstime=%s is not being tracked'%gpstime)
+        left  = self.gpstimes[ind-1] if ind > 0 else None
+        right = self.gpstimes[ind+1] if ind+1 < len(self.gpstimes) else None
+        self.gaps -= self.__change__(gpstime, left, right)
+        self.gpstimes.pop(ind)
+
+    def clear(self):
+        self.gpstimes = []
+        self.gaps = 0
+
 #-------------------------------------------------
 # PipelineThrottle
 # used to ignore certain pipelines when they submit too many events to GraceDb. 
 # NOTE: this will not stop GraceDb from crashing but it will prevent approval processor from being overloaded
 #-------------------------------------------------
 
+class EventWindow(object):
+    """
+    the time ordered list of (graceid, t0) tracked by a PipelineThrottle
+
+    entries live in a python list with a head offset rather than being popped off the front, so forgetting old events
+    only moves the offset (the list itself is trimmed once more than half of it is dead, which is amortized O(1)).
+    a parallel list of times lets us bisect both when inserting out of order events and when expiring.
+    supports len(), iteration and indexing (including slices) like the list it replaces.
+    """
+
+    def __init__(self):
+        self.__events__ = [] ### (graceid, t0)
+        self.__times__  = [] ### t0 for each entry in self.__events__
+        self.__head__   = 0  ### index of the oldest entry we still track
+
+    def __len__(self):
+        return len(self.__events__) - self.__head__
+
+    def __iter__(self):
+        for ind in xrange(self.__head__, len(self.__events__)):
+            yield self.__events__[ind]
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return list(self)[ind]
+        if ind < 0:
+            ind += len(self)
+        if (ind < 0) or (ind >= len(self)):
+            raise IndexError('EventWindow index out of range')
+        return self.__events__[self.__head__+ind]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def insert(self, graceid, t0):
+        '''
+        adds (graceid, t0), keeping entries ordered by t0. Events almost always arrive in order, in which case this is an append
+        '''
+        if (not self.__times__) or (t0 >= self.__times__[-1]):
+            self.__events__.append( (graceid, t0) )
+            self.__times__.append( t0 )
+        else:
+            ind = bisect.bisect_right(self.__times__, t0, self.__head__)
+            self.__events__.insert( ind, (graceid, t0) )
+            self.__times__.insert( ind, t0 )
+
+    def expire(self, t):
+        '''
+        forgets every event with t0 <= t and returns the forgotten [(graceid, t0), ...]
+        '''
+        ind = bisect.bisect_right(self.__times__, t, self.__head__)
+        expired = self.__events__[self.__head__:ind]
+        self.__head__ = ind
+        if self.__head__ > len(self.__events__)/2: ### drop the dead entries once they make up most of the list
+            del self.__events__[:self.__head__]
+            del self.__times__[:self.__head__]
+            self.__head__ = 0
+        return expired
+
+    def clear(self):
+        '''
+        forgets all events. Modifies this object in place, so every reference to it sees the change
+        '''
+        self.__events__ = []
+        self.__times__  = []
+        self.__head__   = 0
+
 def generate_ThrottleKey(group, pipeline, search=None):
     """
     computes the key assigned to self.graceid based on group, pipelin, and search
@@ -127,6 +310,62 @@ def generate_ThrottleKey(group, pipeline, search=None):
     else:
         return "%s_%s"%(group, pipeline)
 
+global NthrCache # (targetRate, win, conf) -> Nthr
+NthrCache = {}
+
+def computeNthr(targetRate, win, conf):
+    '''
+    determines the upper limit on the acceptable number of events within win based on targetRate and conf
+    assumes triggers are poisson distributed in time
+
+    finds the minimum Nthr such that
+        \sum_{n=0}^{N} p(n|targetRate*win) >= conf
+    by evaluating the (log) cumulative distribution for a whole block of N at once and searching it.
+    the block is doubled until it contains the answer. Results are memoized in NthrCache.
+    '''
+    key = (targetRate, win, conf)
+    if NthrCache.has_key(key):
+        return NthrCache[key]
+
+    ### handle special cases where algorithm won't converge
+    if (conf>1) or (conf<0):
+        raise ValueError('unphysical confidence level!')
+
+    k = targetRate*win
+    if conf==1:
+        Nthr = np.infty
+    elif (k<=0) or (conf==0): ### either no events are expected (p(0|k) = 1) or any N satisfies the bound
+        Nthr = 0
+    else:
+        logConf = np.log(conf)
+        size = int(k + 10*k**0.5) + 20 ### the quantiles we care about are a few standard deviations above the mean
+        while True:
+            n = np.arange(size)
+            logFactorial = np.concatenate(([0.], np.cumsum(np.log(n[1:])))) ### log(n!) exactly, no need for Stirling's approximation
+            logCDF = np.logaddexp.accumulate(n*np.log(k) - k - logFactorial)
+            Nthr = np.searchsorted(logCDF, logConf) ### logCDF is non-decreasing, so this is the first N with logCDF >= logConf
+            if Nthr < size:
+                Nthr = int(Nthr)
+                break
+            size *= 2
+
+    NthrCache[key] = Nthr
+    return Nthr
+
+global NthrSettings # the Settings NthrCache was last warmed up from
+NthrSettings = None
+
+def precomputeNthr(settings):
+    '''
+    warms up NthrCache with Nthr for every PipelineThrottle section in settings (see eventDictClassMethods.Settings),
+    so the PipelineThrottles created at alert time find their Nthr already computed. Only does work when settings change
+    '''
+    global NthrSettings
+    if settings is not NthrSettings:
+        for throttle in settings.throttles.values():
+            computeNthr(throttle.targetRate, throttle.throttleWin, throttle.conf)
+        NthrSettings = settings
+
 class PipelineThrottle(utils.QueueItem):
     '''
     A throttle that determines which events approval processor will actually track.
@@ -141,7 +380,7 @@ class PipelineThrottle(utils.QueueItem):
     '''
     name = 'pipeline throttle'
 
-    def __init__(self, t0, eventDicts, grouperWin, win, targetRate, group, pipeline, search=None, requireManualReset=False, conf=0.9, graceDB_url='https://gracedb.ligo.org/api/'):
+    def __init__(self, t0, eventDicts, grouperWin, win, targetRate, group, pipeline, search=None, requireManualReset=False, conf=0.9, graceDB_url='https://gracedb.ligo.org/api/', journal=None):
         self.eventDicts = eventDicts ### pointer to the dictionary of event dicts, needed for determining number of triggers with different gpstimes
         ### record data about the pipeline (equivalently, the lvalert node)
         self.group    = group
@@ -153,7 +392,7 @@ class PipelineThrottle(utils.QueueItem):
 
         self.description = "a throttle on the events approval processor will react to from %s"%(self.graceid)
 
-        self.events = [] ### list managed by Throttle task
+        self.events = EventWindow() ### managed by Throttle task
 
         self.win        = win ### the window over which we track events
         self.targetRate = targetRate ### the target rate at which we expect events
@@ -161,63 +400,18 @@ class PipelineThrottle(utils.QueueItem):
 
         self.computeNthr() ### sets self.Nthr
 
-        self.graceDB = GraceDb( graceDB_url )
+        self.graceDB = getGraceDb( graceDB_url )
 
-        tasks = [Throttle(self.events, eventDicts, grouperWin, win, self.Nthr, requireManualReset=requireManualReset) ### there is only one task!
+        tasks = [Throttle(self.events, eventDicts, grouperWin, win, self.Nthr, requireManualReset=requireManualReset, node=(group, pipeline, search), journal=journal) ### there is only one task!
                 ]
         super(PipelineThrottle, self).__init__(t0, tasks) ### delegate to parent
 
     def computeNthr(self):
         '''
         determines the upper limit on the acceptable number of events within win based on targetRate and conf
-        assumes triggers are poisson distributed in time
-
-        finds the minimum Nthr such that
-            \sum_{n=0}^{N} p(n|targetRate*win) >= conf
-        via direct iteration.
-
-        WARNING: this could be slow for large targetRate*win or large conf!
-        '''
-        ### handle special cases where algorithm won't converge
-        if (self.conf>1) or (self.conf<0):
-            raise ValueError('unphysical confidence level!')
-        elif self.conf==1:
-            self.Nthr = np.infty
-
-        ### set up direct iteration
-        k = self.targetRate*self.win
-        self.Nthr = 0
-        logProb = self.__logProb__(self.Nthr, k)
-        logConf = np.log(self.conf)
-
-        ### integrate
-        while logProb < logConf:
-            self.Nthr += 1
-            logProb = self.__sumLogs__( logProb, self.__logProb__(self.Nthr, k) )
-
-    def __sumLogs__(self, *logs ):
-        '''
-        take the sum of logarithms to high precision
-        '''
-        logs = np.array(logs)
-        maxLogs = np.max(logs)
-        return np.log( np.sum( np.exp( logs-maxLogs ) ) ) + maxLogs
-
-    def __logProb__(self, n, k):
-        '''
-        return the logarithm of the poisson probability
+        delegates to computeNthr, which memoizes the result for each (targetRate, win, conf)
         '''
-        return n*np.log(k) - k - self.__logFactorial__(n)
-
-    def __logFactorial__(self, n):
-        '''
-        return the log of a factorial, using Stirling's approximation if n >= 100
-        '''
-        if n > 20: ### use stirling's approximation because np.math.factorial returns a long float when n>20, which breaks np.log 
-                   ### this should be accurate to ~1 part in 1e4, if not more so
-            return 0.5*np.log(np.pi*2*n) + n*np.log(n) - n
-        else:
-            return np.log( np.math.factorial(n) )
+        self.Nthr = computeNthr(self.targetRate, self.win, self.conf)
 
     def isThrottled(self):
         '''
@@ -232,12 +426,7 @@ class PipelineThrottle(utils.QueueItem):
         Checks for state changes of self.throttled and applies labels in GraceDb as necessary
         '''
         wasThrottled = self.isThrottled() ### figure out if we're already throttled before adding event
-        for i, (_, t1) in enumerate(self.events): ### insert in order
-            if t0 < t1:
-                self.events.insert( i, (graceid, t0) )
-                break
-        else:
-            self.events.append( (graceid, t0) )
+        self.tasks[0].addEvent( graceid, t0 ) ### keeps events ordered by t0 and counts distinct triggers
         ### NOTE: we do not update expiration because it should be handled within a call to execute()
         ### either the expiration is too early, in which case execture() is smart enough to handle this
         ### (note, we expect events to come in in order, so we shouldn't ever have to set the expiration to earlier than it was before...)
@@ -253,6 +442,20 @@ class PipelineThrottle(utils.QueueItem):
         self.complete = False ### there is now at least one item being tracked
                               ### FIXME: need pointer to queue and queueByGraceID to update complete attribute
 
+    def restoreEvents(self, events, t0):
+        '''
+        tracks events [(graceid, t0, gpstime), ...] that were persisted by a previous instance (see ThrottleJournal)
+        nothing is labeled in GraceDb because that already happened when the events were first added.
+        events that are too old by t0 are forgotten just as manageEvents would have done, and the expiration is set accordingly.
+        call this before inserting the throttle into the queue
+        '''
+        task = self.tasks[0]
+        for graceid, t, gpstime in events:
+            task.addEvent( graceid, t, gpstime=gpstime )
+        task.manage( t0 )
+        self.sortTasks() ### picks up the task's new expiration
+        self.complete = not self.events
+
     def labelAsThrottled(self, graceid):
         """
         attempts to label the graceid as "EM_Throttled"
@@ -270,8 +473,7 @@ class PipelineThrottle(utils.QueueItem):
 
         The main use case is from within ResetThrottleTask, which uses reset() to mark the item complete and then removes it from queueByGraceID.
         '''
-        while self.events: ### modify this list in place instead of creating a new object. This way, the reference within self.tasks[0] is updated too
-            self.events.pop(0)
+        self.tasks[0].clear() ### modifies self.events in place instead of creating a new object. This way, the reference within self.tasks[0] is updated too
         self.tasks[0].expiration = -np.infty ### need to set this so that the call to self.execute is guaranteed to actually delegate to 
         self.execute( verbose=False )
 
@@ -286,12 +488,18 @@ class Throttle(utils.Task):
     name = 'manageEvents'
     description = 'a task that manages which events are tracked as part of the PipelineThrottle'
 
-    def __init__(self, events, eventDicts, grouperWin, win, Nthr, requireManualReset=False):
-        self.events = events ### list of data we're tracking. Should be a shared reference to an attribute of PipelineThrottle
+    def __init__(self, events, eventDicts, grouperWin, win, Nthr, requireManualReset=False, node=None, journal=None):
+        self.events = events ### EventWindow of data we're tracking. Should be a shared reference to an attribute of PipelineThrottle
+
+        self.node    = node ### (group, pipeline, search) of the PipelineThrottle we belong to
+        self.journal = journal ### ThrottleJournal recording every change to the events we track, if any
+        self.throttleKey = generate_ThrottleKey(*node) if node else None
 
         self.eventDicts = eventDicts ### pointer to the dictionary of event dictionaries, needed to determine number of triggers with distinct gpstimes
 
         self.grouperWin = grouperWin
+        self.distinctTriggers = DistinctTriggers(grouperWin) ### clusters of gpstimes for the events we track
+        self.gpstimes = {} ### (graceid, t0) -> gpstime for the events we track
 
         self.Nthr = Nthr
 
@@ -300,25 +508,45 @@ class Throttle(utils.Task):
         super(Throttle, self).__init__(win) ### delegate to parent. Will call setExpiration, which we overwrite to manage things as we need here
         #                               ^win is stored as timeout via delegation to Parent
 
-    def countDistinctTriggers(self): ### counts the number of triggers with distinct gpstimes; will group triggers and count them as one if their gpstimes round down to the same number
-        if len(self.events)==1:
-            return 1
-        elif len(self.events)>1: # we need at least two triggers to use the withinGrouperWin function
-            distinctTriggers = {}
-            event1 = self.events[0][0] #this is the graceid of the first trigger
-            distinctTriggers[event1] = 1 # adding in the first trigger graceid
-            for event in self.events[1:]: #cycle through the rest of the events in self.events and compare with triggers in distinctTriggers
-                event2 = event[0] # graceid of the event pulled in from self.events[1:]
-                for distinctTrigger in distinctTriggers:
-                    trueFalse, timeDiff, trigger = withinGrouperWin(event2, distinctTrigger, self.grouperWin, self.eventDicts)
-                    if trueFalse==True: # we found a trigger with similar gpstimes, so break and move on to the next event in self.events[1:]
-                        distinctTriggers[trigger] += 1 #since trigger is the one already in distinctTriggers, increase the count by 1
-                        break
-                    else:
-                        distinctTriggers[trigger] = 1 #since trigger is the new trigger from self.events[1:], count starts at 1
-            return len(distinctTriggers)
-        else:
-            return 0
+    def addEvent(self, graceid, t0, gpstime=None):
+        '''
+        starts tracking graceid, which was received at t0
+        its gpstime is looked up once here (unless supplied) and remembered, so we can stop counting it even if its event_dict is gone by the time it expires
+        '''
+        if gpstime is None:
+            gpstime = self.eventDicts[graceid]['gpstime']
+        self.events.insert( graceid, t0 )
+        self.gpstimes[(graceid, t0)] = gpstime
+        self.distinctTriggers.add( gpstime )
+        if self.journal:
+            self.journal.append( self.throttleKey, 'add', self.node+(graceid, t0, gpstime) )
+
+    def forgetEvents(self, t):
+        '''
+        stops tracking every event received at or before t
+        '''
+        expired = self.events.expire( t )
+        for key in expired:
+            self.distinctTriggers.remove( self.gpstimes.pop(key) )
+        if expired and self.journal:
+            self.journal.append( self.throttleKey, 'forget', t )
+
+    def clear(self):
+        '''
+        stops tracking all events
+        '''
+        self.events.clear()
+        self.gpstimes.clear()
+        self.distinctTriggers.clear()
+        if self.journal:
+            self.journal.append( self.throttleKey, 'clear' )
+
+    def countDistinctTriggers(self):
+        '''
+        counts the number of triggers with distinct gpstimes; triggers whose gpstimes are within grouperWin of a neighbour are grouped and counted as one
+        maintained incrementally by addEvent and forgetEvents, so this does not depend on how many events we track
+        '''
+        return len(self.distinctTriggers)
 
     def isThrottled(self):
         '''
@@ -333,14 +561,16 @@ class Throttle(utils.Task):
         the exception is if we are already throttled and we require manual reset. 
         Then we update expiration to infty and hold onto all events.
         '''
+        self.manage( time.time() )
+
+    def manage(self, now):
+        '''
+        forgets events that are too old as of now and sets the expiration accordingly
+        '''
         ### if we are not already throttled and require manual reset, we forget about events that are old enough
         if not (self.isThrottled() and self.requireManualReset):
-            t = time.time() - self.timeout ### cut off for what is "too old"
-            while len(self.events):
-                graceid, t0 = self.events.pop(0)
-                if t0 > t: ### event is recent enough that we still care about it
-                    self.events.insert(0, (graceid, t0) ) ### add it back in 
-                    break
+            t = now - self.timeout ### cut off for what is "too old"
+            self.forgetEvents( t ) ### forget everything received at or before t
 
         ### determine how we set the expiration by how many events we have left
         if self.isThrottled() and self.requireManualReset: ### we don't expire because we don't forget old events
@@ -362,16 +592,17 @@ class Grouper(utils.QueueItem):
     A QueueItem which groups neighboring GraceDb entries together and makes automatic downselection to select a preferred event.
     This is supported to enforce The Collaboration's mandte that we will only release a single alert for each "physical event".
 
-    WARNING: grouping is currently done by the time at which lvalert_listenMP recieves the alert rather than gpstime or creation time. We may want to revisit this.
+    events are grouped by gpstime: an event joins this group if its gpstime is within win of the group's gpstime (that of its first event)
+    and the group is still open. GrouperIndex finds the group for a new event from the events near it in gpstime.
 
-    as currently implemented, the group stays "open" until t0+win=closure. 
-    At this point, it begins trying to decide via delegations to it's task. 
-    If it cannot decide immediately (eg: not enough DQ info is available), it will punt "wait" seconds and try again. 
-    This polling will continue until we have enough info to decide or we reach a maximum timeout of "maxWait" after the window closes. 
+    as currently implemented, the group stays "open" until t0+win=closure, where t0 is the arrival of the first alert.
+    At this point, it tries to decide via delegation to its task.
+    If it cannot decide immediately (eg: not enough information is available), it does not poll. Instead, touch(graceid) is called whenever
+    a member's event_dict changes and we decide as soon as canDecide() allows (see decideNow), or after a maximum timeout of "maxWait" after the window closes.
     '''
     name = 'grouper'
     
-    def __init__(self, t0, win, groupTag, eventDicts, wait=1, maxWait=60, graceDB_url='https://gracedb.ligo.org/api'):
+    def __init__(self, t0, win, groupTag, eventDicts, gpstime, maxWait=60, index=None, tables=defaultRankTables, graceDB_url='https://gracedb.ligo.org/api'):
         self.graceid = groupTag ### record data bout this group
 
         self.eventDicts = eventDicts ### pointer to the dictionary of dictionaries, which we will need to determine whether a decision can be made
@@ -379,14 +610,20 @@ class Grouper(utils.QueueItem):
         self.description = "a grouper object collecting events and calling the result %s"%(groupTag)
 
         self.events = [] ### shared reference that is passed to DefineGroup task
+        self.missing = set() ### the events for which we do not yet have enough information to decide
+        self.ranks = {} ### graceid -> rankKey, shared reference that is passed to DefineGroup task
+        self.tables = tables ### the RankTables we rank events with
+
+        self.gpstime = gpstime ### where this group sits in gpstime
+        self.win = win
+        self.index = index ### the GrouperIndex that tracks us, if any
 
         self.t0 = t0
         self.closure = t0+win ### when the acceptance gate closes
 
-        self.wait = wait ### the amount we wait (repeatedly) while looking for more information before making a decision
         self.maxWait = maxWait ### the maximum amount of time after self.closure that we wait for necessary info to make a decision
 
-        tasks = [DefineGroup(self.events, eventDicts, win, graceDB_url=graceDB_url) ### only one task!
+        tasks = [DefineGroup(self.events, self.ranks, win, graceDB_url=graceDB_url) ### only one task!
                 ]
         super(Grouper, self).__init__(t0, tasks) ### delegate to parent
 
@@ -394,7 +631,13 @@ class Grouper(utils.QueueItem):
         '''
         determines whether the Group is still accepting new events
         '''
-        return time.time() < self.closure
+        return (not self.complete) and (time.time() < self.closure)
+
+    def accepts(self, gpstime):
+        '''
+        determines whether an event at gpstime belongs in this group
+        '''
+        return self.isOpen() and (abs(gpstime - self.gpstime) < self.win)
 
     def addEvent(self, graceid):
         '''
@@ -403,33 +646,103 @@ class Grouper(utils.QueueItem):
         This allows us the flexibility to ignore which groupers are still open if needed and "force" events into the mix.
         '''
         self.events.append( graceid )
+        if self.index is not None:
+            self.index.members[graceid] = self
+        self.touch( graceid )
+
+    def touch(self, graceid):
+        '''
+        re-evaluates what we know about graceid, including its rankKey. This must be called whenever its event_dict changes
+        '''
+        event_dict = self.eventDicts.get(graceid)
+        if event_dict and (event_dict.get('far') is not None) and event_dict.get('group') and event_dict.get('pipeline'):
+            self.missing.discard( graceid )
+        else:
+            self.missing.add( graceid )
+        self.ranks[graceid] = rankKey(event_dict, self.tables) if event_dict else (-np.infty,) ### events we know nothing about rank below everything else
 
     def canDecide(self):
         """
         determines whether we have enough information to make this decision
 
-        currently, we only require FAR and pipeline information, which we *know* we already have in eventDicts. 
-        Thus, we return True without doing anything.
-        
-        We may want to do something like the following for more complicated logic:
-            goodToGo = True
-            for graceid in self.events: ### iterate through events in this group
-                event_dict = self.eventDicts[graceid]
-                goodToGo *= event_dict.has_key('far') ### ensure we have FAR information
-                goodToGo *= event_dict.has_key('group') and event_dict.has_key('pipeline') and event_dict.has_key('search') ### ensure we have pipeline information
-            return goodToGo
+        currently, we require FAR and pipeline information for every event in the group.
+        This is only re-evaluated for an event when touch() reports that its event_dict changed, so this costs nothing
+        As we make decisions based on more complicated logic requiring more information, touch() will need to reflect this.
         """
-        return True
+        return not self.missing
 
     def execute(self, verbose=False ):
         '''
         override parent method to handle the case where we cannot make a decision yet
-        we can just set this up to poll every second or so until we can decide or there is a hard timeout. Then we force a decision.
+        rather than polling, we push our expiration back to the hard timeout. decideNow() is called as soon as touch() makes a decision possible
         '''
         if self.canDecide() or (time.time() > self.closure+self.maxWait): ### we can decide or we've timed out
             super(Grouper, self).execute( verbose=verbose ) ### delegate to the parent
+            if self.complete:
+                for graceid in self.events: ### remember the decision locally, so a restart does not group these events again before their labels arrive
+                    event_dict = self.eventDicts.get(graceid)
+                    if event_dict is not None:
+                        event_dict['groupergroup'] = {'groupTag':self.graceid, 'events':list(self.events)}
+                if self.index is not None:
+                    self.index.discard( self )
         else: ### we have not timed out and we cannot yet decide
-            self.setExpiration( self.t0+self.wait ) ### increment the expiration time by wait
+            self.setExpiration( self.t0+self.maxWait ) ### DefineGroup now expires at closure+maxWait
+
+    def decideNow(self, queue, queueByGraceID, verbose=False):
+        '''
+        makes the decision immediately if the window has closed and canDecide() allows it. Returns whether we decided.
+        we cannot move an item within lvalertMP's SortedQueue, so we are left in queue marked complete (a tombstone that interactiveQueue skips when it reaches it)
+        '''
+        if self.complete or (time.time() < self.closure) or (not self.canDecide()):
+            return False
+        self.setExpiration( self.t0 ) ### DefineGroup expires at closure again
+        self.execute( verbose=verbose )
+        queue.complete += 1 ### increment queue's complete attribute to reflect that we marked this item as complete
+
+        sortedQueue = queueByGraceID[self.graceid]
+        for ind, other in enumerate(sortedQueue):
+            if other is self:
+                sortedQueue.pop(ind)
+                break
+        if not len(sortedQueue):
+            queueByGraceID.pop(self.graceid)
+        return True
+
+class GrouperIndex(object):
+    '''
+    the Grouper each undecided graceid belongs to
+    the open Grouper for a new event is found through the events near it in gpstime (see GPSTimeIndex) rather than by walking every Grouper
+    '''
+    def __init__(self, index):
+        self.index = index ### GPSTimeIndex of the tracked events
+        self.members = {} ### graceid -> Grouper, filled in by Grouper.addEvent
+
+    def discard(self, grouper):
+        '''
+        forgets a Grouper once it has decided
+        '''
+        for graceid in grouper.events:
+            if self.members.get(graceid) is grouper:
+                self.members.pop(graceid)
+
+    def find(self, gpstime, win):
+        '''
+        returns the open Grouper accepting an event at gpstime, or None if there is not one
+        '''
+        for graceid in self.index.within(gpstime, win):
+            grouper = self.members.get(graceid)
+            if (grouper is not None) and grouper.accepts(gpstime):
+                return grouper
+        return None
+
+    def touch(self, graceid, queue, queueByGraceID):
+        '''
+        tells the Grouper holding graceid, if any, that its event_dict changed and lets it decide if it was only waiting for that
+        '''
+        grouper = self.members.get(graceid)
+        if grouper is not None:
+            grouper.touch( graceid )
+            grouper.decideNow( queue, queueByGraceID )
 
 class DefineGroup(utils.Task):
     '''
@@ -440,82 +753,48 @@ class DefineGroup(utils.Task):
     name = 'decide'
     description = 'a task that defines a group and selects which element is preferred'
 
-    def __init__(self, events, eventDicts, timeout, graceDB_url='https://gracedb.ligo.org/api'):
+    def __init__(self, events, ranks, timeout, graceDB_url='https://gracedb.ligo.org/api'):
         self.events = events ### shared reference to events tracked within Grouper QueueItem
-        self.eventDicts = eventDicts ### shared reference pointing to the local data about events
-        self.graceDB = GraceDb( graceDB_url )
+        self.ranks = ranks ### shared reference to the rankKey of each event, kept up to date by Grouper.touch
+        self.graceDB = getGraceDb( graceDB_url )
         super(DefineGroup, self).__init__(timeout)
+
     def decide(self, verbose=False):
         '''
         decide which event is preferred and "create the group" in GraceDb
 
-        the actual decision making process is delegated to self.choose, which compares pairs of graceid's and picks one it prefers
+        each event's preference is summarized by its rankKey (see rankKey), so the preferred event is the one with the largest key.
+        CBC events are preferred above Burst events (regardless of FAR). After downselecting based on group, event with the lowest FAR is preferred.
+        ties go to the earliest event in self.events
 
         NOTE: labeling of events occurs here (either 'Selected' or 'Superseded'
               we also must know how to make decisions with incomplete information
               As we make decisions based on more complicated logic requiring more information, we'll also need to update Grouper.canDecide() to reflect this.
         '''
-        selected = self.events[0] ### we assume there is at least one event...
-        superseded = []
-        ### iterate through remaining events and decide if we like any of them better than selected
-        for graceid in self.events[1:]:
-
-            if selected == self.choose( selected, graceid ): ### we reject graceid
-                superseded.append( graceid )
-            else: ### we reject the old selected and now prefer the new graceid
-                superseded.append( selected )
-                selected = graceid
+        if not self.events: ### nothing to decide
+            return
+        selected = max(self.events, key=self.ranks.get) ### max returns the first of several equally preferred events
 
         ### label events in GraceDb. This will initiate all the necessary processing when alert_type='label' messages are received
         self.labelAsSelected( selected )
-        for graceid in superseded:
-            self.labelAsSuperseded( graceid )
+        for graceid in self.events:
+            if graceid != selected:
+                self.labelAsSuperseded( graceid )
 
     def choose(self, graceidA, graceidB ):
         """
-        encapsulates logic that determines which event is preferred between a pair of events
-        If we can rank all pairs of events in this way, we can immediately select an overall winner by iteration (ie: what's done in self.decide)
-
-        CBC events are preferred above Burst events (regardless of FAR)
-        After downselecting based on group, event with the lowest FAR is preferred.
-        Do we want to downselect based on anything else? 
-
-        THIS CAN BECOME VERY COMPLICATED VERY QUICKLY.
-
-        returns the preferred graceid
+        returns the preferred graceid between a pair of events (graceidA if they are indistinguishable)
         """
-        event_dictA = self.eventDicts[graceidA]
-        event_dictB = self.eventDicts[graceidB]
-
-        ### choose based on group_pipeline_search using the class that does this
-        groupPipelineSearchA = GroupPipelineSearch(event_dictA['group'], event_dictA['pipeline'], event_dictA['search'])
-        groupPipelineSearchB = GroupPipelineSearch(event_dictB['group'], event_dictB['pipeline'], event_dictB['search'])
-        if groupPipelineSearchA != groupPipelineSearchB: ### we can make a decision based on this!
-            if groupPipelineSearchA > groupPipelineSearchB:
-                return graceidA
-            else:
-                return graceidB
-
-        ### choose based on FAR
-        farA = event_dictA['far']
-        farB = event_dictB['far']
-        if farA != farB: ### we can make a decision based on this!
-            if farA < farB:
-                return graceidA ### prefer the smaller far
-            else:
-                return graceidB 
-
-        ### at this point, we have two events with identical GroupPipelineSearch ranks and identical FARs
-        ### these should be "indistinguishable" so we pick the first of the two arguments
-        ### this is an arbitrary choice, but we need to make it.
-        return graceidA
+        if self.ranks[graceidA] >= self.ranks[graceidB]:
+            return graceidA
+        return graceidB
 
     def labelAsSelected(self, graceid):
         """
         attempts to label the graceid as "EM_Selected"
         """
         try:
-            self.gdb.writeLabel( graceid, "EM_Selected" )
+            self.graceDB.writeLabel( graceid, "EM_Selected" )
         except:
             pass ### FIXME: print some intelligent error message here!
 
@@ -524,7 +803,7 @@ class DefineGroup(utils.Task):
         attempts to label the graceid as "EM_Superseded"
         """
         try:
-            self.gdb.writeLabel( graceid, "EM_Superseded" )
+            self.graceDB.writeLabel( graceid, "EM_Superseded" )
         except:
             pass ### FIXME: print some intelligent error message here!
 
@@ -534,52 +813,31 @@ class GroupPipelineSearch():
 
     this is done by mapping group, pipeline, search combinations into integers and then comparing the integers
 
-    NOTE: bigger things are more preferred and the relative ranking is hard coded into immutable attributes of this class
+    NOTE: bigger things are more preferred and the relative ranking comes from RankTables (defaultRankTables unless the childConfig says otherwise)
           comparison is done first by group. If that is inconclusive, we then compare pipelines. If that is inconclusive, we then check search.
     
-    we prefer:
+    by default we prefer:
         cbc over burst
         no pipeline is prefered
         events with 'search' specified are preferred over events without 'search' specified
 
-    WARNING: if we do not know about a pariticular group, pipeline, or search, we assign a rank of -infty because we don't know about this type of event
+    WARNING: if we do not know about a pariticular group, pipeline, or search, we assign a rank of -1 because we don't know about this type of event
     '''
-    ### dictionaries that map group, pipeline, search into 
-    __groupRank__    = {'CBC'  :1, ### cbc events are preferred over burst
-                        'Burst':0,
-                       }
-    __pipelineRank__ = {'gstlal'      :0, ### all pipelines are equal
-                        'MBTAOnline'  :0,
-                        'pycbc'       :0,
-                        'gstlal-spiir':0,
-                        'CWB'         :0,
-                        'LIB'         :0,
-                       } ### all pipelines are equal
-    __searchRank__   = {'LowMass' :1,   ### events with "search" specified are preferred over events without "search" specified
-                        'HighMass':1,
-                        'AllSky'  :1,
-                        ''        :0,
-                        None      :0,
-                       }
-
-    def __init__(self, group, pipeline, search=None):
+    def __init__(self, group, pipeline, search=None, tables=defaultRankTables):
         self.group = group
-        if self.__groupRank__.has_key(group):
-            self.groupRank = self.__groupRank__[group]
-        else:
-            self.groupRank = -1
+        self.groupRank = tables.group.get((group or '').lower(), -1)
 
         self.pipeline = pipeline
-        if self.__pipelineRank__.has_key(pipeline):
-            self.pipelineRank = self.__pipelineRank__[pipeline]
-        else:
-            self.pipelineRank = -1
+        self.pipelineRank = tables.pipeline.get((pipeline or '').lower(), -1)
 
         self.search = search
-        if self.__searchRank__.has_key(search):
-            self.searchRank = self.__searchRank__[search]
-        else:
-            self.searchRank = -1
+        self.searchRank = tables.search.get((search or '').lower(), -1)
+
+    def rank(self):
+        '''
+        returns (groupRank, pipelineRank, searchRank). GroupPipelineSearch objects compare the way these tuples do
+        '''
+        return (self.groupRank, self.pipelineRank, self.searchRank)
 
     def __str__(self):
         return "%s, %s, %s : %d, %d, %d"%(self.group, self.pipeline, self.search, self.groupRank, self.pipelineRank, self.searchRank)
@@ -588,35 +846,27 @@ class GroupPipelineSearch():
         return str(self)
 
     def __eq__(self, other):
-        return (self.groupRank==other.groupRank) and (self.pipelineRank==other.pipelineRank) and (self.searchRank==other.searchRank)
+        return self.rank() == other.rank()
 
-    def __neq__(self, other):
-        return (not self==other)
+    def __ne__(self, other):
+        return self.rank() != other.rank()
 
     def __lt__(self, other):
-        if self.groupRank == other.groupRank: ### we must decide based on pipelineRank
-            if self.pipelineRank == other.pipelineRank: ### we must decide based on searchRank
-                return self.searchRank < other.searchRank ### decide based on searchRank
-
-            else: ### we can decide based on pipelinerank
-                return self.pipelineRank < other.pipelineRank
-
-        else: ### we can decide based on group alone
-            return self.groupRank < other.groupRank
+        return self.rank() < other.rank()
 
     def __gt__(self, other):
-        if self.groupRank == other.groupRank: ### we must decide based on pipelineRank
-            if self.pipelineRank == other.pipelineRank: ### we must decide based on searchRank
-                return self.searchRank > other.searchRank ### decide based on searchRank
-
-            else: ### we can decide based on pipelinerank
-                return self.pipelineRank > other.pipelineRank
-
-        else: ### we can decide based on group alone
-            return self.groupRank > other.groupRank
+        return self.rank() > other.rank()
 
     def __ge__(self, other):
-        return (not self < other)
+        return self.rank() >= other.rank()
 
     def __le__(self, other):
-        return (not self > other)
+        return self.rank() <= other.rank()
+
+def rankKey(event_dict, tables=defaultRankTables):
+    '''
+    returns the hashable key by which the Grouper prefers events: (groupRank, pipelineRank, searchRank, -far), bigger is preferred
+    an event without a FAR ranks below any other event of its kind
+    '''
+    far = event_dict.get('far')
+    return GroupPipelineSearch(event_dict.get('group'), event_dict.get('pipeline'), event_dict.get('search'), tables=tables).rank() + (-far if far is not None else -np.infty,)
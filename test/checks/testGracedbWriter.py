@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+description = "checks the order, batching, retries and read-after-write behavior of WriteBehindGraceDb"
+author = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import os
+import sys
+import time
+import logging
+import threading
+import unittest
+
+#-------------------------------------------------
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(thisdir, '..', '..')) ### approval_processorMP uses flat imports between its modules
+
+from gracedbWriter import WriteBehindGraceDb
+from eventDictClassMethods import isMergeableLog
+
+#-------------------------------------------------
+
+class RecordingGraceDb(object):
+    '''
+    a GraceDb client that records every call as (method, graceid, args, kwargs) in the order they were made
+    writeLog waits for gate, so a test can hold a worker in the middle of a write, and fails the first failures[graceid] times it is called for graceid
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.attempts = 0
+        self.failures = {}
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event() ### set whenever writeLog is called
+
+    def __record(self, method, graceid, args, kwargs):
+        self.lock.acquire()
+        try:
+            self.calls.append( (method, graceid, args, kwargs) )
+        finally:
+            self.lock.release()
+
+    def writeLog(self, graceid, message, *args, **kwargs):
+        self.entered.set()
+        self.gate.wait()
+        self.lock.acquire()
+        try:
+            self.attempts += 1
+            if self.failures.get(graceid, 0):
+                self.failures[graceid] -= 1
+                raise IOError('GraceDb is down')
+        finally:
+            self.lock.release()
+        self.__record('writeLog', graceid, (message,)+args, kwargs)
+
+    def writeLabel(self, graceid, label, *args, **kwargs):
+        self.__record('writeLabel', graceid, (label,)+args, kwargs)
+
+    def events(self, query=None, **kwargs):
+        self.__record('events', query, (), kwargs)
+        return iter([{'graceid':query}])
+
+    def messages(self, graceid=None):
+        '''
+        the log messages written, one entry per writeLog
+        '''
+        return [args[0] for method, gid, args, kwargs in self.calls if method=='writeLog' and (graceid is None or gid==graceid)]
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+#-------------------------------------------------
+
+class TestWriteBehindGraceDb(unittest.TestCase):
+
+    def setUp(self):
+        self.client = RecordingGraceDb()
+
+    def tearDown(self):
+        self.client.gate.set() ### never leave a worker stuck
+
+    def test_order_per_graceid(self):
+        '''
+        however writes are spread over the workers and batched, each graceid sees them in the order they were made
+        '''
+        writer = WriteBehindGraceDb(self.client, workers=3)
+        graceids = ['G%d'%ind for ind in xrange(10)]
+        expected = dict((graceid, []) for graceid in graceids)
+        for ind in xrange(50):
+            for graceid in graceids:
+                if ind%7==3:
+                    writer.writeLabel(graceid, 'LABEL%d'%ind)
+                    expected[graceid].append( ('writeLabel', 'LABEL%d'%ind) )
+                else:
+                    writer.writeLog(graceid, 'AP: message %d'%ind)
+                    expected[graceid].append( ('writeLog', 'AP: message %d'%ind) )
+        writer.flush()
+        self.assertEqual(writer.pending(), 0)
+
+        for graceid in graceids:
+            made = []
+            for method, gid, args, kwargs in self.client.calls:
+                if gid==graceid:
+                    made += [(method, line) for line in args[0].split('\n')] ### joined log messages count once per line
+            self.assertEqual(made, expected[graceid])
+
+    def test_classified_comments_are_not_joined(self):
+        '''
+        log messages we parse back out of GraceDb must be written on their own, everything around them may be joined
+        '''
+        writer = WriteBehindGraceDb(self.client, workers=1, mergeable=isMergeableLog)
+        self.client.gate.clear()
+        writer.writeLog('G1', 'AP: first')
+        self.client.entered.wait(5) ### the worker is now stuck writing 'AP: first', so everything below ends up in one batch
+
+        messages = ['AP: a',
+                    'AP: Candidate event has low enough FAR. 1e-09 < 1.9e-07',
+                    'AP: b',
+                    'AP: c',
+                    'minimum glitch-FAP for ovl at H1 within 5 seconds of the event is 0.52',
+                    'minimum glitch-FAP for ovl at L1 within 5 seconds of the event is 0.71',
+                    'AP: d',
+                   ]
+        for message in messages:
+            writer.writeLog('G1', message, tagname='em_follow')
+        self.client.gate.set()
+        writer.flush()
+
+        self.assertEqual(self.client.messages('G1'), ['AP: first',
+                                                      'AP: a',
+                                                      'AP: Candidate event has low enough FAR. 1e-09 < 1.9e-07',
+                                                      'AP: b\nAP: c',
+                                                      'minimum glitch-FAP for ovl at H1 within 5 seconds of the event is 0.52',
+                                                      'minimum glitch-FAP for ovl at L1 within 5 seconds of the event is 0.71',
+                                                      'AP: d',
+                                                     ])
+
+    def test_retries_with_backoff(self):
+        writer = WriteBehindGraceDb(self.client, retries=3, backoff=0.05)
+        self.client.failures['G1'] = 2
+        start = time.time()
+        writer.writeLog('G1', 'AP: message')
+        writer.flush()
+        self.assertTrue(time.time()-start >= 0.05+0.1) ### backoff, then 2*backoff
+        self.assertEqual(self.client.attempts, 3)
+        self.assertEqual(self.client.messages('G1'), ['AP: message'])
+        self.assertEqual(len(writer.failed), 0)
+
+    def test_gives_up_and_logs(self):
+        handler = ListHandler()
+        logger = logging.getLogger('testGracedbWriter')
+        logger.addHandler(handler)
+        writer = WriteBehindGraceDb(self.client, retries=2, backoff=0.01, logger=logger, maxFailed=2)
+        for graceid in ['G1', 'G2', 'G3']:
+            self.client.failures[graceid] = 3
+            writer.writeLog(graceid, 'AP: message for %s'%graceid)
+        writer.flush()
+
+        self.assertEqual(self.client.attempts, 9)
+        self.assertEqual(self.client.calls, [])
+        self.assertEqual([annotation.graceid for annotation in writer.failed], ['G2', 'G3']) ### only the most recent maxFailed are kept
+        self.assertEqual(len(handler.records), 3)
+        for record, graceid in zip(handler.records, ['G1', 'G2', 'G3']):
+            self.assertEqual(record.levelno, logging.ERROR)
+            self.assertTrue(graceid in record.getMessage())
+            self.assertTrue('Gave up on writeLog' in record.getMessage())
+
+    def test_reads_wait_for_writes(self):
+        '''
+        events(graceid) blocks until everything queued for graceid has been written, but not for other graceids
+        '''
+        writer = WriteBehindGraceDb(self.client, workers=2)
+        self.client.gate.clear()
+        writer.writeLog('G1', 'AP: message')
+        self.client.entered.wait(5)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(list(writer.events('G1'))))
+        thread.daemon = True
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(results, [])
+
+        self.assertEqual(list(writer.events('G2')), [{'graceid':'G2'}]) ### nothing queued for G2, so this goes straight through
+
+        self.client.gate.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [[{'graceid':'G1'}]])
+        self.assertEqual([method for method, graceid, args, kwargs in self.client.calls if graceid=='G1'], ['writeLog', 'events'])
+
+    def test_sync_writes_wait_for_queue(self):
+        '''
+        labels in syncLabels and log messages with files are made on the calling thread, after what was queued before them
+        '''
+        writer = WriteBehindGraceDb(self.client, syncLabels=['EM_READY'])
+        writer.writeLog('G1', 'AP: queued')
+        writer.writeLabel('G1', 'EM_READY')
+        self.assertEqual(writer.pending('G1'), 0)
+        writer.writeLog('G1', 'AP: queued')
+        writer.writeLog('G1', 'AP: with a file', filename='skymap.png', tagname='sky_loc')
+        self.assertEqual(writer.pending('G1'), 0)
+        self.assertEqual([(method, args[0]) for method, graceid, args, kwargs in self.client.calls], [('writeLog', 'AP: queued'),
+                                                                                                      ('writeLabel', 'EM_READY'),
+                                                                                                      ('writeLog', 'AP: queued'),
+                                                                                                      ('writeLog', 'AP: with a file'),
+                                                                                                     ])
+
+#-------------------------------------------------
+
+if __name__=="__main__":
+    unittest.main()
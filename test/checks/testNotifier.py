@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+description = "checks the rate limiting and deduplication of Notifier"
+author = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import os
+import sys
+import time
+import unittest
+
+#-------------------------------------------------
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(thisdir, '..', '..')) ### approval_processorMP uses flat imports between its modules
+
+from notifier import Notifier, MemoryTransport
+
+#-------------------------------------------------
+
+def waitFor(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+class TestNotifier(unittest.TestCase):
+
+    def test_urgent_not_rate_limited(self):
+        '''
+        an advocate page goes out right away even while other emails wait on the rate limit
+        '''
+        transport = MemoryTransport()
+        notifier = Notifier(transport, rate=1, burst=1) ### one email a minute
+        for ind in xrange(3):
+            notifier.notify('G%d'%ind, 'voeventerror-preliminary', 'someone@example.com', 'subject', 'body')
+        self.assertTrue(waitFor(lambda: len(transport.notifications)==1))
+
+        notifier.notify('G9', 'ADVREQ', 'advocate@example.com', 'G9 passed criteria for follow-up', 'body')
+        self.assertTrue(waitFor(lambda: len(transport.notifications)==2))
+        self.assertEqual([notification.reason for notification in transport.notifications], ['voeventerror-preliminary', 'ADVREQ'])
+        self.assertEqual(notifier.pending(), 2)
+
+    def test_dedup(self):
+        transport = MemoryTransport()
+        notifier = Notifier(transport, rate=0, urgent=())
+        self.assertTrue(notifier.notify('G1', 'ADVREQ', 'advocate@example.com', 'subject', 'body'))
+        self.assertFalse(notifier.notify('G1', 'ADVREQ', 'advocate@example.com', 'subject', 'body'))
+        self.assertTrue(notifier.notify('G2', 'ADVREQ', 'advocate@example.com', 'subject', 'body'))
+        notifier.flush()
+        self.assertEqual([notification.graceid for notification in transport.notifications], ['G1', 'G2'])
+        self.assertEqual(notifier.suppressed, 1)
+
+#-------------------------------------------------
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+description = "checks how process_alert and the VOEventDispatcher keep track of VOEvents that are still being sent"
+author = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+import ConfigParser
+
+#-------------------------------------------------
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(thisdir, '..', '..')) ### approval_processorMP uses flat imports between its modules
+sys.path.insert(0, os.path.join(thisdir, '..', 'replay'))
+
+import fakeBackend
+
+#-------------------------------------------------
+# set up the fake backend before approval_processorMP is imported
+#-------------------------------------------------
+
+scratch = tempfile.mkdtemp(prefix='testVOEvents-')
+os.environ['HOME'] = scratch ### saveEventDicts and loadLogger build paths off of the home directory
+os.mkdir(os.path.join(scratch, 'files'))
+
+config = ConfigParser.SafeConfigParser()
+config.read(os.path.join(thisdir, '..', '..', 'etc', 'childConfig-approval_processorMP.ini'))
+config.set('general', 'approval_processorMPfiles', '/files')
+config.set('general', 'approval_processorMP_logfile', '/approval_processorMP.log')
+config.set('general', 'force_all_internal', 'yes')
+config.set('general', 'voevent_transport', 'comet-sendvo') ### so the fake subprocess stands in for Comet
+config.set('general', 'notify_transport', 'memory')
+config.set('labelCheck', 'wait_for_hardware_inj', '0')
+
+raven = fakeBackend.FakeRaven()
+raven.install()
+
+backend    = fakeBackend.FakeGraceDb(config.get('general', 'client'))
+subprocess = fakeBackend.FakeSubprocess()
+
+import approval_processorMPutils
+import eventDictClassMethods
+import voeventDispatcher
+from lvalertMP.lvalert import lvalertMPutils as utils
+
+eventDictClassMethods.graceDbClients[config.get('general', 'client')] = backend
+voeventDispatcher.sp = subprocess
+
+#-------------------------------------------------
+
+def newAlert(graceid, gpstime):
+    '''
+    a "new" lvalert for a CBC event that passes every check on its way to a preliminary VOEvent
+    each event gets its own search so they do not add up in a single PipelineThrottle
+    '''
+    return {'uid':graceid, 'alert_type':'new', 'description':'', 'file':'',
+            'object':{'far':1e-9, 'gpstime':gpstime, 'group':'CBC', 'pipeline':'gstlal', 'search':graceid, 'instruments':'H1,L1', 'labels':{}}}
+
+def idqAlert(graceid, ifo, fap):
+    '''
+    the iDQ log message whose arrival runs the new_to_preliminary checks
+    '''
+    return {'uid':graceid, 'alert_type':'update', 'description':'', 'file':'',
+            'object':{'comment':'minimum glitch-FAP for ovl at %s within 5 seconds of the event is %.2f'%(ifo, fap), 'filename':'', 'issuer':{'display_name':'gdb_processor'}, 'tag_names':[]}}
+
+def labelAlert(graceid, label):
+    return {'uid':graceid, 'alert_type':'label', 'description':label, 'file':''}
+
+class TestVOEvents(unittest.TestCase):
+
+    gpstime = 1170000000.5
+
+    def setUp(self):
+        subprocess.returncode = 0
+        subprocess.latency    = 0.0
+        self.queue = utils.SortedQueue()
+        self.queueByGraceID = {}
+        self.dispatcher = eventDictClassMethods.getVOEventDispatcher(config)
+        self.logger = logging.getLogger('approval_processorMP')
+
+    def tearDown(self):
+        self.dispatcher.flush()
+
+    def alert(self, alert):
+        backend.apply(alert)
+        approval_processorMPutils.parseAlert(self.queue, self.queueByGraceID, alert, time.time(), config)
+
+    def newEvent(self, graceid):
+        '''
+        creates the event_dict for graceid. Nothing is sent until its iDQ log messages arrive, so tests may call process_alert themselves
+        '''
+        TestVOEvents.gpstime += 100
+        self.alert(newAlert(graceid, TestVOEvents.gpstime))
+        return eventDictClassMethods.eventDicts[graceid].data
+
+    def sent(self, graceid):
+        '''
+        the types of the VOEvents created in GraceDb for graceid, in order
+        '''
+        return [voevent['voevent_type'] for voevent in backend.voevents(graceid).json()['voevents']]
+
+    def test_retraction_while_preliminary_is_sent(self):
+        '''
+        EM_Throttled arrives while the preliminary VOEvent is still being sent to a slow Comet
+        '''
+        subprocess.latency = 0.5
+        graceid = 'G2001'
+        self.newEvent(graceid)
+        self.alert(idqAlert(graceid, 'H1', 0.52))
+        self.alert(idqAlert(graceid, 'L1', 0.71))
+        while len(self.queue) and self.queue[0].hasExpired(): ### the HardwareInjectionWait sends the preliminary VOEvent
+            item = self.queue.pop(0)
+            item.execute(verbose=False)
+        self.assertEqual([key[0] for key in self.dispatcher.pending(graceid)], ['preliminary'])
+
+        self.alert(labelAlert(graceid, 'EM_Throttled'))
+        self.assertEqual([key[0] for key in self.dispatcher.pending(graceid)], ['preliminary', 'retraction'])
+
+        self.dispatcher.flush()
+        event_dict = eventDictClassMethods.eventDicts[graceid].data
+        self.assertEqual([voevent.voevent_type for voevent in event_dict['voevents'].records], ['preliminary', 'retraction'])
+        self.assertEqual(self.sent(graceid), ['PR', 'RE'])
+
+    def test_pending_voevent_is_not_resent(self):
+        subprocess.latency = 0.5
+        graceid = 'G2002'
+        event_dict = self.newEvent(graceid)
+        eventDictClassMethods.process_alert(event_dict, 'preliminary', backend, config, self.logger)
+        eventDictClassMethods.process_alert(event_dict, 'preliminary', backend, config, self.logger)
+        self.assertEqual(self.sent(graceid), ['PR'])
+
+        self.dispatcher.flush()
+        self.assertEqual(len(event_dict['voevents']), 1)
+        eventDictClassMethods.process_alert(event_dict, 'preliminary', backend, config, self.logger)
+        self.assertEqual(self.sent(graceid), ['PR'])
+
+    def test_single_retraction_while_pending(self):
+        subprocess.latency = 0.5
+        graceid = 'G2003'
+        event_dict = self.newEvent(graceid)
+        eventDictClassMethods.process_alert(event_dict, 'retraction', backend, config, self.logger)
+        self.assertEqual(self.sent(graceid), []) ### nothing was sent, so there is nothing to retract
+
+        eventDictClassMethods.process_alert(event_dict, 'preliminary', backend, config, self.logger)
+        eventDictClassMethods.process_alert(event_dict, 'retraction', backend, config, self.logger)
+        eventDictClassMethods.process_alert(event_dict, 'retraction', backend, config, self.logger)
+        self.assertEqual(self.sent(graceid), ['PR', 'RE'])
+
+        self.dispatcher.flush()
+        eventDictClassMethods.process_alert(event_dict, 'retraction', backend, config, self.logger)
+        self.assertEqual(self.sent(graceid), ['PR', 'RE'])
+        self.assertEqual([voevent.voevent_type for voevent in event_dict['voevents'].records], ['preliminary', 'retraction'])
+
+    def test_failure_recorded_in_voeventerrors(self):
+        subprocess.returncode = 1
+        graceid = 'G2004'
+        event_dict = self.newEvent(graceid)
+        response = eventDictClassMethods.process_alert(event_dict, 'preliminary', backend, config, self.logger, wait=True)
+        self.assertTrue(response.startswith('voeventerrors, '))
+        self.assertEqual(len(event_dict['voevents']), 0)
+        self.assertTrue(event_dict['voeventerrors'].hasType('preliminary'))
+        self.assertEqual(self.dispatcher.pending(graceid), [])
+
+        notifier = eventDictClassMethods.getNotifier(config)
+        notifier.flush()
+        self.assertTrue((graceid, 'voeventerror-preliminary') in [(notification.graceid, notification.reason) for notification in notifier.transport.notifications])
+
+        ### a failed VOEvent may be sent again, and once it goes out the error is forgotten
+        subprocess.returncode = 0
+        response = eventDictClassMethods.process_alert(event_dict, 'preliminary', backend, config, self.logger, wait=True)
+        self.assertTrue(response.startswith('voevents, '))
+        self.assertFalse(event_dict['voeventerrors'].hasType('preliminary'))
+        self.assertEqual(self.sent(graceid), ['PR', 'PR'])
+
+    def test_wait_returns_voevent(self):
+        subprocess.latency = 0.1
+        graceid = 'G2005'
+        event_dict = self.newEvent(graceid)
+        response = eventDictClassMethods.process_alert(event_dict, 'preliminary', backend, config, self.logger, wait=True)
+        self.assertEqual(self.dispatcher.pending(graceid), [])
+        self.assertEqual(response, 'voevents, {0}'.format(event_dict['voevents'].last))
+        self.assertEqual(event_dict['voevents'].last.voevent_type, 'preliminary')
+
+#-------------------------------------------------
+
+if __name__=="__main__":
+    try:
+        unittest.main()
+    finally:
+        shutil.rmtree(scratch)
@@ -0,0 +1,236 @@
+description = "in-process stand-ins for GraceDb, raven and comet used when replaying recorded lvalerts through approval_processorMP"
+author = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import sys
+import imp
+import copy
+import json
+import time
+
+#-------------------------------------------------
+# responses
+#-------------------------------------------------
+
+class FakeResponse(object):
+    '''
+    mimics the response objects returned by ligo.gracedb.rest.GraceDb
+    '''
+    def __init__(self, payload, status=200):
+        self.status  = status
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def read(self):
+        return json.dumps(self.payload)
+
+#-------------------------------------------------
+# GraceDb
+#-------------------------------------------------
+
+### maps the voevent_type passed to createVOEvent onto the codes GraceDb reports
+__voeventCodes__ = {'preliminary':'PR',
+                    'initial'    :'IN',
+                    'update'     :'UP',
+                    'retraction' :'RE',
+                   }
+
+__voeventTemplate__ = '''<?xml version='1.0' encoding='UTF-8'?>
+<voe:VOEvent xmlns:voe="http://www.ivoa.net/xml/VOEvent/v2.0" ivorn="{ivorn}" role="observation" version="2.0">
+  <What>
+    <Param name="internal" dataType="int" value="{internal}"/>
+    <Param name="Vetted" dataType="int" value="{vetted}"/>
+    <Param name="OpenAlert" dataType="int" value="{open_alert}"/>
+    <Param name="HardwareInj" dataType="int" value="{hardware_inj}"/>
+{skymap}  </What>
+</voe:VOEvent>
+'''
+
+__skymapTemplate__ = '''    <Param name="skymap_fits_basic" dataType="string" value="{service_url}events/{graceid}/files/{skymap}"/>
+'''
+
+class FakeGraceDb(object):
+    '''
+    an in-memory GraceDb that knows just enough of the REST interface to satisfy approval_processorMP
+    state is filled in by apply() as recorded lvalerts are replayed and by the writes approval_processorMP makes itself
+
+    every call is counted in self.calls so the replay can report how many round trips each alert would have cost
+    '''
+    def __init__(self, service_url='https://gracedb.fake/api/', latency=0.0):
+        self.service_url = service_url
+        self.latency     = latency ### seconds slept per call to emulate a network round trip
+
+        self.templates = {'signoff-list-template':'signoffs/{graceid}'}
+
+        self.__events__   = {}
+        self.__logs__     = {}
+        self.__voevents__ = {}
+        self.__signoffs__ = {}
+
+        self.calls = {}
+
+    def __call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    #------------------------
+    # feeding state from the replay
+    #------------------------
+
+    def apply(self, alert):
+        '''
+        updates local state so it reflects what GraceDb would have known when this lvalert was sent
+        '''
+        graceid    = alert['uid']
+        alert_type = alert.get('alert_type')
+        if graceid=='command':
+            return
+
+        if alert_type=='new':
+            event = copy.deepcopy(alert['object'])
+            event.setdefault('labels', {})
+            event['graceid'] = graceid
+            self.__events__[graceid] = event
+
+        elif alert_type=='label':
+            self.__event(graceid)['labels'][alert['description']] = ''
+
+        elif alert_type=='update' and alert.has_key('object'):
+            log = copy.deepcopy(alert['object'])
+            log.setdefault('comment', '')
+            log.setdefault('filename', alert.get('file', ''))
+            log.setdefault('tag_names', [])
+            log.setdefault('issuer', {'display_name':'replay'})
+            self.__log(graceid).append(log)
+
+        elif alert_type=='signoff':
+            self.__signoffs__.setdefault(graceid, []).append(copy.deepcopy(alert['object']))
+
+    def __event(self, graceid):
+        if not self.__events__.has_key(graceid): ### we only ever heard about this event through a non-new alert
+            self.__events__[graceid] = {'graceid':graceid, 'far':None, 'gpstime':0.0, 'group':'', 'pipeline':'', 'search':'', 'instruments':'', 'labels':{}}
+        return self.__events__[graceid]
+
+    def __log(self, graceid):
+        return self.__logs__.setdefault(graceid, [])
+
+    #------------------------
+    # read interface
+    #------------------------
+
+    def events(self, query=None, orderby=None, count=None, columns=None):
+        self.__call('events')
+        if self.__events__.has_key(query):
+            yield copy.deepcopy(self.__events__[query])
+
+    def logs(self, graceid):
+        self.__call('logs')
+        return FakeResponse({'log':copy.deepcopy(self.__log(graceid))})
+
+    def voevents(self, graceid):
+        self.__call('voevents')
+        return FakeResponse({'voevents':copy.deepcopy(self.__voevents__.get(graceid, []))})
+
+    def get(self, url, headers=None):
+        self.__call('get')
+        graceid = url.split('/')[-1]
+        return FakeResponse({'signoff':copy.deepcopy(self.__signoffs__.get(graceid, []))})
+
+    #------------------------
+    # write interface
+    #------------------------
+
+    def writeLog(self, graceid, message, filename=None, filecontents=None, tagname=None, displayName=None):
+        self.__call('writeLog')
+        if isinstance(tagname, basestring):
+            tagname = [tagname]
+        self.__log(graceid).append({'comment':message, 'filename':filename or '', 'tag_names':tagname or [], 'issuer':{'display_name':'approval_processorMP'}})
+        return FakeResponse({})
+
+    def writeLabel(self, graceid, label):
+        self.__call('writeLabel')
+        self.__event(graceid)['labels'][label] = ''
+        return FakeResponse({})
+
+    def createVOEvent(self, graceid, voevent_type, skymap_filename=None, internal=1, vetted=0, open_alert=0, hardware_inj=0, **kwargs):
+        self.__call('createVOEvent')
+        voevents = self.__voevents__.setdefault(graceid, [])
+        if skymap_filename:
+            skymap = __skymapTemplate__.format(service_url=self.service_url, graceid=graceid, skymap=skymap_filename)
+        else:
+            skymap = ''
+        ivorn = 'ivo://gwnet/LVC#%s-%d-%s'%(graceid, len(voevents)+1, __voeventCodes__[voevent_type])
+        text = __voeventTemplate__.format(ivorn=ivorn,
+                                          internal=internal, vetted=vetted, open_alert=open_alert, hardware_inj=hardware_inj, skymap=skymap)
+        voevent = {'N':len(voevents)+1, 'ivorn':ivorn, 'voevent_type':__voeventCodes__[voevent_type], 'text':text}
+        voevents.append(voevent)
+        return FakeResponse(copy.deepcopy(voevent))
+
+#-------------------------------------------------
+# raven
+#-------------------------------------------------
+
+class FakeRaven(object):
+    '''
+    answers raven.search.query from a fixed list of hardware injection gpstimes
+    '''
+    def __init__(self, injections=[], latency=0.0):
+        self.injections = sorted(injections)
+        self.latency    = latency
+        self.calls      = 0
+
+    def query(self, event_type, gpstime, tl, th, *args, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [{'graceid':'H%d'%i, 'gpstime':t} for i, t in enumerate(self.injections) if gpstime+tl <= t <= gpstime+th]
+
+    def install(self):
+        '''
+        registers this object as raven.search so the import inside EventDict.injectionCheck finds it
+        '''
+        raven = imp.new_module('raven')
+        search = imp.new_module('raven.search')
+        search.query = self.query
+        raven.search = search
+        sys.modules['raven'] = raven
+        sys.modules['raven.search'] = search
+
+#-------------------------------------------------
+# comet-sendvo
+#-------------------------------------------------
+
+class FakePopen(object):
+    '''
+    stands in for subprocess.Popen when the comet-sendvo transport pipes a VOEvent into comet-sendvo
+    '''
+    def __init__(self, cmd, returncode=0, latency=0.0, **kwargs):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.latency = latency
+
+    def communicate(self, input=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return '', ''
+
+class FakeSubprocess(object):
+    '''
+    replaces the subprocess module within voeventDispatcher
+    Popen may be called from several dispatcher threads at once; list.append is atomic, so commands stays consistent
+    returncode and latency (seconds each send takes) may be changed between sends
+    '''
+    PIPE = -1
+
+    def __init__(self, returncode=0, latency=0.0):
+        self.returncode = returncode
+        self.latency    = latency
+        self.commands   = []
+
+    def Popen(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        return FakePopen(cmd, returncode=self.returncode, latency=self.latency, **kwargs)
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+usage       = "replayAlerts.py [--options] alerts.json [alerts.json ...]"
+description = "replays recorded lvalert JSON streams through approval_processorMPutils.parseAlert against an in-process fake GraceDb, raven and comet and reports how long each alert took"
+author      = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import os
+import sys
+import json
+import shutil
+import logging
+import tempfile
+import traceback
+import ConfigParser
+
+import time
+import timeit
+
+import numpy as np
+
+from optparse import OptionParser
+
+#-------------------------------------------------
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(thisdir, '..', '..')) ### approval_processorMP uses flat imports between its modules
+sys.path.insert(0, thisdir)
+
+import fakeBackend
+
+#-------------------------------------------------
+
+def parseCommandLine():
+    parser = OptionParser(usage=usage, description=description)
+
+    parser.add_option('-c', '--config', default=os.path.join(thisdir, '..', '..', 'etc', 'childConfig-approval_processorMP.ini'), type='string', help='the childConfig to replay against. DEFAULT=the one shipped in etc/')
+
+    parser.add_option('', '--wait-for-hardware-inj', default=0, type='float', help='overrides [labelCheck] wait_for_hardware_inj. new_to_preliminary checks are deferred by this much and only run if they come due before the replay (plus --drain) ends. DEFAULT=0')
+    parser.add_option('', '--gracedb-latency', default=0, type='float', help='seconds the fake GraceDb sleeps per call to emulate network round trips. DEFAULT=0')
+    parser.add_option('', '--raven-latency', default=0, type='float', help='seconds the fake raven query sleeps per call. DEFAULT=0')
+    parser.add_option('', '--injection', default=[], type='float', action='append', help='gpstime of a hardware injection reported by the fake raven. Can be repeated')
+    parser.add_option('', '--comet-returncode', default=0, type='int', help='returncode reported by the fake comet-sendvo. DEFAULT=0')
+    parser.add_option('', '--comet-latency', default=0, type='float', help='seconds the fake comet-sendvo takes per VOEvent. DEFAULT=0')
+
+    parser.add_option('', '--drain', default=0, type='float', help='after the last alert, keep executing QueueItems that expire within this many seconds. DEFAULT=0')
+    parser.add_option('', '--memory-cadence', default=1, type='int', help='measure the size of eventDicts/eventDictionaries every this many alerts. DEFAULT=1')
+
+    parser.add_option('', '--restart-after', default=[], type='int', action='append', help='emulate restarting approval_processorMP after this many alerts: in-memory state is dropped and must be rebuilt from disk (see [general] warmstart_horizon) or GraceDb. Can be repeated')
+    parser.add_option('', '--keep-files', default=False, action='store_true', help='do not delete the scratch directory holding EventDicts.* and the log')
+    parser.add_option('-v', '--verbose', default=False, action='store_true')
+
+    opts, args = parser.parse_args()
+
+    if not args:
+        raise ValueError('please supply at least one file of recorded lvalerts\n%s'%usage)
+
+    return opts, args
+
+#-------------------------------------------------
+
+def readAlerts(filenames):
+    '''
+    reads recorded lvalerts, one JSON object per line. Blank lines and lines starting with '#' are ignored
+    '''
+    alerts = []
+    for filename in filenames:
+        file_obj = open(filename, 'r')
+        for line in file_obj:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                alerts.append(json.loads(line))
+        file_obj.close()
+    return alerts
+
+def prepareConfig(opts, scratch):
+    '''
+    reads the childConfig and points everything that touches disk into the scratch directory
+    '''
+    config = ConfigParser.SafeConfigParser()
+    config.read(opts.config)
+
+    os.environ['HOME'] = scratch ### saveEventDicts and loadLogger build paths off of the home directory
+    os.mkdir(os.path.join(scratch, 'files'))
+    config.set('general', 'approval_processorMPfiles', '/files')
+    config.set('general', 'approval_processorMP_logfile', '/approval_processorMP.log')
+    config.set('labelCheck', 'wait_for_hardware_inj', '%f'%opts.wait_for_hardware_inj)
+    config.set('general', 'voevent_transport', 'comet-sendvo') ### so the fake subprocess stands in for Comet
+    config.set('general', 'notify_transport', 'memory') ### emails are counted rather than sent
+
+    return config
+
+#-------------------------------------------------
+
+def sizeof(obj, seen=None):
+    '''
+    a recursive sys.getsizeof that walks containers and instances, counting each object once
+    objects whose ids are already in seen are not counted, which is how we skip things every event shares (client, config, logger)
+    '''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(key, seen) + sizeof(val, seen) for key, val in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += sizeof(obj.__dict__, seen)
+    if hasattr(obj, '__slots__'):
+        size += sum(sizeof(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    return size
+
+def drainQueue(queue, queueByGraceID, timer, latencies):
+    '''
+    executes expired QueueItems much like lvalertMP's interactiveQueue does between alerts
+    each execution is timed and recorded under "queue:<item.name>"
+    '''
+    while len(queue) and queue[0].hasExpired():
+        item = queue.pop(0)
+        if item.complete: ### already marked complete elsewhere
+            continue
+
+        start = timer()
+        item.execute(verbose=False)
+        latencies.setdefault('queue:%s'%item.name, []).append(timer()-start)
+
+        if item.complete:
+            if queueByGraceID.has_key(item.graceid):
+                sortedQueue = queueByGraceID[item.graceid]
+                for ind, other in enumerate(sortedQueue):
+                    if other is item:
+                        sortedQueue.pop(ind)
+                        break
+                if not len(sortedQueue):
+                    queueByGraceID.pop(item.graceid)
+        else:
+            queue.insert(item)
+
+def restart(modules, config):
+    '''
+    drops everything approval_processorMP holds in memory, as if the process had been restarted
+    only what was written to the scratch directory survives. Returns a new (queue, queueByGraceID)
+    '''
+    approval_processorMPutils, eventDictClassMethods, utils = modules
+    eventDictClassMethods.getVOEventDispatcher(config).flush() ### a clean shutdown lets the VOEvents in flight finish
+    for writer in eventDictClassMethods.writeBehindClients.values():
+        writer.flush() ### and the log messages and labels still being written
+    for notifier in eventDictClassMethods.notifiers.values():
+        notifier.flush() ### and the emails
+    for journal in eventDictClassMethods.eventDictJournals.values():
+        if journal.compactor:
+            journal.compactor.join()
+    eventDictClassMethods.eventDictJournals.clear()
+    eventDictClassMethods.throttleJournals.clear()
+    eventDictClassMethods.eventDicts.clear()
+    eventDictClassMethods.eventDictionaries.clear()
+    eventDictClassMethods.logCache.clear()
+    approval_processorMPutils.warmStarted = False
+    return utils.SortedQueue(), {}
+
+def report(latencies, walltime, nalerts, peakMemory, backend, raven, subprocess, mail):
+    '''
+    prints per alert_type latency percentiles, throughput and peak memory
+    '''
+    print '%-28s %6s %10s %10s %10s %10s'%('alert_type', 'count', 'p50 [ms]', 'p90 [ms]', 'p99 [ms]', 'max [ms]')
+    for alert_type in sorted(latencies.keys()):
+        samples = 1e3*np.array(latencies[alert_type])
+        p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+        print '%-28s %6d %10.3f %10.3f %10.3f %10.3f'%(alert_type, len(samples), p50, p90, p99, np.max(samples))
+    print ''
+    print 'alerts     : %d in %.3f sec -> %.1f alerts/sec'%(nalerts, walltime, nalerts/walltime if walltime else np.infty)
+    print 'peak memory: eventDicts %.1f kB, eventDictionaries %.1f kB'%(peakMemory['eventDicts']/1024., peakMemory['eventDictionaries']/1024.)
+    print 'GraceDb    : %s'%(', '.join('%s=%d'%(key, backend.calls[key]) for key in sorted(backend.calls.keys())) or 'no calls')
+    print 'raven      : %d queries'%(raven.calls)
+    print 'comet      : %d sends'%(len(subprocess.commands))
+    print 'mail       : %d messages'%(len(mail))
+
+#-------------------------------------------------
+
+if __name__=="__main__":
+    opts, args = parseCommandLine()
+
+    alerts = readAlerts(args)
+
+    scratch = tempfile.mkdtemp(prefix='replayAlerts-')
+    try:
+        config = prepareConfig(opts, scratch)
+
+        ### set up the fake backend before approval_processorMP is imported
+        raven = fakeBackend.FakeRaven(opts.injection, latency=opts.raven_latency)
+        raven.install()
+
+        backend    = fakeBackend.FakeGraceDb(config.get('general', 'client'), latency=opts.gracedb_latency)
+        subprocess = fakeBackend.FakeSubprocess(returncode=opts.comet_returncode, latency=opts.comet_latency)
+
+        import approval_processorMPutils
+        import eventDictClassMethods
+        import voeventDispatcher
+        import queueItemsAndTasks
+        from lvalertMP.lvalert import lvalertMPutils as utils
+
+        ### the shared GraceDb client handed out by getGraceDb is the fake
+        eventDictClassMethods.graceDbClients[config.get('general', 'client')] = backend
+        voeventDispatcher.sp              = subprocess
+
+        queue = utils.SortedQueue()
+        queueByGraceID = {}
+
+        timer = timeit.default_timer
+        latencies = {}
+        errors = 0
+        peakMemory = {'eventDicts':0, 'eventDictionaries':0}
+
+        start = timer()
+        for ind, alert in enumerate(alerts):
+            if ind in opts.restart_after:
+                queue, queueByGraceID = restart((approval_processorMPutils, eventDictClassMethods, utils), config)
+
+            backend.apply(alert)
+
+            t0 = timer()
+            try:
+                approval_processorMPutils.parseAlert(queue, queueByGraceID, alert, time.time(), config)
+            except Exception: ### record the failure and keep replaying
+                errors += 1
+                if opts.verbose:
+                    traceback.print_exc()
+            latencies.setdefault(alert.get('alert_type', 'command'), []).append(timer()-t0)
+
+            drainQueue(queue, queueByGraceID, timer, latencies)
+
+            if (ind+1)%opts.memory_cadence==0:
+                shared = set([id(backend), id(config), id(logging.getLogger('approval_processorMP'))]) ### referenced by every EventDict, not owned by any
+                shared.update(id(writer) for writer in eventDictClassMethods.writeBehindClients.values())
+                peakMemory['eventDicts']        = max(peakMemory['eventDicts'], sizeof(eventDictClassMethods.eventDicts, seen=set(shared)))
+                peakMemory['eventDictionaries'] = max(peakMemory['eventDictionaries'], sizeof(eventDictClassMethods.eventDictionaries, seen=set(shared)))
+
+            if opts.verbose:
+                print '%s %s %.3f ms'%(alert['uid'], alert.get('alert_type', 'command'), 1e3*latencies[alert.get('alert_type', 'command')][-1])
+
+        ### give deferred work a chance to run
+        end = time.time() + opts.drain
+        while len(queue) and queue[0].expiration <= end:
+            time.sleep(max(0, queue[0].expiration - time.time()))
+            drainQueue(queue, queueByGraceID, timer, latencies)
+        getVOEventDispatcher = eventDictClassMethods.getVOEventDispatcher
+        getVOEventDispatcher(config).flush() ### wait for VOEvents still being sent in the background
+        for writer in eventDictClassMethods.writeBehindClients.values():
+            writer.flush() ### and for log messages and labels still being written
+        mail = []
+        for notifier in eventDictClassMethods.notifiers.values():
+            notifier.flush() ### and for emails still being sent
+            mail += notifier.transport.notifications
+        walltime = timer() - start
+
+        report(latencies, walltime, len(alerts), peakMemory, backend, raven, subprocess, mail)
+        if errors:
+            print 'errors     : %d alerts raised exceptions (rerun with --verbose for tracebacks)'%errors
+
+    finally:
+        if opts.keep_files:
+            print 'scratch files kept in %s'%scratch
+        else:
+            shutil.rmtree(scratch)
@@ -0,0 +1,268 @@
+description = "a module that sends VOEvents to the local Comet broker from background threads so approval_processorMP does not wait on them"
+author = "Min-A Cho (mina19@umd.edu)"
+
+#-------------------------------------------------
+
+import socket
+import select
+import struct
+import threading
+import traceback
+import Queue
+
+import subprocess as sp
+
+from xml.etree import ElementTree
+
+#-------------------------------------------------
+# Transports
+# each knows how to hand a single VOEvent to Comet and returns (success, message)
+#-------------------------------------------------
+
+class VTPTransport(object):
+    """
+    speaks the VOEvent Transport Protocol directly to the Comet broker: every message is a 4 byte, network ordered length followed by the xml.
+    Comet answers with a Transport message whose role is either "ack" or "nak".
+
+    the connection is kept open between VOEvents and reused if the broker has not closed it in the meantime.
+    if a reused connection turns out to be dead, we reconnect and try once more.
+    """
+    __header__ = struct.Struct('!I')
+
+    def __init__(self, host='127.0.0.1', port=5340, timeout=30):
+        self.host    = host
+        self.port    = port
+        self.timeout = timeout
+        self.sock    = None
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+        self.sock = None
+
+    def __isAlive__(self):
+        '''
+        the broker never sends anything unprompted, so a readable socket means it was closed (or is in a bad state)
+        '''
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return True
+        try:
+            return bool(self.sock.recv(1, socket.MSG_PEEK))
+        except socket.error:
+            return False
+
+    def __connect__(self):
+        if (self.sock is not None) and (not self.__isAlive__()):
+            self.close()
+        reused = self.sock is not None
+        if not reused:
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        return reused
+
+    def __recvall__(self, size):
+        data = ''
+        while len(data) < size:
+            chunk = self.sock.recv(size-len(data))
+            if not chunk:
+                raise socket.error('connection closed by %s:%d'%(self.host, self.port))
+            data += chunk
+        return data
+
+    def __exchange__(self, voevent):
+        self.sock.sendall(self.__header__.pack(len(voevent)) + voevent)
+        size, = self.__header__.unpack(self.__recvall__(self.__header__.size))
+        return self.__recvall__(size)
+
+    def send(self, voevent):
+        '''
+        returns (True, '') if Comet acknowledged the VOEvent and (False, reason) otherwise
+        '''
+        if isinstance(voevent, unicode):
+            voevent = voevent.encode('utf-8')
+        try:
+            reused = self.__connect__()
+            try:
+                response = self.__exchange__(voevent)
+            except socket.error:
+                self.close() ### never reuse a connection that failed
+                if not reused:
+                    raise
+                self.__connect__() ### the connection we reused had gone stale; try once on a fresh one
+                response = self.__exchange__(voevent)
+        except socket.error, e:
+            self.close()
+            return False, 'could not reach Comet at %s:%d: %s'%(self.host, self.port, str(e))
+
+        try:
+            role = ElementTree.fromstring(response).get('role')
+        except ElementTree.ParseError:
+            role = None
+        if role=='ack':
+            return True, ''
+        return False, 'Comet replied with role=%s: %s'%(role, response)
+
+class CometSendvoTransport(object):
+    """
+    pipes the VOEvent into comet-sendvo on stdin. No shell and no temporary file are involved.
+    This costs a process spawn per VOEvent, but that cost is paid on a worker thread rather than in parseAlert
+    """
+    def __init__(self, host='127.0.0.1', port=5340, executable='comet-sendvo'):
+        self.host       = host
+        self.port       = port
+        self.executable = executable
+
+    def close(self):
+        pass
+
+    def send(self, voevent):
+        if isinstance(voevent, unicode):
+            voevent = voevent.encode('utf-8')
+        cmd = [self.executable, '--host', self.host, '--port', str(self.port)]
+        try:
+            proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+            output, error = proc.communicate(voevent)
+        except OSError, e:
+            return False, str(e)
+        if proc.returncode==0:
+            return True, ''
+        return False, error
+
+transports = {
+    'vtp'          : VTPTransport,
+    'comet-sendvo' : CometSendvoTransport,
+}
+
+#-------------------------------------------------
+# Dispatcher
+#-------------------------------------------------
+
+class VOEventJob(object):
+    """
+    a single VOEvent handed to the dispatcher
+
+    report(job) is called from the worker thread as soon as the send has finished. It should only have side effects outside
+    of approval_processorMP's own data structures (logging, writing to GraceDb, sending emails).
+    record(job) is called from whichever thread calls VOEventDispatcher.deliver() and is where local bookkeeping (voevents, voeventerrors) is updated.
+    """
+    def __init__(self, graceid, key, voevent, report=None, record=None):
+        self.graceid = graceid
+        self.key     = key ### what the caller uses to recognize repeats of this VOEvent
+        self.voevent = voevent
+        self.report  = report
+        self.record  = record
+
+        self.success = None
+        self.message = None
+        self.result  = None ### whatever record returns
+
+        self.sent      = threading.Event() ### set once the worker is done with this job
+        self.delivered = False
+
+class VOEventDispatcher(object):
+    """
+    sends VOEvents from a small pool of worker threads, each with its own transport (and therefore its own connection to Comet).
+    jobs are assigned to workers by graceid, so VOEvents for a single event are always sent in the order they were submitted.
+
+    finished jobs wait in self.completed until deliver() is called, which lets the caller update event_dicts from its own thread.
+    until a job is delivered its key is reported by pending(), so callers can avoid sending the same VOEvent twice.
+    """
+    def __init__(self, transport, workers=1):
+        self.workers = []
+        self.completed = Queue.Queue()
+
+        self.lock = threading.Lock()
+        self.__pending__ = {} ### graceid -> [job, job, ...] that have not been delivered yet
+
+        for ind in xrange(max(1, workers)):
+            jobs = Queue.Queue()
+            thread = threading.Thread(target=self.__work__, args=(jobs, transport()), name='VOEventDispatcher-%d'%ind)
+            thread.daemon = True
+            thread.start()
+            self.workers.append( jobs )
+
+    def __work__(self, jobs, transport):
+        while True:
+            job = jobs.get()
+            try:
+                job.success, job.message = transport.send(job.voevent)
+            except Exception, e: ### a worker must never die, otherwise every later job assigned to it would hang
+                transport.close()
+                job.success, job.message = False, str(e)
+            if job.report:
+                try:
+                    job.report(job)
+                except Exception: ### reporting is best effort, the job must still be delivered
+                    traceback.print_exc()
+            self.completed.put(job)
+            job.sent.set()
+            jobs.task_done()
+
+    def submit(self, graceid, key, voevent, report=None, record=None):
+        '''
+        queues a VOEvent for sending and returns the corresponding VOEventJob
+        '''
+        job = VOEventJob(graceid, key, voevent, report=report, record=record)
+        self.lock.acquire()
+        try:
+            self.__pending__.setdefault(graceid, []).append(job)
+        finally:
+            self.lock.release()
+        self.workers[hash(graceid)%len(self.workers)].put(job)
+        return job
+
+    def pending(self, graceid):
+        '''
+        returns the keys of all jobs for graceid that have not been delivered yet, in the order they were submitted
+        '''
+        self.lock.acquire()
+        try:
+            return [job.key for job in self.__pending__.get(graceid, [])]
+        finally:
+            self.lock.release()
+
+    def deliver(self):
+        '''
+        calls record(job) for every job that has finished since the last call, on the calling thread
+        returns the number of jobs delivered
+        '''
+        delivered = 0
+        while True:
+            try:
+                job = self.completed.get_nowait()
+            except Queue.Empty:
+                break
+            if job.record:
+                job.result = job.record(job)
+            job.delivered = True
+
+            self.lock.acquire()
+            try:
+                jobs = self.__pending__[job.graceid]
+                jobs.remove(job)
+                if not jobs:
+                    self.__pending__.pop(job.graceid)
+            finally:
+                self.lock.release()
+            delivered += 1
+        return delivered
+
+    def wait(self, job):
+        '''
+        blocks until job has been sent and delivered, then returns job.result
+        '''
+        job.sent.wait()
+        while not job.delivered:
+            self.deliver()
+        return job.result
+
+    def flush(self):
+        '''
+        blocks until every submitted job has been sent, then delivers them all
+        '''
+        for jobs in self.workers:
+            jobs.join()
+        return self.deliver()